@@ -0,0 +1,352 @@
+"""
+Microbenchmarks for the ffmpeg stages of video_prepare, run against reproducible synthetic camera footage.
+
+Footage is generated with ffmpeg's lavfi testsrc2 source at the cameras' frame rate (10 fps): clips of 95, 100 and 105
+frames, like the short, exact and long clips cameras upload, and a truncated clip like a failed download. Each
+transcode function and a full StreamingGenerator run is timed and the results are written as JSON. prepare_hls is also
+timed with an ABR ladder (--renditions), the difference to plain prepare_hls is the cost of the renditions:
+
+    python benchmarks/ffmpeg_stages.py --output results.json
+    python benchmarks/ffmpeg_stages.py --output after.json --baseline results.json
+
+For every stage the wall time, CPU-seconds (this process and its ffmpeg children), frames per second and bytes written
+are recorded for each run, along with the median run.
+"""
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import ffmpeg
+import pytz
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from video_prepare import const, transcode, util
+from video_prepare.streaming_generator import StreamingGenerator
+
+FPS = 10
+CLIP_FRAMES = {"short": 95, "exact": 100, "long": 105}
+
+
+def generate_clip(path, frames, width, height):
+    ffmpeg.input(f"testsrc2=size={width}x{height}:rate={FPS}", format="lavfi").output(
+        path, vframes=frames, vcodec="libx264", pix_fmt="yuv420p", g=FPS * 10, r=FPS, preset="veryfast"
+    ).global_args("-loglevel", "warning").overwrite_output().run()
+
+
+def generate_corrupt_clip(source_path, path):
+    """
+    Copy the first half of a clip, like a download that was cut off. The moov atom is lost.
+    """
+    with open(source_path, "rb") as source, open(path, "wb") as destination:
+        destination.write(source.read(os.path.getsize(source_path) // 2))
+
+
+def generate_footage(footage_directory, width, height):
+    """
+    :return: dict of clip kind ("short", "exact", "long", "corrupt") to path
+    """
+    clips = {}
+    for kind, frames in CLIP_FRAMES.items():
+        clips[kind] = os.path.join(footage_directory, f"{kind}_{frames}.mp4")
+        generate_clip(clips[kind], frames, width, height)
+
+    clips["corrupt"] = os.path.join(footage_directory, "corrupt.mp4")
+    generate_corrupt_clip(clips["exact"], clips["corrupt"])
+    return clips
+
+
+def directory_bytes(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(fn, frames, output_directory):
+    """
+    Run fn, which writes its output into output_directory, and measure it
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    bytes_before = directory_bytes(output_directory)
+    cpu_before = cpu_seconds()
+    wall_before = time.perf_counter()
+
+    fn()
+
+    wall_seconds = time.perf_counter() - wall_before
+    return {
+        "wall_seconds": round(wall_seconds, 4),
+        "cpu_seconds": round(cpu_seconds() - cpu_before, 4),
+        "frames": frames,
+        "frames_per_second": round(frames / wall_seconds, 2) if wall_seconds > 0 else None,
+        "bytes_written": directory_bytes(output_directory) - bytes_before,
+    }
+
+
+def write_concat_list(path, clip_paths):
+    with open(path, "w", encoding="utf-8") as fp:
+        for clip_path in clip_paths:
+            fp.write(f"file '{clip_path}'\n")
+
+
+def stage_benchmarks(clips, work_directory, concat_clips, renditions):
+    """
+    :param renditions: ABR ladder for the prepare_hls_renditions stage, list of {"height": int, "bitrate": str} dicts
+    :return: dict of stage name to a function that runs the stage once in the given run directory and returns its
+             measurements
+    """
+    concat_frames = concat_clips * CLIP_FRAMES["exact"]
+
+    def _concat_input(run_directory):
+        concat_list_path = os.path.join(run_directory, "concat.txt")
+        write_concat_list(concat_list_path, [clips["exact"]] * concat_clips)
+        return concat_list_path
+
+    # The HLS and preview stages read one shared concatenated video
+    concatenated_path = os.path.join(work_directory, "concatenated.mp4")
+    transcode.concat_videos(_concat_input(work_directory), concatenated_path, rewrite=True)
+
+    def _trim(run_directory):
+        output_path = os.path.join(run_directory, "trimmed.mp4")
+        return measure(lambda: transcode.trim_video(clips["long"], output_path), CLIP_FRAMES["long"], run_directory)
+
+    def _pad(run_directory):
+        output_path = os.path.join(run_directory, "padded.mp4")
+        frames = CLIP_FRAMES["exact"] - CLIP_FRAMES["short"]
+        return measure(
+            lambda: transcode.pad_video(clips["short"], output_path, frames), CLIP_FRAMES["exact"], run_directory
+        )
+
+    def _concat(run_directory):
+        concat_list_path = _concat_input(run_directory)
+        output_path = os.path.join(run_directory, "output.mp4")
+        return measure(
+            lambda: transcode.concat_videos(concat_list_path, output_path, rewrite=True), concat_frames, run_directory
+        )
+
+    def _validate(run_directory):
+        paths = [clips[kind] for kind in ["short", "exact", "long", "corrupt"]]
+        return measure(
+            lambda: transcode.validate_videos(paths, level=transcode.VALIDATION_PACKETS),
+            sum(CLIP_FRAMES.values()),
+            run_directory,
+        )
+
+    def _hls(run_directory):
+        output_path = os.path.join(run_directory, "output.m3u8")
+        return measure(
+            lambda: transcode.prepare_hls(concatenated_path, output_path, rewrite=True), concat_frames, run_directory
+        )
+
+    def _hls_renditions(run_directory):
+        output_path = os.path.join(run_directory, "output.m3u8")
+        return measure(
+            lambda: transcode.prepare_hls(concatenated_path, output_path, rewrite=True, renditions=renditions),
+            concat_frames,
+            run_directory,
+        )
+
+    def _preview(run_directory):
+        output_path = os.path.join(run_directory, "output-preview.jpg")
+        return measure(
+            lambda: transcode.generate_preview_image(concatenated_path, output_path, rewrite=True), 1, run_directory
+        )
+
+    return {
+        "trim_video": _trim,
+        "pad_video": _pad,
+        "concat_videos": _concat,
+        "validate_videos": _validate,
+        "prepare_hls": _hls,
+        "prepare_hls_renditions": _hls_renditions,
+        "generate_preview_image": _preview,
+    }
+
+
+def streaming_generator_benchmark(clips, work_directory, camera_clips):
+    """
+    A camera's worth of clips in raw video storage: mostly exact clips with short, long and corrupt clips mixed in and
+    a missing clip, run through a full StreamingGenerator
+    """
+    start = datetime.datetime(2023, 1, 1, 9, 0, tzinfo=pytz.UTC)
+    raw_directory = os.path.join(work_directory, "raw")
+    os.makedirs(raw_directory, exist_ok=True)
+
+    kinds = ["exact", "short", "exact", "long", "exact", "corrupt", "exact", None]
+    video_metadata = []
+    for index in range(camera_clips):
+        kind = kinds[index % len(kinds)]
+        if kind is None:
+            continue
+
+        path = f"camera/{index:05d}.mp4"
+        os.makedirs(os.path.dirname(os.path.join(raw_directory, path)), exist_ok=True)
+        shutil.copy(clips[kind], os.path.join(raw_directory, path))
+        video_metadata.append(
+            {
+                "data_id": f"clip-{index:05d}",
+                "path": path,
+                "video_timestamp": (start + datetime.timedelta(seconds=10 * index)).isoformat(),
+            }
+        )
+
+    end = start + datetime.timedelta(seconds=10 * camera_clips)
+    frames = camera_clips * CLIP_FRAMES["exact"]
+
+    def _run(run_directory, **generator_options):
+        output_directory = os.path.join(run_directory, "camera")
+        os.makedirs(output_directory, exist_ok=True)
+        empty_clip_path = const.empty_clip_path(run_directory)
+        transcode.copy_technical_difficulties_clip(clip_path=empty_clip_path, output_path=empty_clip_path)
+
+        def _execute():
+            StreamingGenerator(
+                video_metadata=[dict(m) for m in video_metadata],
+                start=start,
+                end=end,
+                output_directory=output_directory,
+                empty_clip_path=empty_clip_path,
+                raw_video_storage_directory=raw_directory,
+                **generator_options,
+            ).load().execute(rewrite=True)
+
+        return measure(_execute, frames, output_directory)
+
+    return {
+        "streaming_generator": _run,
+        "streaming_generator_single_pass": lambda run_directory: _run(run_directory, single_pass=True),
+    }
+
+
+def summarize(runs):
+    median_run = sorted(runs, key=lambda r: r["wall_seconds"])[len(runs) // 2]
+    return {
+        "runs": runs,
+        "median": median_run,
+        "wall_seconds_stdev": round(statistics.stdev([r["wall_seconds"] for r in runs]), 4) if len(runs) > 1 else 0,
+    }
+
+
+def environment_details():
+    details = {
+        "created": datetime.datetime.now(tz=pytz.UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        details["ffmpeg"] = subprocess.run(
+            ["ffmpeg", "-version"], capture_output=True, text=True, check=True
+        ).stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError):
+        details["ffmpeg"] = None
+    try:
+        details["git_revision"] = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        details["git_revision"] = None
+    return details
+
+
+def compare(results, baseline):
+    click.echo(f"{'stage':<36}{'baseline s':>12}{'current s':>12}{'speedup':>10}")
+    for stage, summary in results["stages"].items():
+        baseline_summary = baseline.get("stages", {}).get(stage)
+        if baseline_summary is None:
+            continue
+
+        baseline_seconds = baseline_summary["median"]["wall_seconds"]
+        current_seconds = summary["median"]["wall_seconds"]
+        speedup = baseline_seconds / current_seconds if current_seconds > 0 else float("inf")
+        click.echo(f"{stage:<36}{baseline_seconds:>12.3f}{current_seconds:>12.3f}{speedup:>9.2f}x")
+
+
+@click.command()
+@click.option("--output", "-o", help="Path to write the JSON results to", required=True)
+@click.option("--width", type=int, help="Width of the synthetic footage", default=1296)
+@click.option("--height", type=int, help="Height of the synthetic footage", default=972)
+@click.option("--repeat", type=int, help="Number of times each stage is run", default=3)
+@click.option("--concat_clips", type=int, help="Number of clips concatenated for the concat/HLS stages", default=30)
+@click.option("--camera_clips", type=int, help="Number of 10 second slots in the StreamingGenerator run", default=30)
+@click.option(
+    "--renditions",
+    help="ABR ladder of the prepare_hls_renditions stage, i.e. 720,360 (see prepare-videos-for-environment-for-time-range)",
+    default="720,360",
+)
+@click.option("--stage", "stages", multiple=True, help="Only run the given stages (defaults to all)", default=[])
+@click.option("--baseline", type=click.Path(exists=True), help="Earlier results to compare against", default=None)
+@click.option("--work_directory", help="Directory for footage and outputs (defaults to a temporary directory)")
+def main(output, width, height, repeat, concat_clips, camera_clips, renditions, stages, baseline, work_directory):
+    renditions = util.parse_rendition_ladder(renditions, default_bitrates=const.DEFAULT_RENDITION_BITRATES)
+
+    with tempfile.TemporaryDirectory(dir=work_directory) as tmp_directory:
+        footage_directory = os.path.join(tmp_directory, "footage")
+        os.makedirs(footage_directory)
+        clips = generate_footage(footage_directory, width, height)
+
+        benchmarks = {
+            **stage_benchmarks(clips, tmp_directory, concat_clips, renditions),
+            **streaming_generator_benchmark(clips, tmp_directory, camera_clips),
+        }
+        if len(stages) > 0:
+            benchmarks = {name: fn for name, fn in benchmarks.items() if name in stages}
+
+        results = {
+            "environment": environment_details(),
+            "footage": {
+                "width": width,
+                "height": height,
+                "fps": FPS,
+                "clip_frames": CLIP_FRAMES,
+                "concat_clips": concat_clips,
+                "camera_clips": camera_clips,
+                "renditions": renditions,
+            },
+            "stages": {},
+        }
+        for name, fn in benchmarks.items():
+            runs = []
+            for run in range(repeat):
+                run_directory = os.path.join(tmp_directory, "runs", name, str(run))
+                runs.append(fn(run_directory))
+                shutil.rmtree(run_directory, ignore_errors=True)
+
+            results["stages"][name] = summarize(runs)
+            median = results["stages"][name]["median"]
+            click.echo(
+                f"{name}: {median['wall_seconds']:.3f}s, {median['cpu_seconds']:.3f} CPU-s, {median['frames_per_second']} frames/s, {median['bytes_written']} bytes"
+            )
+
+    with open(output, "w", encoding="utf-8") as fp:
+        json.dump(results, fp, indent=2)
+
+    if baseline is not None:
+        with open(baseline, "r", encoding="utf-8") as fp:
+            compare(results, json.load(fp))
+
+
+if __name__ == "__main__":
+    main()
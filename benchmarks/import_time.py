@@ -0,0 +1,187 @@
+"""
+Import time benchmark of the video_prepare CLI and modules.
+
+Every measurement runs in a fresh interpreter: the wall time of `python -m video_prepare --help` (what every k8s Job
+pays before doing any work) and the import time of each module as reported by `python -X importtime`. The heaviest
+top level packages pulled in by each module are recorded too, so a heavy dependency creeping back into the CLI's import
+path shows up by name:
+
+    python benchmarks/import_time.py --output results.json
+    python benchmarks/import_time.py --output after.json --baseline results.json
+"""
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import click
+import pytz
+
+REPO_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "video_prepare.__main__",
+    "video_prepare.job_queue",
+    "video_prepare.transcode",
+    "video_prepare.streaming_generator",
+    "video_prepare.core",
+    "video_prepare.worker",
+]
+
+COMMANDS = {
+    "cli_help": ["-m", "video_prepare", "--help"],
+    "cli_list_jobs_help": ["-m", "video_prepare", "list-jobs", "--help"],
+}
+
+
+def run_python(args, extra_args=None):
+    """
+    :return: tuple of the wall time in seconds and the completed process
+    """
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable] + (extra_args or []) + args,
+        capture_output=True,
+        text=True,
+        cwd=REPO_DIRECTORY,
+        check=False,
+    )
+    return time.perf_counter() - started, process
+
+
+def parse_importtime(stderr):
+    """
+    Parse -X importtime output
+
+    :return: list of (module, self microseconds, cumulative microseconds) in import order
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        imports.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return imports
+
+
+def heaviest_packages(imports, module, count):
+    """
+    Cumulative import time of the top level packages imported by module, excluding the module's own package
+    """
+    own_package = module.split(".")[0]
+    packages = {}
+    for name, _, cumulative in imports:
+        package = name.split(".")[0]
+        if package == own_package or name != package:
+            continue
+        packages[package] = packages.get(package, 0) + cumulative
+
+    return dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)[:count])
+
+
+def measure_module(module, repeat, top):
+    runs = []
+    packages = {}
+    for _ in range(repeat):
+        wall_seconds, process = run_python(["-c", f"import {module}"], extra_args=["-X", "importtime"])
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "unknown error"
+            return {"error": error}
+
+        imports = parse_importtime(process.stderr)
+        import_seconds = next(
+            (cumulative / 1e6 for name, _, cumulative in reversed(imports) if name == module), float("nan")
+        )
+        runs.append({"wall_seconds": round(wall_seconds, 4), "import_seconds": round(import_seconds, 4)})
+        packages = heaviest_packages(imports, module, top)
+
+    return {
+        "runs": runs,
+        "median": {key: round(statistics.median(run[key] for run in runs), 4) for key in runs[0]},
+        "heaviest_packages_us": packages,
+    }
+
+
+def measure_command(args, repeat):
+    runs = []
+    for _ in range(repeat):
+        wall_seconds, process = run_python(args)
+        if process.returncode != 0:
+            error = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else "unknown error"
+            return {"error": error}
+        runs.append({"wall_seconds": round(wall_seconds, 4)})
+
+    return {"runs": runs, "median": {"wall_seconds": round(statistics.median(run["wall_seconds"] for run in runs), 4)}}
+
+
+def environment_details():
+    details = {
+        "created": datetime.datetime.now(tz=pytz.UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        details["git_revision"] = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=REPO_DIRECTORY
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        details["git_revision"] = None
+    return details
+
+
+def compare(results, baseline):
+    click.echo(f"{'benchmark':<40}{'baseline s':>12}{'current s':>12}{'speedup':>10}")
+    for section, key in [("commands", "wall_seconds"), ("modules", "import_seconds")]:
+        for name, summary in results[section].items():
+            baseline_summary = baseline.get(section, {}).get(name)
+            if baseline_summary is None or "median" not in baseline_summary or "median" not in summary:
+                continue
+
+            baseline_seconds = baseline_summary["median"][key]
+            current_seconds = summary["median"][key]
+            speedup = baseline_seconds / current_seconds if current_seconds > 0 else float("inf")
+            click.echo(f"{name:<40}{baseline_seconds:>12.3f}{current_seconds:>12.3f}{speedup:>9.2f}x")
+
+
+@click.command()
+@click.option("--output", "-o", help="Path to write the JSON results to", required=True)
+@click.option("--repeat", type=int, help="Number of fresh interpreters each measurement is run in", default=5)
+@click.option("--top", type=int, help="Number of heaviest packages recorded per module", default=10)
+@click.option("--module", "modules", multiple=True, help="Only measure the given modules (defaults to all)", default=[])
+@click.option("--baseline", type=click.Path(exists=True), help="Earlier results to compare against", default=None)
+def main(output, repeat, top, modules, baseline):
+    results = {"environment": environment_details(), "commands": {}, "modules": {}}
+
+    for name, args in COMMANDS.items():
+        results["commands"][name] = measure_command(args, repeat)
+        summary = results["commands"][name]
+        click.echo(f"{name}: {summary.get('median', {}).get('wall_seconds', summary.get('error'))}")
+
+    for module in modules or MODULES:
+        results["modules"][module] = measure_module(module, repeat, top)
+        summary = results["modules"][module]
+        if "error" in summary:
+            click.echo(f"{module}: failed, {summary['error']}")
+            continue
+        click.echo(
+            f"{module}: {summary['median']['import_seconds']:.3f}s import, {summary['median']['wall_seconds']:.3f}s wall, heaviest: {', '.join(summary['heaviest_packages_us'])}"
+        )
+
+    with open(output, "w", encoding="utf-8") as fp:
+        json.dump(results, fp, indent=2)
+
+    if baseline is not None:
+        with open(baseline, "r", encoding="utf-8") as fp:
+            compare(results, json.load(fp))
+
+
+if __name__ == "__main__":
+    main()
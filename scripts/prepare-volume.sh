@@ -13,6 +13,62 @@ if [ ! -z "${CLEANUP}"  ] && [ "${CLEANUP}" = "true" ]; then
     cmd_extras="${cmd_extras} --cleanup"
 fi
 
+if [ ! -z "${SINGLE_PASS}"  ] && [ "${SINGLE_PASS}" = "true" ]; then
+    cmd_extras="${cmd_extras} --single_pass"
+fi
+
+if [ ! -z "${STREAM_COPY}"  ] && [ "${STREAM_COPY}" = "true" ]; then
+    cmd_extras="${cmd_extras} --stream_copy"
+fi
+
+if [ ! -z "${COLLAPSE_GAPS}"  ] && [ "${COLLAPSE_GAPS}" = "true" ]; then
+    cmd_extras="${cmd_extras} --collapse_gaps"
+fi
+
+if [ ! -z "${PIPELINED}"  ] && [ "${PIPELINED}" = "true" ]; then
+    cmd_extras="${cmd_extras} --pipelined"
+fi
+
+if [ ! -z "${READ_RAW_IN_PLACE}"  ] && [ "${READ_RAW_IN_PLACE}" = "true" ]; then
+    cmd_extras="${cmd_extras} --read_raw_in_place"
+fi
+
+if [ ! -z "${CLIP_CACHE_DIRECTORY}"  ]; then
+    cmd_extras="${cmd_extras} --clip_cache_directory ${CLIP_CACHE_DIRECTORY}"
+fi
+
+if [ ! -z "${CLIP_CACHE_MAX_BYTES}"  ]; then
+    cmd_extras="${cmd_extras} --clip_cache_max_bytes ${CLIP_CACHE_MAX_BYTES}"
+fi
+
+if [ ! -z "${METADATA_CACHE_DIRECTORY}"  ]; then
+    cmd_extras="${cmd_extras} --metadata_cache_directory ${METADATA_CACHE_DIRECTORY}"
+fi
+
+if [ ! -z "${RENDITIONS}"  ]; then
+    cmd_extras="${cmd_extras} --renditions ${RENDITIONS}"
+fi
+
+if [ ! -z "${HLS_SEGMENT_TYPE}"  ]; then
+    cmd_extras="${cmd_extras} --hls_segment_type ${HLS_SEGMENT_TYPE}"
+fi
+
+if [ ! -z "${THUMBNAIL_INTERVAL}"  ]; then
+    cmd_extras="${cmd_extras} --thumbnail_interval ${THUMBNAIL_INTERVAL}"
+fi
+
+if [ ! -z "${METRICS_PATH}"  ]; then
+    cmd_extras="${cmd_extras} --metrics_path ${METRICS_PATH}"
+fi
+
+if [ ! -z "${PROMETHEUS_TEXTFILE_PATH}"  ]; then
+    cmd_extras="${cmd_extras} --prometheus_textfile_path ${PROMETHEUS_TEXTFILE_PATH}"
+fi
+
+if [ ! -z "${CAMERA_WORKERS}"  ]; then
+    cmd_extras="${cmd_extras} --camera_workers ${CAMERA_WORKERS}"
+fi
+
 python -m video_prepare prepare-videos-for-environment-for-time-range \
     --environment_name ${ENVIRONMENT_NAME} \
     --video_directory /data/videos \
@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+
+import pytest
+
+from video_prepare import clip_cache as clip_cache_module
+from video_prepare.clip_cache import ClipCache
+
+
+@pytest.fixture
+def clip_cache(tmp_path):
+    return ClipCache(str(tmp_path / "cache"))
+
+
+def make_videos(tmp_path, data_ids):
+    output_directory = tmp_path / "output"
+    output_directory.mkdir(exist_ok=True)
+    return [
+        {"data_id": data_id, "path": f"{data_id}.mp4", "video_streamer_path": str(output_directory / f"{data_id}.mp4")}
+        for data_id in data_ids
+    ]
+
+
+class Downloader:
+    """
+    download_fn that writes each clip's data_id as its content and records every call
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, videos, directory):
+        self.calls.append([video["data_id"] for video in videos])
+        downloaded = []
+        for video in videos:
+            local_path = os.path.join(directory, video["path"])
+            with open(local_path, "w", encoding="utf-8") as fp:
+                fp.write(video["data_id"] * 100)
+            downloaded.append({**video, "video_local_path": local_path})
+        return downloaded
+
+
+def test_fetch_downloads_then_links(clip_cache, tmp_path):
+    download = Downloader()
+
+    downloaded = clip_cache.fetch(make_videos(tmp_path, ["a", "b"]), download)
+    assert [video["data_id"] for video in downloaded] == ["a", "b"]
+    assert download.calls == [["a", "b"]]
+
+    # Another camera's output directory gets the cached clips without downloading them again
+    for video in make_videos(tmp_path, ["a", "b"]):
+        os.remove(video["video_streamer_path"])
+    videos = make_videos(tmp_path, ["a", "b", "c"])
+    downloaded = clip_cache.fetch(videos, download)
+
+    assert [video["data_id"] for video in downloaded] == ["c"]
+    assert download.calls == [["a", "b"], ["c"]]
+    for video in videos:
+        with open(video["video_streamer_path"], "r", encoding="utf-8") as fp:
+            assert fp.read() == video["data_id"] * 100
+    assert clip_cache.lookup("a") is not None
+
+
+def test_fetch_fills_in_batches(clip_cache, tmp_path, monkeypatch):
+    monkeypatch.setattr(clip_cache_module, "FILL_BATCH_CLIPS", 2)
+    download = Downloader()
+
+    clip_cache.fetch(make_videos(tmp_path, ["e", "d", "c", "b", "a"]), download)
+
+    assert download.calls == [["a", "b"], ["c", "d"], ["e"]]
+
+
+def test_same_content_is_stored_once(clip_cache, tmp_path):
+    for data_id in ["a", "b"]:
+        local_path = tmp_path / f"{data_id}.mp4"
+        local_path.write_text("same", encoding="utf-8")
+        clip_cache.insert(data_id, str(local_path))
+
+    assert clip_cache.lookup("a") == clip_cache.lookup("b")
+    assert len(os.listdir(clip_cache.objects_directory)) == 1
+
+
+def test_evict_least_recently_used(tmp_path):
+    clip_cache = ClipCache(str(tmp_path / "cache"), max_bytes=250)
+    download = Downloader()
+    clip_cache.fetch(make_videos(tmp_path, ["a", "b"]), download)
+    os.utime(clip_cache._index_path("a"), (1, 1))
+
+    clip_cache.fetch(make_videos(tmp_path, ["c"]), download)
+
+    assert clip_cache.lookup("a") is None
+    assert clip_cache.lookup("b") is not None
+    assert clip_cache.lookup("c") is not None
+    assert clip_cache.size() == 200
+    # The evicted clip's lock file goes with it
+    assert sorted(os.listdir(clip_cache.locks_directory)) == ["b.lock", "c.lock", "evict.lock"]
+
+
+def test_vanished_clip_is_a_miss(clip_cache, tmp_path, monkeypatch):
+    video = make_videos(tmp_path, ["a"])[0]
+    # Evicted between the lookup and the link
+    monkeypatch.setattr(clip_cache, "lookup", lambda data_id: os.path.join(clip_cache.objects_directory, "gone.mp4"))
+
+    assert clip_cache._link_cached(video) is False
+    assert not os.path.exists(video["video_streamer_path"])
+
+
+def test_lock_is_retaken_after_lock_file_removed(clip_cache):
+    with clip_cache._lock("a") as locked:
+        assert locked
+        with clip_cache._lock("a", blocking=False) as locked_again:
+            assert not locked_again
+        os.remove(clip_cache._lock_path("a"))
+
+    with clip_cache._lock("a", blocking=False) as locked:
+        assert locked
+        assert os.path.exists(clip_cache._lock_path("a"))
+
+
+def test_waiter_on_removed_lock_file_waits_for_new_holder(clip_cache):
+    holding = threading.Event()
+    release = threading.Event()
+    acquired = []
+
+    def _wait_for_lock():
+        with clip_cache._lock("a") as locked:
+            acquired.append(locked)
+
+    with clip_cache._lock("a"):
+        waiter = threading.Thread(target=_wait_for_lock)
+        waiter.start()
+        time.sleep(0.1)
+        # Evicted while the waiter is blocked on the old lock file
+        os.remove(clip_cache._lock_path("a"))
+
+        def _hold_new_lock():
+            with clip_cache._lock("a"):
+                holding.set()
+                release.wait(timeout=5)
+
+        holder = threading.Thread(target=_hold_new_lock)
+        holder.start()
+        assert holding.wait(timeout=5)
+
+    # The waiter got the removed file's lock, it has to wait for the holder of the new one
+    time.sleep(0.1)
+    assert acquired == []
+    release.set()
+    holder.join()
+    waiter.join()
+    assert acquired == [True]
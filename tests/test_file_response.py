@@ -0,0 +1,85 @@
+import asyncio
+import importlib.util
+import os
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # pylint: disable=wrong-import-position
+
+
+def load_file_response():
+    # Importing the video_streaming_service package connects to its database, file_response is loaded on its own
+    path = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "video_streaming_service", "file_response.py"
+    )
+    spec = importlib.util.spec_from_file_location("file_response", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+file_response = load_file_response()
+
+
+async def read_body(response):
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=-100", (900, 999)),
+        ("bytes=-2000", (0, 999)),
+        ("bytes=900-2000", (900, 999)),
+        (" bytes=5-5 ", (5, 5)),
+        ("bytes=-", None),
+        ("bytes=0-10,20-30", None),
+        ("items=0-10", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert file_response.parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1000-", "bytes=500-100"])
+def test_parse_range_not_satisfiable(header):
+    with pytest.raises(HTTPException) as error:
+        file_response.parse_range(header, 1000)
+
+    assert error.value.status_code == 416
+    assert error.value.headers["Content-Range"] == "bytes */1000"
+
+
+def test_ranged_file_response(tmp_path):
+    path = tmp_path / "stream_0.m4s"
+    content = bytes(range(256)) * 1024
+    path.write_bytes(content)
+
+    response = file_response.ranged_file_response(str(path), "bytes=1000-200999")
+
+    assert response.status_code == 206
+    assert response.media_type == "video/iso.segment"
+    assert response.headers["Content-Range"] == f"bytes 1000-200999/{len(content)}"
+    assert response.headers["Content-Length"] == "200000"
+    assert asyncio.run(read_body(response)) == content[1000:201000]
+
+
+def test_ranged_file_response_without_range(tmp_path):
+    path = tmp_path / "output.m3u8"
+    path.write_text("#EXTM3U\n", encoding="utf-8")
+
+    response = file_response.ranged_file_response(str(path))
+
+    assert response.status_code == 200
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+def test_ranged_file_response_missing_file(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        file_response.ranged_file_response(str(tmp_path / "missing.m4s"), "bytes=0-10")
+
+    assert error.value.status_code == 404
@@ -0,0 +1,107 @@
+import threading
+import time
+
+from video_prepare import governor as governor_module
+from video_prepare.governor import ResourceGovernor, cgroup_cpu_limit, cgroup_memory_limit
+
+
+def test_cgroup_v2_limits(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    (tmp_path / "memory.max").write_text("4294967296\n")
+
+    assert cgroup_cpu_limit(str(tmp_path)) == 1.5
+    assert cgroup_memory_limit(str(tmp_path)) == 4294967296
+
+
+def test_cgroup_v2_unlimited(tmp_path):
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    (tmp_path / "memory.max").write_text("max\n")
+
+    assert cgroup_cpu_limit(str(tmp_path)) is None
+    assert cgroup_memory_limit(str(tmp_path)) is None
+
+
+def test_cgroup_v1_limits(tmp_path):
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("200000\n")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000\n")
+    (tmp_path / "memory").mkdir()
+    (tmp_path / "memory" / "memory.limit_in_bytes").write_text(f"{1 << 62}\n")
+
+    assert cgroup_cpu_limit(str(tmp_path)) == 2
+    assert cgroup_memory_limit(str(tmp_path)) is None
+
+
+def test_camera_share():
+    governor = ResourceGovernor(cpus=8, memory_bytes=4 * 1536 * 1024 * 1024)
+
+    assert governor.camera_workers() == 4
+    assert governor.camera_share(4) == {"cpus": 2, "memory_bytes": 1536 * 1024 * 1024}
+
+
+def test_encode_leaves_probe_slots(monkeypatch):
+    monkeypatch.setattr(governor_module, "PROBE_RESERVED_CPUS", 1)
+    governor = ResourceGovernor(cpus=4)
+    assert governor.ffmpeg_threads() == 3
+    assert ResourceGovernor(cpus=1).ffmpeg_threads() == 1
+
+
+def test_probe_runs_alongside_encode(monkeypatch):
+    """
+    A pipelined run probes the next section while the current one is encoded, the encode mustn't hold every slot
+    """
+    monkeypatch.setattr(governor_module, "PROBE_RESERVED_CPUS", 1)
+    governor = ResourceGovernor(cpus=4)
+    encoding = threading.Event()
+    probed = threading.Event()
+
+    def _encode():
+        with governor.ffmpeg_slot(governor.ffmpeg_threads()):
+            encoding.set()
+            probed.wait(timeout=5)
+
+    encoder = threading.Thread(target=_encode)
+    encoder.start()
+    assert encoding.wait(timeout=5)
+
+    def _probe():
+        with governor.ffmpeg_slot(1):
+            probed.set()
+
+    prober = threading.Thread(target=_probe)
+    prober.start()
+    # The probe gets the reserved slot while the encode is still running (the encode only exits once probed is set)
+    assert probed.wait(timeout=5)
+
+    encoder.join()
+    prober.join()
+
+
+def test_slots_wait_in_order():
+    governor = ResourceGovernor(cpus=2)
+    started = []
+    release = threading.Event()
+
+    def _run(name, threads):
+        with governor.ffmpeg_slot(threads):
+            started.append(name)
+            release.wait(timeout=5)
+
+    with governor.ffmpeg_slot(2):
+        encode = threading.Thread(target=_run, args=("encode", 2))
+        encode.start()
+        while len(governor._waiting) < 1:
+            time.sleep(0.01)
+        probe = threading.Thread(target=_run, args=("probe", 1))
+        probe.start()
+        while len(governor._waiting) < 2:
+            time.sleep(0.01)
+
+    # The probe queued behind the encode, it doesn't jump ahead even though a slot would fit it
+    while len(started) < 1:
+        time.sleep(0.01)
+    assert started == ["encode"]
+    release.set()
+    encode.join()
+    probe.join()
+    assert started == ["encode", "probe"]
@@ -0,0 +1,104 @@
+from video_prepare.hls_playlist import insert_gap_segments, mark_discontinuity, parse_media_playlist, playlist_length
+
+
+GAP_URI = "../empty_frames.ts"
+
+
+def write_playlist(path, durations, ended=True):
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:10", "#EXT-X-MEDIA-SEQUENCE:0"]
+    for index, duration in enumerate(durations):
+        lines += [f"#EXTINF:{duration:.6f},", f"output_stream_0_{index}.ts"]
+    if ended:
+        lines.append("#EXT-X-ENDLIST")
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_parse_media_playlist(tmp_path):
+    playlist_path = write_playlist(tmp_path / "output_stream_0.m3u8", [10.0, 10.0, 4.5])
+
+    segments = parse_media_playlist(playlist_path)
+
+    assert [segment["uri"] for segment in segments] == [f"output_stream_0_{index}.ts" for index in range(3)]
+    assert [segment["duration"] for segment in segments] == [10.0, 10.0, 4.5]
+    assert all(segment["tags"] == [] for segment in segments)
+    assert playlist_length(playlist_path) == (3, 24.5)
+
+
+def test_parse_media_playlist_keeps_segment_tags(tmp_path):
+    playlist_path = tmp_path / "output_stream_0.m3u8"
+    playlist_path.write_text(
+        '#EXTM3U\n#EXT-X-MAP:URI="init.mp4"\n#EXTINF:10.0,\na.ts\n#EXT-X-DISCONTINUITY\n#EXTINF:10.0,\nb.ts\n',
+        encoding="utf-8",
+    )
+
+    segments = parse_media_playlist(str(playlist_path))
+
+    assert segments[0]["tags"] == ['#EXT-X-MAP:URI="init.mp4"']
+    assert segments[1]["tags"] == ["#EXT-X-DISCONTINUITY"]
+
+
+def test_insert_gap_segments_layout(tmp_path):
+    playlist_path = write_playlist(tmp_path / "output_stream_0.m3u8", [10.0, 10.0, 10.0])
+
+    insert_gap_segments(playlist_path, [["video", 1], ["gap", 3], ["video", 2]], GAP_URI, slot_seconds=10)
+
+    segments = parse_media_playlist(playlist_path)
+    assert [segment["uri"] for segment in segments] == [
+        "output_stream_0_0.ts",
+        GAP_URI,
+        GAP_URI,
+        GAP_URI,
+        "output_stream_0_1.ts",
+        "output_stream_0_2.ts",
+    ]
+    assert [segment["tags"] for segment in segments] == [
+        [],
+        ["#EXT-X-DISCONTINUITY"],
+        ["#EXT-X-DISCONTINUITY"],
+        ["#EXT-X-DISCONTINUITY"],
+        ["#EXT-X-DISCONTINUITY"],
+        [],
+    ]
+    assert playlist_length(playlist_path) == (6, 60.0)
+    assert open(playlist_path, encoding="utf-8").read().rstrip().endswith("#EXT-X-ENDLIST")
+
+
+def test_insert_gap_segments_every_blank_reference_is_a_discontinuity(tmp_path):
+    playlist_path = write_playlist(tmp_path / "output_stream_0.m3u8", [10.0])
+
+    insert_gap_segments(playlist_path, [["gap", 2], ["video", 1], ["gap", 2]], GAP_URI, slot_seconds=10)
+
+    segments = parse_media_playlist(playlist_path)
+    assert [segment["uri"] for segment in segments] == [GAP_URI, GAP_URI, "output_stream_0_0.ts", GAP_URI, GAP_URI]
+    # Nothing precedes the first segment, every later blank reference and the video after a gap start over
+    assert segments[0]["tags"] == []
+    assert all(segment["tags"] == ["#EXT-X-DISCONTINUITY"] for segment in segments[1:])
+
+
+def test_insert_gap_segments_leaves_earlier_segments(tmp_path):
+    playlist_path = write_playlist(tmp_path / "output_stream_0.m3u8", [10.0, 10.0, 10.0])
+
+    insert_gap_segments(playlist_path, [["gap", 1], ["video", 1]], GAP_URI, slot_seconds=10, first_segment=2)
+
+    segments = parse_media_playlist(playlist_path)
+    assert [segment["uri"] for segment in segments] == [
+        "output_stream_0_0.ts",
+        "output_stream_0_1.ts",
+        GAP_URI,
+        "output_stream_0_2.ts",
+    ]
+    assert segments[2]["tags"] == ["#EXT-X-DISCONTINUITY"]
+    assert segments[3]["tags"] == ["#EXT-X-DISCONTINUITY"]
+
+
+def test_mark_discontinuity(tmp_path):
+    playlist_path = write_playlist(tmp_path / "output_stream_0.m3u8", [10.0, 10.0, 10.0])
+
+    mark_discontinuity(playlist_path, 2)
+    mark_discontinuity(playlist_path, 2)
+    mark_discontinuity(playlist_path, 3)
+
+    segments = parse_media_playlist(playlist_path)
+    assert [segment["tags"] for segment in segments] == [[], [], ["#EXT-X-DISCONTINUITY"]]
+    assert playlist_length(playlist_path) == (3, 30.0)
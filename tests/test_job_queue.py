@@ -0,0 +1,97 @@
+from datetime import datetime
+import socket
+
+import pytest
+import pytz
+
+from video_prepare import job_queue as job_queue_module
+from video_prepare.job_queue import JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JobQueue
+
+
+@pytest.fixture
+def job_queue(tmp_path):
+    return JobQueue(str(tmp_path / "queue" / "jobs.sqlite"), max_attempts=2)
+
+
+def test_claim_in_queue_order(job_queue):
+    start = datetime(2023, 1, 9, 14, tzinfo=pytz.UTC)
+    first = job_queue.enqueue({"environment_name": "a", "start": start})
+    second = job_queue.enqueue({"environment_name": "b"})
+
+    job = job_queue.claim()
+    assert job["id"] == first
+    assert job["status"] == JOB_RUNNING
+    assert job["attempts"] == 1
+    assert job["params"] == {"environment_name": "a", "start": start}
+
+    assert job_queue.claim()["id"] == second
+    assert job_queue.claim() is None
+
+
+def test_complete(job_queue):
+    job_id = job_queue.enqueue({"environment_name": "a"})
+    job_queue.claim()
+
+    job_queue.complete(job_id)
+
+    assert [job["status"] for job in job_queue.list_jobs()] == [JOB_SUCCEEDED]
+    assert job_queue.claim() is None
+
+
+def test_fail_retries_until_out_of_attempts(job_queue):
+    job_id = job_queue.enqueue({"environment_name": "a"})
+
+    job_queue.claim()
+    job_queue.fail(job_id, "first")
+    assert job_queue.list_jobs(status=JOB_QUEUED)[0]["error"] == "first"
+
+    job = job_queue.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    job_queue.fail(job_id, "second")
+
+    assert job_queue.claim() is None
+    failed = job_queue.list_jobs(status=JOB_FAILED)
+    assert [job["id"] for job in failed] == [job_id]
+    assert failed[0]["error"] == "second"
+
+
+def test_requeue_abandoned(job_queue, monkeypatch):
+    job_id = job_queue.enqueue({"environment_name": "a"})
+    job_queue.claim()
+    hostname = socket.gethostname()
+
+    # Claimed by a worker process that's still running
+    monkeypatch.setattr(job_queue_module, "_process_exists", lambda pid: True)
+    with job_queue._transaction() as connection:
+        connection.execute("UPDATE job SET claimed_by = ? WHERE id = ?", (f"{hostname}:1", job_id))
+    assert job_queue.requeue_abandoned() == 0
+
+    # Claimed on another host, that host's workers requeue it
+    with job_queue._transaction() as connection:
+        connection.execute("UPDATE job SET claimed_by = ? WHERE id = ?", ("elsewhere:1", job_id))
+    assert job_queue.requeue_abandoned() == 0
+
+    # Claimed by a worker process that exited
+    monkeypatch.setattr(job_queue_module, "_process_exists", lambda pid: False)
+    with job_queue._transaction() as connection:
+        connection.execute("UPDATE job SET claimed_by = ? WHERE id = ?", (f"{hostname}:1", job_id))
+    assert job_queue.requeue_abandoned() == 1
+
+    job = job_queue.claim()
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+
+
+def test_requeue_abandoned_out_of_attempts(job_queue, monkeypatch):
+    job_id = job_queue.enqueue({"environment_name": "a"})
+    job_queue.claim()
+    job_queue.fail(job_id, "first")
+    job_queue.claim()
+
+    monkeypatch.setattr(job_queue_module, "_process_exists", lambda pid: False)
+    with job_queue._transaction() as connection:
+        connection.execute("UPDATE job SET claimed_by = ? WHERE id = ?", (f"{socket.gethostname()}:1", job_id))
+
+    assert job_queue.requeue_abandoned() == 1
+    assert [job["status"] for job in job_queue.list_jobs()] == [JOB_FAILED]
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import pytz
+
+from video_prepare.manifest import STAGES, JobManifest, StageManifest, fingerprint
+
+
+def test_fingerprint_is_stable():
+    start = datetime(2023, 1, 9, 14, tzinfo=pytz.UTC)
+
+    assert fingerprint({"start": start, "clips": ["a", "b"]}) == fingerprint({"clips": ["a", "b"], "start": start})
+    assert fingerprint({"start": start, "clips": ["a", "b"]}) != fingerprint({"start": start, "clips": ["a"]})
+
+
+def test_stage_manifest_progress(tmp_path):
+    manifest_path = str(tmp_path / "prepare_manifest.json")
+    manifest = StageManifest(manifest_path)
+    assert not manifest.is_complete()
+    assert manifest.first_incomplete_stage() == STAGES[0]
+
+    manifest.reset("abc", {"clips": 2})
+    manifest.start("download")
+    manifest.complete("download", {"downloaded": 2})
+    manifest.start("normalize")
+
+    loaded = StageManifest(manifest_path)
+    assert loaded.fingerprint == "abc"
+    assert loaded.inputs == {"clips": 2}
+    assert loaded.is_complete("download")
+    assert loaded.details("download") == {"downloaded": 2}
+    assert loaded.is_started("normalize")
+    assert not loaded.is_complete("normalize")
+    assert loaded.first_incomplete_stage() == "normalize"
+    assert not loaded.is_complete()
+
+    for stage in STAGES[1:]:
+        loaded.complete(stage)
+    assert StageManifest(manifest_path).is_complete()
+    assert StageManifest(manifest_path).first_incomplete_stage() is None
+
+
+def test_stage_manifest_reset_clears_stages(tmp_path):
+    manifest = StageManifest(str(tmp_path / "prepare_manifest.json"))
+    manifest.reset("abc", {})
+    manifest.complete("download")
+
+    manifest.reset("def", {})
+
+    assert not StageManifest(manifest.manifest_path).is_started("download")
+
+
+def test_stage_manifest_unreadable_starts_over(tmp_path):
+    manifest_path = tmp_path / "prepare_manifest.json"
+    manifest_path.write_text("{", encoding="utf-8")
+
+    manifest = StageManifest(str(manifest_path))
+
+    assert manifest.fingerprint is None
+    assert manifest.first_incomplete_stage() == STAGES[0]
+
+
+def test_job_manifest(tmp_path):
+    manifest_path = str(tmp_path / "prepare_job.json")
+    assert not JobManifest(manifest_path).is_interrupted()
+
+    JobManifest(manifest_path).start()
+    assert JobManifest(manifest_path).is_interrupted()
+
+    JobManifest(manifest_path).complete()
+    assert not JobManifest(manifest_path).is_interrupted()
+
+    # A new run of the same playset is interrupted until it completes
+    JobManifest(manifest_path).start()
+    assert JobManifest(manifest_path).is_interrupted()
+
+
+def test_stage_manifest_feed_end_survives_reset(tmp_path):
+    manifest_path = str(tmp_path / "prepare_manifest.json")
+    feed_end = datetime.fromisoformat("2023-01-09T09:00:00-06:00")
+    manifest = StageManifest(manifest_path)
+    manifest.reset("abc", {})
+    manifest.complete_feed(feed_end)
+
+    # Appending different clips for the same range starts the stages over, the feed still ends where it did
+    loaded = StageManifest(manifest_path)
+    loaded.reset("def", {})
+    assert StageManifest(manifest_path).feed_end == datetime(2023, 1, 9, 15, tzinfo=pytz.UTC)
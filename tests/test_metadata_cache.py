@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+import os
+import threading
+
+import pytz
+
+from video_prepare.metadata_cache import MetadataCache
+
+
+START = datetime(2023, 1, 9, 14, 0, tzinfo=pytz.UTC)
+
+
+def video(device_id, seconds):
+    return {
+        "device_id": device_id,
+        "data_id": f"{device_id}-{seconds}",
+        "video_timestamp": START + timedelta(seconds=seconds),
+    }
+
+
+class VideoService:
+    """
+    fetch_fn over a fixed set of videos that records every query
+    """
+
+    def __init__(self, videos):
+        self.videos = videos
+        self.queries = []
+
+    def __call__(self, start, end, device_ids):
+        self.queries.append((start, end, list(device_ids)))
+        return {
+            device_id: [v for v in self.videos if v["device_id"] == device_id and start <= v["video_timestamp"] < end]
+            for device_id in device_ids
+        }
+
+
+def test_settled_hours_are_fetched_once(tmp_path):
+    cache = MetadataCache(str(tmp_path), settle_seconds=0)
+    service = VideoService([video("a", 10), video("a", 3700), video("b", 20)])
+
+    fetched = cache.fetch("env", ["a", "b"], START, START + timedelta(hours=2), service)
+    assert [v["data_id"] for v in fetched["a"]] == ["a-10", "a-3700"]
+    assert [v["data_id"] for v in fetched["b"]] == ["b-20"]
+    # Both hours in one query for both cameras
+    assert service.queries == [(START, START + timedelta(hours=2), ["a", "b"])]
+    assert len(os.listdir(tmp_path / "env" / "a")) == 2
+
+    again = cache.fetch("env", ["a", "b"], START, START + timedelta(hours=2), service)
+    assert again == fetched
+    assert len(service.queries) == 1
+    assert isinstance(again["a"][0]["video_timestamp"], datetime)
+
+
+def test_only_missing_hours_and_cameras_are_fetched(tmp_path):
+    cache = MetadataCache(str(tmp_path), settle_seconds=0)
+    service = VideoService([video("a", 10), video("a", 3700), video("b", 3710)])
+    cache.fetch("env", ["a"], START, START + timedelta(hours=1), service)
+
+    fetched = cache.fetch("env", ["a", "b"], START, START + timedelta(hours=2), service)
+
+    assert service.queries[1:] == [(START, START + timedelta(hours=2), ["a", "b"])]
+    assert [v["data_id"] for v in fetched["a"]] == ["a-10", "a-3700"]
+    assert [v["data_id"] for v in fetched["b"]] == ["b-3710"]
+
+    cache.fetch("env", ["a", "b"], START + timedelta(hours=1), START + timedelta(hours=2), service)
+    assert len(service.queries) == 2
+
+
+def test_open_hours_are_not_cached(tmp_path):
+    cache = MetadataCache(str(tmp_path))
+    now = datetime.now(tz=pytz.UTC).replace(minute=0, second=0, microsecond=0)
+    service = VideoService([])
+
+    cache.fetch("env", ["a"], now - timedelta(hours=1), now + timedelta(hours=1), service)
+    cache.fetch("env", ["a"], now - timedelta(hours=1), now + timedelta(hours=1), service)
+
+    assert len(service.queries) == 2
+    assert not os.path.exists(tmp_path / "env" / "a")
+
+
+def test_partial_hours_are_trimmed_to_the_range(tmp_path):
+    cache = MetadataCache(str(tmp_path), settle_seconds=0)
+    service = VideoService([video("a", 10), video("a", 1800), video("a", 3590)])
+
+    fetched = cache.fetch("env", ["a"], START + timedelta(minutes=20), START + timedelta(minutes=40), service)
+
+    assert [v["data_id"] for v in fetched["a"]] == ["a-1800"]
+    # The whole hour was fetched and cached
+    assert service.queries == [(START, START + timedelta(hours=1), ["a"])]
+
+
+def test_unreadable_cache_file_is_refetched(tmp_path):
+    cache = MetadataCache(str(tmp_path), settle_seconds=0)
+    service = VideoService([video("a", 10)])
+    cache.fetch("env", ["a"], START, START + timedelta(hours=1), service)
+
+    (bucket_file,) = os.listdir(tmp_path / "env" / "a")
+    (tmp_path / "env" / "a" / bucket_file).write_text("{", encoding="utf-8")
+
+    fetched = cache.fetch("env", ["a"], START, START + timedelta(hours=1), service)
+    assert [v["data_id"] for v in fetched["a"]] == ["a-10"]
+    assert len(service.queries) == 2
+
+
+def test_concurrent_stores_of_one_bucket(tmp_path):
+    cache = MetadataCache(str(tmp_path), settle_seconds=0)
+    path = cache._bucket_path("env", "a", START)
+    errors = []
+
+    def _store(index):
+        try:
+            for _ in range(20):
+                cache._store(path, [video("a", index)])
+        except Exception as e:  # pylint: disable=broad-except
+            errors.append(e)
+
+    threads = [threading.Thread(target=_store, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert os.listdir(tmp_path / "env" / "a") == [os.path.basename(path)]
+    assert len(cache._load(path)) == 1
@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+
+import pytest
+import pytz
+
+from video_prepare import hls_playlist, streaming_generator as streaming_generator_module, thumbnails
+from video_prepare.streaming_generator import SLOT_SECONDS, StreamingGenerator
+
+
+START = datetime(2023, 1, 9, 14, 0, tzinfo=pytz.UTC)
+
+
+def video(seconds, data_id, path="camera/clip.mp4"):
+    return {
+        "data_id": data_id,
+        "path": path,
+        "video_timestamp": (START + timedelta(seconds=seconds)).isoformat(),
+    }
+
+
+def load(tmp_path, video_metadata, slots=6, **kwargs):
+    return StreamingGenerator(
+        video_metadata=video_metadata,
+        start=START,
+        end=START + timedelta(seconds=slots * SLOT_SECONDS),
+        output_directory=str(tmp_path),
+        empty_clip_path=str(tmp_path / "empty_frames.video.mp4"),
+        **kwargs,
+    ).load()
+
+
+def test_clips_are_placed_in_their_slots(tmp_path):
+    generator = load(tmp_path, [video(0, "a"), video(23, "b"), video(50, "c")])
+
+    files = generator.get_files()
+    assert [file["slot"] for file in files] == list(range(6))
+    assert [file.get("data_id") for file in files] == ["a", None, "b", None, None, "c"]
+    assert [file["missing"] for file in files] == [False, True, False, True, True, False]
+    assert files[2]["start"] == START + timedelta(seconds=20)
+    assert files[2]["end"] == START + timedelta(seconds=30)
+    assert files[1]["video_streamer_path"] == generator.empty_clip_path
+    assert generator.file_count() == 6
+
+
+def test_first_clip_in_a_slot_wins(tmp_path):
+    generator = load(tmp_path, [video(11, "a"), video(15, "b"), video(19, "c")], slots=2)
+
+    assert [file["data_id"] for file in generator.captured_video_list] == ["a"]
+    assert [file["slot"] for file in generator.missing_video_list] == [0]
+
+
+def test_clips_outside_the_range_or_unfetchable_are_dropped(tmp_path):
+    generator = load(
+        tmp_path,
+        [
+            video(-10, "before"),
+            video(60, "after"),
+            video(10, None),
+            {**video(20, "no_path"), "path": None},
+            video(30, "kept"),
+        ],
+    )
+
+    assert [file["data_id"] for file in generator.captured_video_list] == ["kept"]
+    assert [file["slot"] for file in generator.missing_video_list] == [0, 1, 2, 4, 5]
+
+
+def test_no_video_metadata(tmp_path):
+    generator = load(tmp_path, [], slots=3)
+
+    assert generator.captured_video_list == []
+    assert [file["slot"] for file in generator.missing_video_list] == [0, 1, 2]
+
+
+@pytest.mark.parametrize("slots", [0, 1])
+def test_short_range(tmp_path, slots):
+    generator = load(tmp_path, [video(0, "a")], slots=slots)
+
+    assert generator.file_count() == slots
+
+
+def test_timestamp_formats(tmp_path):
+    generator = load(
+        tmp_path,
+        [
+            {**video(0, "a"), "video_timestamp": START + timedelta(seconds=5)},
+            {**video(0, "b"), "video_timestamp": "2023-01-09T14:00:10Z"},
+            {**video(0, "c"), "video_timestamp": "2023-01-09T14:00:29.999000+00:00"},
+        ],
+        slots=3,
+    )
+
+    assert [file["data_id"] for file in generator.captured_video_list] == ["a", "b", "c"]
+    assert [file["slot"] for file in generator.captured_video_list] == [0, 1, 2]
+
+
+def test_rewritten_feed_starts_a_new_thumbnail_track(tmp_path, monkeypatch):
+    # The encode itself isn't run, nothing is written by it
+    monkeypatch.setattr(streaming_generator_module, "prepare_hls", lambda **kwargs: True)
+    generator = load(tmp_path, [video(0, "a")], slots=1, thumbnail_interval=10)
+    generator.timeline = [["video", 1]]
+    with open(thumbnails.thumbnail_track_path(str(tmp_path)), "w", encoding="utf-8") as fp:
+        fp.write("WEBVTT\n\n00:00:00.000 --> 00:00:10.000\nthumbnails_0000.jpg#xywh=0,0,160,90\n")
+    (tmp_path / "thumbnails_0000.jpg").write_bytes(b"")
+
+    generator.generate_hls(rewrite=True)
+
+    with open(thumbnails.thumbnail_track_path(str(tmp_path)), "r", encoding="utf-8") as fp:
+        assert fp.read() == "WEBVTT\n"
+    assert thumbnails.next_sprite_index(str(tmp_path)) == 0
+
+
+def test_append_through_the_feed_end_is_skipped(tmp_path, monkeypatch):
+    generator = load(tmp_path, [video(0, "a")], slots=1, append=True)
+    generator.manifest.complete_feed(generator.end_datetime)
+
+    def _download(*args, **kwargs):
+        raise AssertionError("nothing should be appended")
+
+    monkeypatch.setattr(generator, "download_or_copy_files", _download)
+    # Clips uploaded since the last attempt change the inputs, not the range that was appended
+    generator.video_metadata.append(video(5, "late"))
+    generator.execute()
+
+    assert generator.manifest.fingerprint is None
+
+
+def test_stream_copy_reencodes_only_the_runs_that_have_to_be(tmp_path, monkeypatch):
+    encodes = []
+
+    def _prepare_hls(input_path, output_path, append, stream_copy, **kwargs):
+        with open(input_path, "r", encoding="utf-8") as fp:
+            clips = [line for line in fp if line.startswith("file ")]
+        encodes.append((len(clips), stream_copy, append))
+
+        playlist_path = str(tmp_path / "output_stream_0.m3u8")
+        header, segments = ["#EXTM3U"], []
+        if append:
+            header, segments, _ = hls_playlist.read_media_playlist(playlist_path)
+        segments += [
+            {"duration": 10.0, "uri": f"0_{len(segments) + ii:03d}.ts", "tags": []} for ii in range(len(clips))
+        ]
+        hls_playlist.write_media_playlist(playlist_path, header, segments)
+        (tmp_path / "output.m3u8").write_text("#EXTM3U\n", encoding="utf-8")
+        return True
+
+    monkeypatch.setattr(streaming_generator_module, "prepare_hls", _prepare_hls)
+    generator = load(
+        tmp_path, [video(0, "a"), video(10, "b"), video(20, "c"), video(30, "d")], slots=5, stream_copy=True
+    )
+    files = generator.get_files()
+    for file in files:
+        if not file["missing"]:
+            file["video_streamer_path"] = str(tmp_path / f"{file['data_id']}.mp4")
+    (tmp_path / "empty_frames.video.mp4").write_bytes(b"0" * 100)
+    for data_id in ["a", "b", "c", "d"]:
+        (tmp_path / f"{data_id}.mp4").write_bytes(b"0" * 100)
+    # b had to be conformed, the last slot is missing
+    files[1]["conformed"] = True
+
+    generator._write_stream_copy_runs([(100, file) for file in files])
+    generator.timeline = [["video", 5]]
+    generator.generate_hls(rewrite=False)
+
+    # Only b and the missing slot are re-encoded
+    assert encodes == [(1, True, False), (1, False, True), (2, True, True), (1, False, True)]
+    segments = hls_playlist.parse_media_playlist(str(tmp_path / "output_stream_0.m3u8"))
+    assert [segment["tags"] for segment in segments] == [
+        [],
+        ["#EXT-X-DISCONTINUITY"],
+        ["#EXT-X-DISCONTINUITY"],
+        [],
+        ["#EXT-X-DISCONTINUITY"],
+    ]
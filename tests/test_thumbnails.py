@@ -0,0 +1,118 @@
+import os
+import struct
+
+from video_prepare.thumbnails import (
+    discard_thumbnail_snapshot,
+    jpeg_size,
+    next_sprite_index,
+    restore_thumbnails,
+    snapshot_thumbnails,
+    sprite_path_pattern,
+    thumbnail_snapshot_path,
+    write_thumbnail_track,
+)
+
+
+def write_jpeg_header(path, width, height):
+    """
+    Just enough of a JPEG for jpeg_size: SOI, an APP0 segment and a baseline frame header
+    """
+    with open(path, "wb") as fp:
+        fp.write(b"\xff\xd8")
+        fp.write(b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + b"\x00" * 9)
+        fp.write(b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00")
+
+
+def read_cues(hls_directory):
+    with open(hls_directory / "thumbnails.vtt", "r", encoding="utf-8") as fp:
+        blocks = fp.read().split("\n\n")
+    assert blocks[0] == "WEBVTT"
+    return [tuple(block.strip().split("\n")) for block in blocks[1:]]
+
+
+def test_jpeg_size(tmp_path):
+    write_jpeg_header(tmp_path / "sprite.jpg", 1600, 900)
+
+    assert jpeg_size(str(tmp_path / "sprite.jpg")) == (1600, 900)
+
+
+def test_thumbnail_track(tmp_path):
+    # 2x2 tiles of 160x90 per sprite sheet
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 0, 320, 180)
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 1, 320, 180)
+
+    cue_count = write_thumbnail_track(str(tmp_path), [["video", 5]], interval=10, tile=(2, 2))
+
+    assert cue_count == 5
+    assert read_cues(tmp_path) == [
+        ("00:00:00.000 --> 00:00:10.000", "thumbnails_0000.jpg#xywh=0,0,160,90"),
+        ("00:00:10.000 --> 00:00:20.000", "thumbnails_0000.jpg#xywh=160,0,160,90"),
+        ("00:00:20.000 --> 00:00:30.000", "thumbnails_0000.jpg#xywh=0,90,160,90"),
+        ("00:00:30.000 --> 00:00:40.000", "thumbnails_0000.jpg#xywh=160,90,160,90"),
+        ("00:00:40.000 --> 00:00:50.000", "thumbnails_0001.jpg#xywh=0,0,160,90"),
+    ]
+
+
+def test_thumbnail_track_skips_collapsed_gaps(tmp_path):
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 0, 320, 180)
+
+    write_thumbnail_track(str(tmp_path), [["video", 1], ["gap", 3], ["video", 2]], interval=10, tile=(2, 2))
+
+    # The gap wasn't encoded, the thumbnails after it are shifted to where their video plays
+    assert read_cues(tmp_path) == [
+        ("00:00:00.000 --> 00:00:10.000", "thumbnails_0000.jpg#xywh=0,0,160,90"),
+        ("00:00:40.000 --> 00:00:50.000", "thumbnails_0000.jpg#xywh=160,0,160,90"),
+        ("00:00:50.000 --> 00:01:00.000", "thumbnails_0000.jpg#xywh=0,90,160,90"),
+    ]
+
+
+def test_thumbnail_track_appends(tmp_path):
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 0, 320, 180)
+    write_thumbnail_track(str(tmp_path), [["video", 2]], interval=10, tile=(2, 2))
+    assert next_sprite_index(str(tmp_path)) == 1
+
+    # An appended encode numbers its sprites on from the existing ones and starts where the feed ended
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 1, 320, 180)
+    write_thumbnail_track(str(tmp_path), [["video", 1]], first_sprite=1, start_seconds=20.0, interval=10, tile=(2, 2))
+
+    assert read_cues(tmp_path)[-1] == ("00:00:20.000 --> 00:00:30.000", "thumbnails_0001.jpg#xywh=0,0,160,90")
+    assert len(read_cues(tmp_path)) == 3
+
+
+def test_thumbnail_track_stops_at_missing_sprite(tmp_path):
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 0, 320, 180)
+
+    assert write_thumbnail_track(str(tmp_path), [["video", 6]], interval=10, tile=(2, 2)) == 4
+
+
+def test_interrupted_append_is_rolled_back(tmp_path):
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 0, 320, 180)
+    write_thumbnail_track(str(tmp_path), [["video", 2]], interval=10, tile=(2, 2))
+    snapshot_thumbnails(str(tmp_path))
+
+    # Interrupted after the encode wrote its sprite sheet and the track was appended to
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 1, 320, 180)
+    write_thumbnail_track(str(tmp_path), [["video", 1]], first_sprite=1, start_seconds=20.0, interval=10, tile=(2, 2))
+
+    # The retried append starts from the feed as it was before the interrupted one
+    snapshot_thumbnails(str(tmp_path))
+    assert next_sprite_index(str(tmp_path)) == 1
+    assert len(read_cues(tmp_path)) == 2
+
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 1, 320, 180)
+    write_thumbnail_track(str(tmp_path), [["video", 1]], first_sprite=1, start_seconds=20.0, interval=10, tile=(2, 2))
+    discard_thumbnail_snapshot(str(tmp_path))
+
+    assert len(read_cues(tmp_path)) == 3
+    assert not os.path.exists(thumbnail_snapshot_path(str(tmp_path)))
+
+
+def test_interrupted_first_thumbnail_append_is_rolled_back(tmp_path):
+    # A feed encoded without thumbnails has no track to restore
+    snapshot_thumbnails(str(tmp_path))
+    write_jpeg_header(sprite_path_pattern(str(tmp_path)) % 0, 320, 180)
+    write_thumbnail_track(str(tmp_path), [["video", 1]], interval=10, tile=(2, 2))
+
+    restore_thumbnails(str(tmp_path))
+
+    assert os.listdir(tmp_path) == [os.path.basename(thumbnail_snapshot_path(str(tmp_path)))]
@@ -0,0 +1,50 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from video_prepare.const import DEFAULT_RENDITION_BITRATES
+from video_prepare.util import parse_rendition_ladder, str_to_date, str_to_epoch_seconds
+
+
+def test_parse_rendition_ladder():
+    assert parse_rendition_ladder("360:400k, 720p:1500k,") == [
+        {"height": 720, "bitrate": "1500k"},
+        {"height": 360, "bitrate": "400k"},
+    ]
+
+
+def test_parse_rendition_ladder_default_bitrates():
+    assert parse_rendition_ladder("720,240:300k", default_bitrates=DEFAULT_RENDITION_BITRATES) == [
+        {"height": 720, "bitrate": "1500k"},
+        {"height": 240, "bitrate": "300k"},
+    ]
+
+
+def test_parse_rendition_ladder_missing_bitrate():
+    with pytest.raises(ValueError):
+        parse_rendition_ladder("540")
+
+
+def test_parse_rendition_ladder_empty():
+    assert parse_rendition_ladder("") == []
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "2023-01-09T14:00:10Z",
+        "2023-01-09T14:00:10.250000+00:00",
+        "2023-01-09T15:00:10+01:00",
+        "2023-01-09T14:00:10",
+        "2023-01-09 14:00:10.5",
+        datetime(2023, 1, 9, 14, 0, 10, tzinfo=pytz.UTC),
+    ],
+)
+def test_str_to_epoch_seconds(timestamp):
+    assert str_to_epoch_seconds(timestamp) == int(datetime(2023, 1, 9, 14, 0, 10, tzinfo=pytz.UTC).timestamp())
+
+
+def test_str_to_epoch_seconds_falls_back_to_str_to_date():
+    # Not ISO 8601 but parseable by dateutil
+    assert str_to_epoch_seconds("Jan 9 2023 14:00:10") == int(str_to_date("Jan 9 2023 14:00:10").timestamp())
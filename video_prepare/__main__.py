@@ -1,4 +1,8 @@
+import datetime
 import itertools
+import os
+import sys
+
 import pytz
 
 import click
@@ -7,9 +11,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-from . import core
-from .honeycomb_service import HoneycombClient
-from .introspection import fetch_video_metadata_in_range
+# Only lightweight modules are imported here. Commands import what they need (ffmpeg, video_io, honeycomb_io, auth0,
+# numpy...) when they run, so --help and the queue commands start quickly.
+from . import const, job_queue, util
 from .log import logger
 
 
@@ -30,6 +34,16 @@ def cli_timezone_aware(ctx, param, value):
     return value.astimezone(pytz.utc)
 
 
+def cli_rendition_ladder(ctx, param, value):
+    if value is None:
+        return None
+
+    try:
+        return util.parse_rendition_ladder(value, default_bitrates=const.DEFAULT_RENDITION_BITRATES)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @click.group()
 def main():
     pass
@@ -66,29 +80,83 @@ def main():
     multiple=True,
     default=[],
 )
-def list_videos_for_environment_for_time_range(environment_name, output_path, output_name, start, end, camera):
+@click.option(
+    "--metadata_cache_directory",
+    help="Directory of a local cache of video metadata by camera and hour, elapsed hours are only fetched once",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(const.INVENTORY_FORMATS),
+    help="Output format. 'parquet' and 'arrow' (Arrow IPC file) have typed timestamp columns and require pyarrow",
+    default="csv",
+)
+@click.option(
+    "--chunk_hours",
+    type=int,
+    help="The time range is fetched in chunks of this many hours, several chunks at once, and written as they arrive",
+    default=24,
+)
+@click.option(
+    "--workers",
+    type=int,
+    help="Number of chunks fetched at once (defaults to the I/O workers of the resource governor)",
+    default=None,
+)
+def list_videos_for_environment_for_time_range(
+    environment_name,
+    output_path,
+    output_name,
+    start,
+    end,
+    camera,
+    metadata_cache_directory,
+    output_format,
+    chunk_hours,
+    workers,
+):
+    """
+    Export the environment's video inventory: a row per captured video with its camera's assignment, timestamp and data
+    id
+    """
+    from .honeycomb_service import HoneycombClient
+    from .inventory import export_inventory
+    from .metadata_cache import MetadataCache
+
     # load the environment to get all the assignments
     honeycomb_client = HoneycombClient()
 
     environment_id = honeycomb_client.get_environment_by_name(environment_name).get("environment_id")
-    with open(f"{output_path}/{output_name}", "w", encoding="utf-8") as output_fp:
-        output_fp.write("assignment_id,device_id,assigned_name,timestamp,data_id\n")
-        # evaluate the assignments to filter out non-camera assignments
-        assignments = honeycomb_client.get_assignments(environment_id)
-        for assignment_id, device_id, assigned_name in assignments:
-            if len(camera) > 0:
-                if assignment_id not in camera and assigned_name not in camera:
-                    logger.info(f"Skipping camera '{assignment_id}:{assigned_name}', not in supplied cameras param")
-                    continue
-
-            video_metadata = list(
-                fetch_video_metadata_in_range(environment_id=environment_id, device_id=device_id, start=start, end=end)
-            )
-            for item in video_metadata:
-                output_fp.write(
-                    f"{assignment_id},{device_id},{assigned_name},{item['video_timestamp']},{item['data_id']}\n"
-                )
-        output_fp.flush()
+    metadata_cache = None
+    if metadata_cache_directory is not None:
+        metadata_cache = MetadataCache(metadata_cache_directory)
+
+    # evaluate the assignments to filter out non-camera assignments
+    camera_assignments = []
+    for assignment_id, device_id, assigned_name in honeycomb_client.get_assignments(environment_id):
+        if len(camera) > 0:
+            if assignment_id not in camera and assigned_name not in camera:
+                logger.info(f"Skipping camera '{assignment_id}:{assigned_name}', not in supplied cameras param")
+                continue
+
+        camera_assignments.append((assignment_id, device_id, assigned_name))
+
+    try:
+        export_inventory(
+            os.path.join(output_path, output_name),
+            environment_id=environment_id,
+            camera_assignments=camera_assignments,
+            start=start,
+            end=end,
+            output_format=output_format,
+            chunk=datetime.timedelta(hours=max(1, chunk_hours)),
+            workers=workers,
+            metadata_cache=metadata_cache,
+        )
+    except ImportError as e:
+        raise click.ClickException(str(e))
 
 
 @main.command(name="prepare-videos-for-environment-for-time-range")
@@ -131,7 +199,7 @@ def list_videos_for_environment_for_time_range(environment_name, output_path, ou
 )
 @click.option(
     "--append",
-    help="DISABLED - append images/video to HLS feed (start time for given day must align)",
+    help="Append video to an existing playset's HLS feeds, only video between the playset's current end time and --end is generated",
     is_flag=True,
     default=False,
 )
@@ -149,6 +217,94 @@ def list_videos_for_environment_for_time_range(environment_name, output_path, ou
     multiple=True,
     default=[],
 )
+@click.option(
+    "--camera_workers",
+    type=int,
+    help="Number of cameras to prepare in parallel. Cameras share the CPUs the container's cgroup allows, so each camera's ffmpeg processes are limited to its share (defaults to half the allowed CPUs, fewer if the memory limit can't hold that many cameras)",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--single_pass",
+    help="Generate the HLS feed and preview image directly from the raw video clips in a single ffmpeg pass, without writing an intermediate full length mp4",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--stream_copy",
+    help="Package raw video clips into HLS without re-encoding. Clips that don't match the camera's codec, resolution, frame rate or keyframe cadence are conformed. Runs of conformed or missing clips are re-encoded and packaged between the stream copied runs, separated by discontinuities",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--collapse_gaps",
+    help="Don't encode long stretches of missing video. The HLS playlists reference a single pre-encoded blank segment for every missing 10 second slot instead",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--pipelined",
+    help="Download, normalize and encode each camera's video in sections with the stages running concurrently, so encoding starts as soon as the first clips arrive. Implies --single_pass",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--read_raw_in_place",
+    help="Read raw video clips directly from --raw_video_storage_directory instead of copying them into the video directory first. Only clips that need to be re-encoded are written locally",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--clip_cache_directory",
+    help="Directory of a node wide cache of downloaded raw video clips, shared by every playset prepared on the node so overlapping playsets don't download the same clips again",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--clip_cache_max_bytes",
+    type=int,
+    help="Size budget of the clip cache in bytes, the least recently used clips are evicted once the cache grows past it (defaults to unlimited)",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--metadata_cache_directory",
+    help="Directory of a local cache of video metadata by environment, camera and hour. Elapsed hours are cached once and never fetched again, only uncached or still open hours are queried",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--renditions",
+    help="ABR ladder encoded alongside the source resolution from the same decode, as comma separated heights with optional bitrates (i.e. '1080:3000k,720:1500k,360:400k'). Heights without a bitrate use a default for that height",
+    required=False,
+    default=None,
+    callback=cli_rendition_ladder,
+)
+@click.option(
+    "--hls_segment_type",
+    type=click.Choice(const.HLS_SEGMENT_TYPES),
+    help="'mpegts' writes a .ts file per 10 second segment, 'fmp4' writes a single fragmented MP4 (CMAF) file per rendition addressed with byte ranges. fmp4 feeds can't be appended to",
+    default="mpegts",
+)
+@click.option(
+    "--thumbnail_interval",
+    type=int,
+    help="Seconds between trick play thumbnails (i.e. 10 or 30). Thumbnails are tiled into sprite sheets during the HLS encode and indexed by a WebVTT thumbnail track, disabled by default",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--metrics_path",
+    help="Write per camera, per stage timing, CPU, I/O and clip count metrics of the run to this path as JSON",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--prometheus_textfile_path",
+    help="Write the run's metrics to this path in the Prometheus text format (i.e. for node_exporter's textfile collector or a Pushgateway)",
+    required=False,
+    default=None,
+)
 def prepare_videos_for_environment_for_time_range(
     environment_name,
     video_directory,
@@ -160,7 +316,23 @@ def prepare_videos_for_environment_for_time_range(
     append,
     cleanup,
     camera,
+    camera_workers,
+    single_pass,
+    stream_copy,
+    collapse_gaps,
+    pipelined,
+    read_raw_in_place,
+    clip_cache_directory,
+    clip_cache_max_bytes,
+    metadata_cache_directory,
+    renditions,
+    hls_segment_type,
+    thumbnail_interval,
+    metrics_path,
+    prometheus_textfile_path,
 ):
+    from . import core
+
     core.prepare_videos_for_environment_for_time_range(
         environment_name=environment_name,
         video_directory=video_directory,
@@ -172,8 +344,269 @@ def prepare_videos_for_environment_for_time_range(
         camera=camera,
         raw_video_storage_directory=raw_video_storage_directory,
         remove_video_files_after_processing=cleanup,
+        camera_workers=camera_workers,
+        single_pass=single_pass,
+        stream_copy=stream_copy,
+        collapse_gaps=collapse_gaps,
+        pipelined=pipelined,
+        read_raw_in_place=read_raw_in_place,
+        clip_cache_directory=clip_cache_directory,
+        clip_cache_max_bytes=clip_cache_max_bytes,
+        metadata_cache_directory=metadata_cache_directory,
+        renditions=renditions,
+        hls_segment_type=hls_segment_type,
+        thumbnail_interval=thumbnail_interval,
+        metrics_path=metrics_path,
+        prometheus_textfile_path=prometheus_textfile_path,
     )
 
 
+@main.command(name="enqueue-job")
+@click.option("--queue_path", help="Path of the worker's job queue (SQLite database)", required=True)
+@click.option(
+    "--environment_name",
+    "-e",
+    help="name of the environment in honeycomb, required for using the honeycomb consumer",
+    required=True,
+)
+@click.option(
+    "--video_name",
+    "-n",
+    help="name given to subfolder where video is stored (i.e. /<<video_directory/<<environment_id>>/<<VIDEO_NAME>>/",
+    required=True,
+)
+@click.option(
+    "--start",
+    type=click.DateTime(formats=cli_valid_date_formats),
+    required=True,
+    callback=cli_timezone_aware,
+    help="start time of video to load expects format to be YYYY-MM-DDTHH:MM Z",
+)
+@click.option(
+    "--end",
+    type=click.DateTime(formats=cli_valid_date_formats),
+    required=True,
+    callback=cli_timezone_aware,
+    help="end time of video to load expects format to be YYYY-MM-DDTHH:MM Z",
+)
+@click.option("--rewrite", help="rewrite any generated images/video (i.e. hls feeds)", is_flag=True, default=False)
+@click.option("--append", help="Append video to an existing playset's HLS feeds", is_flag=True, default=False)
+@click.option(
+    "--cleanup",
+    help="Will remove downloaded/copied videos after generating streamable video",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--camera",
+    "-c",
+    help="list of cameras to generate video for (ids/names)",
+    required=False,
+    multiple=True,
+    default=[],
+)
+@click.option("--single_pass", help="See prepare-videos-for-environment-for-time-range", is_flag=True, default=False)
+@click.option("--stream_copy", help="See prepare-videos-for-environment-for-time-range", is_flag=True, default=False)
+@click.option("--collapse_gaps", help="See prepare-videos-for-environment-for-time-range", is_flag=True, default=False)
+@click.option("--pipelined", help="See prepare-videos-for-environment-for-time-range", is_flag=True, default=False)
+@click.option(
+    "--renditions",
+    help="See prepare-videos-for-environment-for-time-range",
+    required=False,
+    default=None,
+    callback=cli_rendition_ladder,
+)
+@click.option(
+    "--hls_segment_type",
+    type=click.Choice(const.HLS_SEGMENT_TYPES),
+    help="See prepare-videos-for-environment-for-time-range",
+    default="mpegts",
+)
+@click.option(
+    "--thumbnail_interval",
+    type=int,
+    help="See prepare-videos-for-environment-for-time-range",
+    required=False,
+    default=None,
+)
+def enqueue_job(
+    queue_path,
+    environment_name,
+    video_name,
+    start,
+    end,
+    rewrite,
+    append,
+    cleanup,
+    camera,
+    single_pass,
+    stream_copy,
+    collapse_gaps,
+    pipelined,
+    renditions,
+    hls_segment_type,
+    thumbnail_interval,
+):
+    """
+    Queue a prepare job for a worker. Jobs take the same options as prepare-videos-for-environment-for-time-range,
+    except for the directories and resources the worker owns.
+    """
+    job_id = job_queue.JobQueue(queue_path).enqueue(
+        {
+            "environment_name": environment_name,
+            "video_name": video_name,
+            "start": start,
+            "end": end,
+            "rewrite": rewrite,
+            "append": append,
+            "remove_video_files_after_processing": cleanup,
+            "camera": list(camera),
+            "single_pass": single_pass,
+            "stream_copy": stream_copy,
+            "collapse_gaps": collapse_gaps,
+            "pipelined": pipelined,
+            "renditions": renditions,
+            "hls_segment_type": hls_segment_type,
+            "thumbnail_interval": thumbnail_interval,
+        }
+    )
+    click.echo(job_id)
+
+
+@main.command(name="list-jobs")
+@click.option("--queue_path", help="Path of the worker's job queue (SQLite database)", required=True)
+@click.option("--status", type=click.Choice(job_queue.JOB_STATUSES), required=False, default=None)
+def list_jobs(queue_path, status):
+    for job in job_queue.JobQueue(queue_path).list_jobs(status=status):
+        params = job["params"]
+        click.echo(
+            f"{job['id']}\t{job['status']}\t{job['attempts']}\t{params.get('environment_name')}\t{params.get('video_name')}\t{params.get('start')}\t{params.get('end')}\t{job['error'] or ''}"
+        )
+
+
+@main.command(name="worker")
+@click.option("--queue_path", help="Path of the job queue (SQLite database) to run jobs from", required=True)
+@click.option("--video_directory", "-v", help="Directory to store prepared videos in", required=True)
+@click.option(
+    "--raw_video_storage_directory",
+    help="Root directory where raw videos are stored. In production, this is the shared EFS volume's mount point. Providing this path will allow the video_streamer to copy files rather than fetch video files over http.",
+)
+@click.option("--concurrent_jobs", type=int, help="Number of jobs to run at the same time", default=2)
+@click.option(
+    "--camera_workers",
+    type=int,
+    help="Number of cameras to prepare in parallel, shared by every running job (defaults to half the CPUs the container's cgroup allows)",
+    required=False,
+    default=None,
+)
+@click.option("--poll_interval", type=float, help="Seconds to wait before checking an empty queue again", default=10)
+@click.option("--max_attempts", type=int, help="Number of times a failing job is run before giving up on it", default=3)
+@click.option(
+    "--read_raw_in_place",
+    help="Read raw video clips directly from --raw_video_storage_directory instead of copying them into the video directory first",
+    is_flag=True,
+    default=False,
+)
+@click.option(
+    "--clip_cache_directory",
+    help="Directory of a node wide cache of downloaded raw video clips, shared by every job",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--clip_cache_max_bytes",
+    type=int,
+    help="Size budget of the clip cache in bytes (defaults to unlimited)",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--metadata_cache_directory",
+    help="Directory of a local cache of video metadata by camera and hour, shared by every job",
+    required=False,
+    default=None,
+)
+@click.option(
+    "--metrics_directory",
+    help="Directory to write each job's metrics to, as JSON (job-<id>.json) and in the Prometheus text format (one file per environment and playset, for node_exporter's textfile collector)",
+    required=False,
+    default=None,
+)
+def worker(
+    queue_path,
+    video_directory,
+    raw_video_storage_directory,
+    concurrent_jobs,
+    camera_workers,
+    poll_interval,
+    max_attempts,
+    read_raw_in_place,
+    clip_cache_directory,
+    clip_cache_max_bytes,
+    metadata_cache_directory,
+    metrics_directory,
+):
+    """
+    Run prepare jobs from a local job queue until stopped. Clients, tokens, caches and camera worker processes are kept
+    warm across jobs.
+    """
+    from . import worker as prepare_worker
+
+    prepare_worker.PrepareWorker(
+        job_queue=job_queue.JobQueue(queue_path, max_attempts=max_attempts),
+        video_directory=video_directory,
+        raw_video_storage_directory=raw_video_storage_directory,
+        concurrent_jobs=concurrent_jobs,
+        camera_workers=camera_workers,
+        poll_interval=poll_interval,
+        metrics_directory=metrics_directory,
+        job_defaults={
+            "read_raw_in_place": read_raw_in_place,
+            "clip_cache_directory": clip_cache_directory,
+            "clip_cache_max_bytes": clip_cache_max_bytes,
+            "metadata_cache_directory": metadata_cache_directory,
+        },
+    ).run()
+
+
+@main.command(name="validate-videos")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option(
+    "--level",
+    type=click.Choice(const.VALIDATION_LEVELS),
+    help="Validation tier: 'structure' checks the container only, 'packets' also counts packets with ffprobe, 'decode' also decodes every frame (slow)",
+    default=const.VALIDATION_PACKETS,
+)
+@click.option(
+    "--workers",
+    type=int,
+    help="Number of files to validate in parallel, by default twice the CPUs the container's cgroup allows",
+    default=None,
+)
+def validate_videos(paths, level, workers):
+    """
+    Validate video files (directories are searched for .mp4 files and HLS feeds). Invalid files are printed, one per
+    line, and the command exits non-zero if any were found.
+    """
+    video_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                video_paths.extend(os.path.join(root, f) for f in files if f.endswith(".mp4") or f == "output.m3u8")
+        else:
+            video_paths.append(path)
+
+    from . import transcode
+
+    results = transcode.validate_videos(sorted(video_paths), level=level, workers=workers)
+    invalid = [path for path, valid in results.items() if not valid]
+    for path in invalid:
+        click.echo(path)
+
+    logger.info(f"{len(results) - len(invalid)} of {len(results)} videos valid")
+    if len(invalid) > 0:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main(auto_envvar_prefix="HONEYCOMB")
@@ -0,0 +1,266 @@
+from contextlib import ExitStack, contextmanager
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from .log import logger
+
+
+# Clips filled at once, a fill holds a lock file open per clip until the whole batch has been downloaded
+FILL_BATCH_CLIPS = 64
+
+
+class ClipCache:
+    """
+    Node wide cache of downloaded raw clips, shared by every StreamingGenerator (and every process) on the node.
+
+    Clips are stored once per content hash in objects/ and looked up by data_id through index/. A clip's index entry is
+    touched each time the clip is used, so when the cache grows past its byte budget the least recently used clips are
+    evicted first. Fills are serialized with a lock per data_id, so a clip is fetched at most once no matter how many
+    cameras or runs ask for it at the same time. Clips are filled in batches of FILL_BATCH_CLIPS, so a fill never holds
+    more than that many lock files open. An evicted clip's lock file is removed with it.
+
+    Cached clips are handed out as hard links (copies if the cache is on another filesystem) at the path the caller asks
+    for, evicting a clip never removes a file that's in use.
+    """
+
+    def __init__(self, cache_directory, max_bytes: Optional[int] = None):
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+
+        self.objects_directory = os.path.join(cache_directory, "objects")
+        self.index_directory = os.path.join(cache_directory, "index")
+        self.locks_directory = os.path.join(cache_directory, "locks")
+        self.tmp_directory = os.path.join(cache_directory, "tmp")
+        for directory in [self.objects_directory, self.index_directory, self.locks_directory, self.tmp_directory]:
+            os.makedirs(directory, exist_ok=True)
+
+    def _index_path(self, data_id):
+        return os.path.join(self.index_directory, data_id)
+
+    def _object_path(self, content_hash, extension):
+        return os.path.join(self.objects_directory, f"{content_hash}{extension}")
+
+    @contextmanager
+    def _lock(self, name, blocking=True):
+        """
+        Hold an exclusive lock on name. Yields whether the lock was acquired, a non-blocking lock that's held elsewhere
+        yields False.
+
+        Lock files are removed (by evict) while locked. A lock taken on a file that has since been removed is
+        worthless, the next process to open the path gets a new file, so the lock is taken again on the new file.
+        """
+        lock_path = self._lock_path(name)
+        while True:
+            with open(lock_path, "a") as fp:
+                try:
+                    fcntl.flock(fp, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+
+                try:
+                    if not _is_same_file(fp, lock_path):
+                        continue
+
+                    yield True
+                    return
+                finally:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _lock_path(self, name):
+        return os.path.join(self.locks_directory, f"{name}.lock")
+
+    def lookup(self, data_id) -> Optional[str]:
+        """
+        :return: Path to the cached clip for data_id, None if the clip isn't cached
+        """
+        index_path = self._index_path(data_id)
+        try:
+            with open(index_path, "r", encoding="utf-8") as fp:
+                object_name = fp.read().strip()
+        except FileNotFoundError:
+            return None
+
+        object_path = os.path.join(self.objects_directory, object_name)
+        if not os.path.exists(object_path):
+            return None
+
+        # Mark the clip as recently used
+        try:
+            os.utime(index_path, None)
+        except FileNotFoundError:
+            # Evicted since it was read
+            return None
+        return object_path
+
+    def insert(self, data_id, path) -> str:
+        """
+        Move a fetched clip into the cache
+
+        :return: Path to the cached clip
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                sha.update(chunk)
+
+        object_path = self._object_path(sha.hexdigest(), os.path.splitext(path)[1])
+        if os.path.exists(object_path):
+            # Same content is already cached under another data_id
+            os.remove(path)
+        else:
+            os.replace(path, object_path)
+
+        index_tmp_path = f"{self._index_path(data_id)}.tmp"
+        with open(index_tmp_path, "w", encoding="utf-8") as fp:
+            fp.write(os.path.basename(object_path))
+        os.replace(index_tmp_path, self._index_path(data_id))
+
+        return object_path
+
+    def fetch(self, videos, download_fn):
+        """
+        Place each video's clip at its video_streamer_path, from the cache if possible. Clips that aren't cached are
+        fetched with download_fn and added to the cache.
+
+        :param videos: video metadata dicts with data_id, path and video_streamer_path
+        :param download_fn: download_fn(videos, directory) downloads the clips into directory and returns the video
+                            metadata with video_local_path set
+        :return: list of the videos that had to be downloaded
+        """
+        # Locks are always taken in data_id order so concurrent fills can't deadlock
+        remaining = sorted((video for video in videos if not self._link_cached(video)), key=lambda v: v["data_id"])
+
+        downloaded = []
+        with tempfile.TemporaryDirectory(dir=self.tmp_directory) as tmp_dir:
+            for ii in range(0, len(remaining), FILL_BATCH_CLIPS):
+                downloaded.extend(
+                    self._fill(remaining[ii : ii + FILL_BATCH_CLIPS], tmp_dir, download_fn, blocking=False)
+                )
+
+            # Whatever is left is being filled elsewhere, wait for those fills and take over any that failed
+            remaining = [video for video in remaining if not self._link_cached(video)]
+            for ii in range(0, len(remaining), FILL_BATCH_CLIPS):
+                downloaded.extend(
+                    self._fill(remaining[ii : ii + FILL_BATCH_CLIPS], tmp_dir, download_fn, blocking=True)
+                )
+
+        if len(downloaded) > 0:
+            logger.info(f"Clip cache: {len(videos) - len(downloaded)} clips cached, {len(downloaded)} downloaded")
+            self.evict()
+
+        return downloaded
+
+    def _fill(self, videos, tmp_dir, download_fn, blocking):
+        """
+        Download the given videos that aren't being filled elsewhere and add them to the cache. Holds a lock per video
+        while the videos are downloaded, callers pass at most FILL_BATCH_CLIPS videos.
+        """
+        filled = []
+        with ExitStack() as locks:
+            owned = []
+            for video in videos:
+                locked = locks.enter_context(self._lock(video["data_id"], blocking=blocking))
+                # Another fill may have finished while we waited for the lock
+                if locked and not self._link_cached(video):
+                    owned.append(video)
+
+            if len(owned) > 0:
+                for video in download_fn(owned, tmp_dir):
+                    local_path = video.get("video_local_path")
+                    if local_path is None or not os.path.exists(local_path):
+                        continue
+
+                    self.insert(video["data_id"], local_path)
+                    if self._link_cached(video):
+                        filled.append(video)
+
+        return filled
+
+    def _link_cached(self, video) -> bool:
+        """
+        Link (or copy) a video's cached clip to its video_streamer_path
+
+        :return: False if the clip isn't cached, including a clip evicted while it was being linked
+        """
+        cached_path = self.lookup(video["data_id"])
+        if cached_path is None:
+            return False
+
+        destination = video["video_streamer_path"]
+        if os.path.exists(destination):
+            return True
+
+        # Lookups aren't locked, the clip can be evicted between the lookup and the link
+        try:
+            os.link(cached_path, destination)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            try:
+                shutil.copy(cached_path, destination)
+            except FileNotFoundError:
+                return False
+        return True
+
+    def size(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.objects_directory) if entry.is_file())
+
+    def evict(self):
+        """
+        Remove the least recently used clips until the cache is within its byte budget
+        """
+        if self.max_bytes is None:
+            return
+
+        with self._lock("evict"):
+            total_bytes = self.size()
+            if total_bytes <= self.max_bytes:
+                return
+
+            entries = []
+            references = {}
+            for entry in os.scandir(self.index_directory):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    with open(entry.path, "r", encoding="utf-8") as fp:
+                        object_name = fp.read().strip()
+                    entries.append((entry.stat().st_mtime, entry.name, object_name))
+                except FileNotFoundError:
+                    continue
+                references[object_name] = references.get(object_name, 0) + 1
+
+            evicted = 0
+            for _, data_id, object_name in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+
+                with self._lock(data_id, blocking=False) as locked:
+                    if not locked:
+                        # Being filled right now, so it's not the least recently used
+                        continue
+
+                    os.remove(self._index_path(data_id))
+                    # Removed while still locked, anyone waiting on the old lock file takes the lock again (see _lock)
+                    os.remove(self._lock_path(data_id))
+                    references[object_name] -= 1
+                    if references[object_name] == 0:
+                        object_path = os.path.join(self.objects_directory, object_name)
+                        if os.path.exists(object_path):
+                            total_bytes -= os.path.getsize(object_path)
+                            os.remove(object_path)
+                    evicted += 1
+
+            logger.info(f"Clip cache: evicted {evicted} clips, {total_bytes} bytes cached")
+
+
+def _is_same_file(fp, path) -> bool:
+    try:
+        return os.fstat(fp.fileno()).st_ino == os.stat(path).st_ino
+    except FileNotFoundError:
+        return False
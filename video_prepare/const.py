@@ -3,3 +3,41 @@ import os
 
 def empty_clip_path(output_path):
     return os.path.join(output_path, "empty_frames.video.mp4")
+
+
+# Bitrates used for renditions in the ABR ladder that don't specify one
+DEFAULT_RENDITION_BITRATES = {
+    1080: "3000k",
+    720: "1500k",
+    480: "800k",
+    360: "400k",
+    240: "250k",
+}
+
+
+def blank_segment_path(output_path, height=None):
+    if height is None:
+        return os.path.join(output_path, "empty_frames.ts")
+
+    return os.path.join(output_path, f"empty_frames_{height}p.ts")
+
+
+def manifest_path(camera_output_path):
+    return os.path.join(camera_output_path, "prepare_manifest.json")
+
+
+def job_manifest_path(output_path):
+    return os.path.join(output_path, "prepare_job.json")
+
+
+# Validation tiers, from fastest to most thorough. Each tier includes the checks of the tiers before it. The CLI's
+# choices come from here, so listing them doesn't import transcode (and ffmpeg).
+VALIDATION_STRUCTURE = "structure"  # Container structure only, no subprocess
+VALIDATION_PACKETS = "packets"  # ffprobe -count_packets, reads every packet header without decoding
+VALIDATION_DECODE = "decode"  # Full decode with is_valid_video, slow
+VALIDATION_LEVELS = [VALIDATION_STRUCTURE, VALIDATION_PACKETS, VALIDATION_DECODE]
+
+HLS_SEGMENT_TYPES = ["mpegts", "fmp4"]
+
+# File formats the video inventory can be exported as, parquet and arrow require pyarrow
+INVENTORY_FORMATS = ["csv", "parquet", "arrow"]
@@ -1,11 +1,19 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
 import datetime
 import os
-from typing import List, Optional
+import time
+from typing import List, Optional, Tuple
 
-from . import const
+from . import const, governor as resource_governor, thumbnails
+from .clip_cache import ClipCache
 from .honeycomb_service import HoneycombClient
-from .introspection import fetch_video_metadata_in_range
+from .introspection import fetch_video_metadata_for_cameras
 from .log import logger
+from .manifest import JobManifest, StageManifest
+from .metadata_cache import MetadataCache
+from .metrics import JobMetrics
 from .stream_service import client as stream_service_client, models
 from .transcode import (
     copy_technical_difficulties_clip,
@@ -24,18 +32,64 @@ def prepare_videos_for_environment_for_time_range(
     camera: Optional[List[str]] = None,
     raw_video_storage_directory: Optional[str] = None,
     remove_video_files_after_processing: bool = False,
+    camera_workers: Optional[int] = None,
+    single_pass: bool = False,
+    stream_copy: bool = False,
+    collapse_gaps: bool = False,
+    pipelined: bool = False,
+    read_raw_in_place: bool = False,
+    clip_cache_directory: Optional[str] = None,
+    clip_cache_max_bytes: Optional[int] = None,
+    metadata_cache_directory: Optional[str] = None,
+    renditions: Optional[List[dict]] = None,
+    hls_segment_type: str = "mpegts",
+    thumbnail_interval: Optional[int] = None,
+    honeycomb_client: Optional[HoneycombClient] = None,
+    streaming_client: Optional[stream_service_client.StreamServiceClient] = None,
+    camera_executor: Optional[Executor] = None,
+    metrics_path: Optional[str] = None,
+    prometheus_textfile_path: Optional[str] = None,
 ):
+    """
+    Generate streamable video for an environment's cameras and register it with the stream service as a playset
+
+    A long running worker passes in its own clients and camera_executor so API tokens and camera pool processes are
+    reused across jobs. camera_executor is shared by every job the worker runs, camera_workers must be its size.
+
+    Per camera, per stage metrics of the job are written as JSON to metrics_path and in the Prometheus text format to
+    prometheus_textfile_path once every camera is done.
+    """
     if camera is None:
         camera = []
 
+    if hls_segment_type == "fmp4":
+        # Single file feeds are written in one pass, they can't be extended segment by segment or have segments of
+        # blank video spliced in
+        for flag, enabled in [("append", append), ("pipelined", pipelined), ("collapse_gaps", collapse_gaps)]:
+            if enabled:
+                logger.warning(f"{flag} isn't supported with fmp4 HLS segments, ignoring")
+        append = False
+        pipelined = False
+        collapse_gaps = False
+
+    if renditions is None:
+        renditions = []
+    if stream_copy and len(renditions) > 0:
+        logger.warning("Renditions ignored, stream copied video only has the source resolution")
+        renditions = []
+
+    job_metrics = JobMetrics(environment_name=environment_name, video_name=video_name)
+
     if rewrite:
         logger.warning("Rewrite flag enabled! All generated images/video will be recreated.")
+        if append:
+            logger.warning("Append flag ignored, rewrite flag takes precedence")
+            append = False
     elif append:
-        # logger.warning("If existing video is discovered, new video will be appended")
-        logger.warning("After switching to DB storage, append mode has been disabled")
-        append = False
+        logger.warning("If existing video is discovered, new video will be appended")
 
-    honeycomb_client = HoneycombClient()
+    if honeycomb_client is None:
+        honeycomb_client = HoneycombClient()
 
     # load the environment to get all the assignments
     environment_id = honeycomb_client.get_environment_by_name(environment_name).get("environment_id")
@@ -46,25 +100,65 @@ def prepare_videos_for_environment_for_time_range(
     output_dir = os.path.join(video_directory, environment_id, video_name)
     os.makedirs(output_dir, exist_ok=True)
 
-    streaming_client = stream_service_client.StreamServiceClient()
+    if streaming_client is None:
+        streaming_client = stream_service_client.StreamServiceClient()
     playset = streaming_client.get_playset_by_name(environment_id=environment_id, playset_name=video_name)
 
+    # Devices whose video is already registered with the playset (only relevant when resuming an interrupted run)
+    registered_device_ids = set()
+    # Start of the time span being appended to an existing playset, None unless extending an existing playset
+    append_start = None
     if playset is not None:
-        if rewrite is False:
+        if append:
+            if end <= playset.end_time:
+                logger.warning(
+                    f"Streamable video for environment '{environment_name}' with name '{video_name}' already ends at {playset.end_time}, nothing to append"
+                )
+                return
+
+            append_start = playset.end_time
+            start = playset.start_time
+            logger.info(f"Appending {append_start} (start) - {end} (end) to playset '{video_name}'")
+            registered_device_ids = {str(video.device_id) for video in (playset.videos or [])}
+        elif rewrite is False:
+            if not _is_interrupted(output_dir):
+                logger.warning(
+                    f"Rewrite flag set to False and streamable video for environment '{environment_name}' with name '{video_name}' already exists"
+                )
+                return
+
             logger.warning(
-                f"Rewrite flag set to False and streamable video for environment '{environment_name}' with name '{video_name}' already exists"
+                f"Streamable video for environment '{environment_name}' with name '{video_name}' was interrupted, resuming"
             )
-            return
+            registered_device_ids = {str(video.device_id) for video in (playset.videos or [])}
+        else:
+            streaming_client.delete_playset_by_name_if_exists(environment_id=environment_id, playset_name=video_name)
+            playset = None
 
-        streaming_client.delete_playset_by_name_if_exists(environment_id=environment_id, playset_name=video_name)
+    # Recorded before the playset exists, so a run killed at any point is resumed rather than taken as complete
+    job_manifest = JobManifest(const.job_manifest_path(output_dir))
+    job_manifest.start()
 
-    playset = streaming_client.create_playset(
-        playset=models.Playset(classroom_id=environment_id, name=video_name, start_time=start, end_time=end)
-    )
+    if playset is None:
+        playset = streaming_client.create_playset(
+            playset=models.Playset(classroom_id=environment_id, name=video_name, start_time=start, end_time=end)
+        )
 
     empty_clip_path = const.empty_clip_path(output_dir)
-    copy_technical_difficulties_clip(clip_path=empty_clip_path, output_path=empty_clip_path, rewrite=rewrite)
+    blank_segment_path = None
+    blank_segment_paths = None
+    if collapse_gaps:
+        # One blank segment per resolution in the ladder
+        blank_segment_path = const.blank_segment_path(output_dir)
+        blank_segment_paths = {None: blank_segment_path}
+        for rendition in renditions:
+            blank_segment_paths[rendition["height"]] = const.blank_segment_path(output_dir, height=rendition["height"])
 
+    copy_technical_difficulties_clip(
+        clip_path=empty_clip_path, output_path=empty_clip_path, rewrite=rewrite, hls_segment_paths=blank_segment_paths
+    )
+
+    camera_jobs = []
     assignments = honeycomb_client.get_assignments(environment_id)
     for _, (assignment_id, device_id, assigned_name) in enumerate(assignments):
         if len(camera) > 0:
@@ -72,46 +166,289 @@ def prepare_videos_for_environment_for_time_range(
                 logger.info(f"Skipping camera '{device_id}:{assigned_name}', not in supplied cameras param")
                 continue
 
-        camera_specific_directory = os.path.join(output_dir, assigned_name)
-        os.makedirs(camera_specific_directory, exist_ok=True)
+        camera_jobs.append((assignment_id, device_id, assigned_name))
 
-        logger.info(f"Fetching video metadata for camera '{device_id}:{assigned_name}' - {start} (start) - {end} (end)")
-        video_metadata = list(
-            fetch_video_metadata_in_range(environment_id=environment_id, device_id=device_id, start=start, end=end)
-        )
+    if len(camera_jobs) == 0:
+        logger.warning(f"No cameras to generate streamable video for in environment '{environment_name}'")
+        job_manifest.complete()
+        return
 
-        logger.info(f"{assigned_name} has {len(video_metadata)} videos between {start} to {end}")
-        if len(video_metadata) == 0:
-            logger.warning(f"No videos for assignment: '{assignment_id}':{assigned_name}")
-
-        streaming_generator = StreamingGenerator(
-            video_metadata=video_metadata,
-            start=start,
-            end=end,
-            output_directory=camera_specific_directory,
-            empty_clip_path=empty_clip_path,
-            raw_video_storage_directory=raw_video_storage_directory,
-        ).load()
-
-        if streaming_generator.file_count() == 0:
-            logger.info(f"No videos found for {device_id}:{assigned_name}, no streamable video to be generated")
-            continue
+    # Every camera's video metadata is fetched up front, with one query per time range (cameras being appended to only
+    # need the appended range) rather than one per camera
+    camera_starts = {
+        device_id: _camera_start(os.path.join(output_dir, assigned_name), start, append_start)
+        for _, device_id, assigned_name in camera_jobs
+    }
+    metadata_cache = None
+    if metadata_cache_directory is not None:
+        metadata_cache = MetadataCache(metadata_cache_directory)
 
-        try:
-            streaming_generator.execute(rewrite=rewrite)
-        except Exception as e:
-            logger.error(f"Exception generating streamable video for {device_id}:{assigned_name}")
-            logger.error(e)
+    metadata_started = time.perf_counter()
+    # Cameras whose feeds an earlier attempt at the append already extended to the end have nothing left to fetch
+    video_metadata_by_device = {
+        device_id: [] for device_id, camera_start in camera_starts.items() if camera_start >= end
+    }
+    for camera_start in sorted(set(camera_starts.values())):
+        if camera_start >= end:
             continue
+        device_ids = [device_id for device_id, device_start in camera_starts.items() if device_start == camera_start]
+        logger.info(f"Fetching video metadata for {len(device_ids)} camera(s) - {camera_start} (start) - {end} (end)")
+        video_metadata_by_device.update(
+            fetch_video_metadata_for_cameras(
+                environment_id=environment_id,
+                device_ids=device_ids,
+                start=camera_start,
+                end=end,
+                metadata_cache=metadata_cache,
+            )
+        )
+    metadata_seconds = time.perf_counter() - metadata_started
 
-        streaming_generator.cleanup(remove_processed_files=remove_video_files_after_processing)
+    # All cameras share a single CPU budget, the container's cgroup limits: the pool runs up to camera_workers pipelines
+    # at once and each camera process's governor gets its share, its ffmpeg processes never run more threads than that
+    governor = resource_governor.governor
+    if camera_workers is None:
+        camera_workers = governor.camera_workers()
+    if camera_executor is None:
+        camera_workers = max(1, min(camera_workers, len(camera_jobs)))
+    camera_share = governor.camera_share(camera_workers)
+    logger.info(
+        f"Preparing {len(camera_jobs)} camera(s) with {camera_workers} parallel worker(s), {camera_share['cpus']} CPU(s) per worker (budget: {governor.describe()})"
+    )
 
-        current_video = models.Video(
-            playset_id=playset.id,
-            device_id=device_id,
-            device_name=assigned_name,
-            url=f"/videos/{environment_id}/{video_name}/{assigned_name}/output.m3u8",
-            preview_url=f"/videos/{environment_id}/{video_name}/{assigned_name}/output-preview.jpg",
-            preview_thumbnail_url=f"/videos/{environment_id}/{video_name}/{assigned_name}/output-preview.jpg",
-        )
-        streaming_client.add_video_to_playset(video=current_video)
+    # A shared executor belongs to the caller, it's left running for the next job
+    with (
+        ProcessPoolExecutor(max_workers=camera_workers) if camera_executor is None else nullcontext(camera_executor)
+    ) as executor:
+        futures = {}
+        failed_cameras = []
+        for assignment_id, device_id, assigned_name in camera_jobs:
+            future = executor.submit(
+                _prepare_camera,
+                assignment_id=assignment_id,
+                device_id=device_id,
+                assigned_name=assigned_name,
+                output_dir=output_dir,
+                start=start,
+                end=end,
+                video_metadata=video_metadata_by_device[device_id],
+                metadata_seconds=metadata_seconds,
+                rewrite=rewrite,
+                empty_clip_path=empty_clip_path,
+                raw_video_storage_directory=raw_video_storage_directory,
+                remove_video_files_after_processing=remove_video_files_after_processing,
+                camera_share=camera_share,
+                single_pass=single_pass,
+                stream_copy=stream_copy,
+                blank_segment_path=blank_segment_path,
+                pipelined=pipelined,
+                read_raw_in_place=read_raw_in_place,
+                clip_cache_directory=clip_cache_directory,
+                clip_cache_max_bytes=clip_cache_max_bytes,
+                renditions=renditions,
+                hls_segment_type=hls_segment_type,
+                thumbnail_interval=thumbnail_interval,
+                append_start=append_start,
+            )
+            futures[future] = (device_id, assigned_name)
+
+        for future in as_completed(futures):
+            device_id, assigned_name = futures[future]
+            try:
+                status, camera_metrics = future.result()
+            except BrokenProcessPool:
+                # A camera process died and took the pool (and every camera still in it) down, the caller has to
+                # replace the pool before the job can be retried
+                raise
+            except Exception as e:
+                logger.error(f"Exception preparing camera {device_id}:{assigned_name}")
+                logger.error(e)
+                job_metrics.add_camera(assigned_name, device_id, status="failed")
+                failed_cameras.append(assigned_name)
+                continue
+
+            job_metrics.add_camera(assigned_name, device_id, status=status, camera_summary=camera_metrics)
+            if status == "failed":
+                failed_cameras.append(assigned_name)
+            if status != "generated":
+                continue
+
+            if str(device_id) in registered_device_ids:
+                logger.info(f"Video for {device_id}:{assigned_name} already registered with playset '{video_name}'")
+                continue
+
+            thumbnails_url = None
+            if os.path.exists(thumbnails.thumbnail_track_path(os.path.join(output_dir, assigned_name))):
+                thumbnails_url = (
+                    f"/videos/{environment_id}/{video_name}/{assigned_name}/{thumbnails.THUMBNAILS_VTT_NAME}"
+                )
+
+            current_video = models.Video(
+                playset_id=playset.id,
+                device_id=device_id,
+                device_name=assigned_name,
+                url=f"/videos/{environment_id}/{video_name}/{assigned_name}/output.m3u8",
+                preview_url=f"/videos/{environment_id}/{video_name}/{assigned_name}/output-preview.jpg",
+                preview_thumbnail_url=f"/videos/{environment_id}/{video_name}/{assigned_name}/output-preview.jpg",
+                thumbnails_url=thumbnails_url,
+            )
+            streaming_client.add_video_to_playset(video=current_video)
+
+    if append_start is not None:
+        if len(failed_cameras) > 0:
+            # The playset keeps its end time so the append is retried. A retry only appends to each camera's feed from
+            # where its stage manifest shows the feed ends, cameras that were appended to aren't appended to again.
+            logger.error(
+                f"Not extending playset '{video_name}' end time from {append_start} to {end}, appending failed for camera(s): {', '.join(failed_cameras)}"
+            )
+        else:
+            streaming_client.update_playset(playset_id=playset.id, playset=models.PlaysetUpdate(end_time=end))
+            logger.info(f"Extended playset '{video_name}' end time from {append_start} to {end}")
+
+    job_manifest.complete()
+
+    job_metrics.finish()
+    if metrics_path is not None:
+        job_metrics.write_json(metrics_path)
+    if prometheus_textfile_path is not None:
+        job_metrics.write_prometheus_textfile(prometheus_textfile_path)
+
+
+def _is_interrupted(output_dir: str) -> bool:
+    """
+    Check whether the run that generated the output directory never completed, or any camera in it has a stage
+    manifest for a pipeline that never completed
+    """
+    if JobManifest(const.job_manifest_path(output_dir)).is_interrupted():
+        return True
+
+    for item in os.listdir(output_dir):
+        manifest_path = const.manifest_path(os.path.join(output_dir, item))
+        if os.path.exists(manifest_path) and not StageManifest(manifest_path).is_complete():
+            return True
+
+    return False
+
+
+def _has_feed(camera_directory: str) -> bool:
+    return os.path.exists(os.path.join(camera_directory, "output.m3u8"))
+
+
+def _camera_start(camera_directory: str, start: datetime.datetime, append_start: Optional[datetime.datetime]):
+    """
+    Cameras with an existing HLS feed are appended to from append_start (if given), the rest are generated from start.
+    A feed that already reaches past append_start (an earlier attempt at the append got further) is appended to from
+    where it ends.
+    """
+    if append_start is None or not _has_feed(camera_directory):
+        return start
+
+    feed_end = StageManifest(const.manifest_path(camera_directory)).feed_end
+    if feed_end is not None and feed_end > append_start:
+        return feed_end
+
+    return append_start
+
+
+def _prepare_camera(
+    assignment_id: str,
+    device_id: str,
+    assigned_name: str,
+    output_dir: str,
+    start: datetime.datetime,
+    end: datetime.datetime,
+    video_metadata: List[dict],
+    rewrite: bool,
+    empty_clip_path: str,
+    raw_video_storage_directory: Optional[str],
+    remove_video_files_after_processing: bool,
+    camera_share: Optional[dict] = None,
+    single_pass: bool = False,
+    stream_copy: bool = False,
+    blank_segment_path: Optional[str] = None,
+    pipelined: bool = False,
+    read_raw_in_place: bool = False,
+    clip_cache_directory: Optional[str] = None,
+    clip_cache_max_bytes: Optional[int] = None,
+    renditions: Optional[List[dict]] = None,
+    hls_segment_type: str = "mpegts",
+    thumbnail_interval: Optional[int] = None,
+    metadata_seconds: float = 0,
+    append_start: Optional[datetime.datetime] = None,
+) -> Tuple[str, Optional[dict]]:
+    """
+    Generate streamable video for a single camera. Runs in a camera pool worker process.
+
+    If append_start is given, only video from append_start to end is generated and appended to the camera's existing
+    HLS feed. Cameras without an existing feed get video generated for the full start to end range. video_metadata is
+    the camera's video metadata for that range (see _camera_start).
+
+    :param metadata_seconds: wall time of the job's metadata query, recorded as the camera's metadata stage
+    :param camera_share: the camera's share of the resource budget (see ResourceGovernor.camera_share), by default the
+                         whole budget
+    :return: tuple of the camera's status and its metrics summary. Status is "generated" if streamable video was
+             generated and should be added to the playset, "skipped" if the camera had no video and "failed" otherwise.
+    """
+    # Camera processes are reused across cameras and jobs, the budget is set for every camera
+    resource_governor.configure(**(camera_share or {}))
+
+    camera_specific_directory = os.path.join(output_dir, assigned_name)
+    os.makedirs(camera_specific_directory, exist_ok=True)
+
+    append = False
+    if append_start is not None:
+        if _has_feed(camera_specific_directory):
+            start = _camera_start(camera_specific_directory, start, append_start)
+            append = True
+            if start >= end:
+                logger.info(
+                    f"Video for {device_id}:{assigned_name} already appended through {start}, nothing to append"
+                )
+                return "generated", None
+        else:
+            logger.info(f"No existing video for {device_id}:{assigned_name} to append to, generating full video")
+
+    logger.info(f"{assigned_name} has {len(video_metadata)} videos between {start} to {end}")
+    if len(video_metadata) == 0:
+        logger.warning(f"No videos for assignment: '{assignment_id}':{assigned_name}")
+
+    clip_cache = None
+    if clip_cache_directory is not None:
+        clip_cache = ClipCache(cache_directory=clip_cache_directory, max_bytes=clip_cache_max_bytes)
+
+    streaming_generator = StreamingGenerator(
+        video_metadata=video_metadata,
+        start=start,
+        end=end,
+        output_directory=camera_specific_directory,
+        empty_clip_path=empty_clip_path,
+        raw_video_storage_directory=raw_video_storage_directory,
+        single_pass=single_pass,
+        stream_copy=stream_copy,
+        append=append,
+        collapse_gaps=blank_segment_path is not None,
+        blank_segment_path=blank_segment_path,
+        pipelined=pipelined,
+        remove_encoded_clips=remove_video_files_after_processing,
+        read_raw_in_place=read_raw_in_place,
+        clip_cache=clip_cache,
+        renditions=renditions,
+        hls_segment_type=hls_segment_type,
+        thumbnail_interval=thumbnail_interval,
+    ).load()
+    streaming_generator.metrics.record("metadata", {"wall_seconds": metadata_seconds})
+
+    if streaming_generator.file_count() == 0:
+        logger.info(f"No videos found for {device_id}:{assigned_name}, no streamable video to be generated")
+        return "skipped", streaming_generator.metrics_summary()
+
+    try:
+        streaming_generator.execute(rewrite=rewrite)
+    except Exception as e:
+        logger.error(f"Exception generating streamable video for {device_id}:{assigned_name}")
+        logger.error(e)
+        return "failed", streaming_generator.metrics_summary()
+
+    camera_metrics = streaming_generator.metrics_summary()
+    streaming_generator.cleanup(remove_processed_files=remove_video_files_after_processing)
+    return "generated", camera_metrics
@@ -0,0 +1,206 @@
+import json
+import os
+import selectors
+import subprocess
+import time
+from typing import Callable, List, Optional
+
+import ffmpeg
+
+from .governor import governor
+from .log import logger
+from .util import convert_kwargs_to_cmd_line_args
+
+
+# An ffmpeg process whose progress hasn't advanced for this long is considered stuck and killed
+STALL_TIMEOUT_SECONDS = int(os.getenv("FFMPEG_STALL_TIMEOUT_SECONDS", 300))
+# How often a running ffmpeg process's progress (frame, fps, speed, out_time) is logged
+PROGRESS_LOG_SECONDS = int(os.getenv("FFMPEG_PROGRESS_LOG_SECONDS", 60))
+# Trailing stderr kept for error messages
+STDERR_TAIL_BYTES = 64 * 1024
+
+READ_SIZE = 64 * 1024
+
+
+class FfmpegStalled(ffmpeg.Error):
+    """
+    Raised when an ffmpeg process stops making progress and is killed. Subclasses ffmpeg.Error so stalls are handled
+    wherever a failed ffmpeg run is.
+    """
+
+
+class FfmpegProgress:
+    """
+    Parser for ffmpeg's -progress output: blocks of key=value lines, each ending with progress=continue (or
+    progress=end for the last block)
+    """
+
+    # Keys that only grow while ffmpeg is making progress
+    ADVANCING_KEYS = ["frame", "out_time_us", "total_size"]
+
+    def __init__(self):
+        self.current = {}
+        self.latest = {}
+        self.blocks = 0
+        self._partial = b""
+
+    def feed(self, data) -> bool:
+        """
+        Parse a chunk of progress output
+
+        :return: True if a completed progress block moved any of the advancing keys forward
+        """
+        advanced = False
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            key, _, value = line.decode("utf-8", errors="replace").strip().partition("=")
+            if key == "":
+                continue
+
+            self.current[key] = value.strip()
+            if key == "progress":
+                advanced = self._advanced(self.current) or advanced
+                self.latest = self.current
+                self.current = {}
+                self.blocks += 1
+
+        return advanced
+
+    def _advanced(self, block):
+        for key in self.ADVANCING_KEYS:
+            try:
+                if int(block.get(key, 0)) > int(self.latest.get(key, 0)):
+                    return True
+            except ValueError:
+                continue
+        return False
+
+    def describe(self):
+        return ", ".join(
+            f"{key}={self.latest[key]}" for key in ["frame", "fps", "speed", "out_time"] if key in self.latest
+        )
+
+
+def run(
+    args: List[str],
+    description: Optional[str] = None,
+    stall_timeout: Optional[float] = STALL_TIMEOUT_SECONDS,
+    progress: bool = True,
+    on_progress: Optional[Callable[[dict], None]] = None,
+    threads: int = 1,
+) -> bytes:
+    """
+    Run an ffmpeg/ffprobe command and supervise it until it exits. stdout and stderr are read through a selector in the
+    calling thread, no reader threads are started.
+
+    With progress enabled (ffmpeg only), "-progress pipe:1 -nostats" is added to the command. Progress is logged every
+    PROGRESS_LOG_SECONDS and the process is killed if frame, out_time and total_size all stop advancing for
+    stall_timeout seconds. Without progress, stdout is captured and returned and the process is killed if it writes
+    nothing for stall_timeout seconds.
+
+    The process holds `threads` of the governor's CPU slots while it runs, it waits for them before it's started. The
+    command itself should be limited to as many threads (-threads).
+
+    :param on_progress: called with each progress block that shows ffmpeg advancing (a dict of ffmpeg's progress keys)
+    :param threads: CPU slots the process holds
+    :raises FfmpegStalled: if the process stalled
+    :raises ffmpeg.Error: if the process exited with a non-zero code
+    :return: the process's stdout (empty with progress enabled, progress is written to stdout)
+    """
+    if progress:
+        args = [args[0], "-progress", "pipe:1", "-nostats"] + list(args[1:])
+    if description is None:
+        description = os.path.basename(args[-1])
+
+    with governor.ffmpeg_slot(threads):
+        return _supervise(args, description, stall_timeout, progress, on_progress)
+
+
+def _supervise(args, description, stall_timeout, progress, on_progress):
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    parser = FfmpegProgress()
+    stdout = bytearray()
+    stderr = bytearray()
+    stderr_partial = b""
+
+    started = time.monotonic()
+    last_advance = started
+    last_log = started
+    stalled = False
+    with selectors.DefaultSelector() as selector:
+        selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+        selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+        try:
+            while len(selector.get_map()) > 0:
+                for key, _ in selector.select(timeout=1):
+                    data = os.read(key.fd, READ_SIZE)
+                    if not data:
+                        selector.unregister(key.fileobj)
+                        continue
+
+                    if key.data == "stderr":
+                        # stderr only carries warnings and errors, they're logged as they arrive
+                        lines = (stderr_partial + data).split(b"\n")
+                        stderr_partial = lines.pop()
+                        for line in lines:
+                            if line.strip():
+                                logger.warning(f"{description}: {line.decode('utf-8', errors='replace').rstrip()}")
+                        stderr.extend(data)
+                        del stderr[:-STDERR_TAIL_BYTES]
+                        if not progress:
+                            last_advance = time.monotonic()
+                    elif progress:
+                        if parser.feed(data):
+                            last_advance = time.monotonic()
+                            if on_progress is not None:
+                                on_progress(parser.latest)
+                    else:
+                        stdout.extend(data)
+                        last_advance = time.monotonic()
+
+                now = time.monotonic()
+                if progress and parser.blocks > 0 and now - last_log >= PROGRESS_LOG_SECONDS:
+                    logger.info(f"{description}: {parser.describe()} ({now - started:.0f}s)")
+                    last_log = now
+
+                if stall_timeout is not None and now - last_advance > stall_timeout:
+                    stalled = True
+                    break
+        finally:
+            if stalled or len(selector.get_map()) > 0:
+                process.kill()
+            process.stdout.close()
+            process.stderr.close()
+
+    return_code = process.wait()
+    if stalled:
+        logger.error(f"{description}: no progress for {stall_timeout}s, killed ffmpeg ({parser.describe()})")
+        raise FfmpegStalled(args[0], bytes(stdout), bytes(stderr))
+    if return_code != 0:
+        raise ffmpeg.Error(args[0], bytes(stdout), bytes(stderr))
+
+    if progress and time.monotonic() - started >= PROGRESS_LOG_SECONDS:
+        logger.info(f"{description}: done, {parser.describe()} ({time.monotonic() - started:.0f}s)")
+    return bytes(stdout)
+
+
+def run_stream(stream, description: Optional[str] = None, **kwargs) -> bytes:
+    """
+    Run an ffmpeg-python stream (i.e. ffmpeg.input(...).output(...)) through the supervisor
+    """
+    return run(stream.compile(), description=description, **kwargs)
+
+
+def probe(filename, cmd="ffprobe", timeout: Optional[float] = STALL_TIMEOUT_SECONDS, **kwargs) -> dict:
+    """
+    ffmpeg.probe run through the supervisor
+
+    :raises ffmpeg.Error: if ffprobe fails
+    """
+    args = [cmd, "-v", "error", "-show_format", "-show_streams", "-of", "json"]
+    args += convert_kwargs_to_cmd_line_args(kwargs)
+    args += [filename]
+    return json.loads(
+        run(args, description=f"ffprobe {os.path.basename(filename)}", stall_timeout=timeout, progress=False)
+    )
@@ -0,0 +1,197 @@
+from collections import deque
+from contextlib import contextmanager
+import math
+import os
+import threading
+from typing import Optional
+
+from .log import logger
+
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Memory budgeted for one camera pipeline (its ffmpeg encodes, probe cache and section buffers), bounds how many
+# cameras are prepared at once
+CAMERA_MEMORY_BYTES = int(os.getenv("CAMERA_MEMORY_BYTES", 1536 * 1024 * 1024))
+# Concurrent downloads and copies per camera, they wait on the network/disk rather than the CPU
+IO_WORKERS = int(os.getenv("IO_WORKERS", 16))
+# CPU slots an encode leaves free for probes and validations, so a pipelined run keeps probing the next section while
+# the current one is encoded
+PROBE_RESERVED_CPUS = int(os.getenv("PROBE_RESERVED_CPUS", 1))
+# cgroup v1 reports "no limit" as a huge page aligned number rather than "max"
+_UNLIMITED_BYTES = 1 << 60
+
+
+def _read(path):
+    try:
+        with open(path, "r", encoding="utf-8") as fp:
+            return fp.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(cgroup_root=CGROUP_ROOT) -> Optional[float]:
+    """
+    CPUs the container's cgroup quota allows (cgroup v2 cpu.max, falling back to v1's CFS quota), None if unlimited
+
+    A k8s CPU limit is enforced as a quota of CPU time per period, running more busy threads than the quota allows
+    doesn't go any faster, the whole cgroup is throttled until the next period.
+    """
+    cpu_max = _read(os.path.join(cgroup_root, "cpu.max"))
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(" ")
+        if quota == "max":
+            return None
+        return int(quota) / int(period or 100000)
+
+    for cpu_directory in ["cpu", "cpu,cpuacct"]:
+        quota = _read(os.path.join(cgroup_root, cpu_directory, "cpu.cfs_quota_us"))
+        period = _read(os.path.join(cgroup_root, cpu_directory, "cpu.cfs_period_us"))
+        if quota is not None and period is not None:
+            if int(quota) <= 0:
+                return None
+            return int(quota) / int(period)
+
+    return None
+
+
+def cgroup_memory_limit(cgroup_root=CGROUP_ROOT) -> Optional[int]:
+    """
+    Memory limit of the container's cgroup in bytes (cgroup v2 memory.max, falling back to v1), None if unlimited
+    """
+    memory_max = _read(os.path.join(cgroup_root, "memory.max"))
+    if memory_max is not None:
+        return None if memory_max == "max" else int(memory_max)
+
+    limit = _read(os.path.join(cgroup_root, "memory", "memory.limit_in_bytes"))
+    if limit is not None and int(limit) < _UNLIMITED_BYTES:
+        return int(limit)
+
+    return None
+
+
+def available_cpus() -> int:
+    """
+    Whole CPUs this process can keep busy: the CPUs it may be scheduled on, capped by the cgroup quota
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = cgroup_cpu_limit()
+    if quota is not None:
+        # A fractional quota (i.e. 1.5 CPUs) can't keep another thread busy without being throttled
+        cpus = min(cpus, math.floor(quota))
+
+    return max(1, cpus)
+
+
+class ResourceGovernor:
+    """
+    Hands out the CPU budget of a process to the ffmpeg processes it runs.
+
+    The budget is a pool of CPU slots, one per CPU. Every ffmpeg/ffprobe invocation holds as many slots as the threads
+    it's given (-threads) for as long as it runs, invocations that don't fit wait for running ones to exit. Waiting
+    invocations are started in order, so a long encode isn't starved by a stream of probes. Encodes leave
+    PROBE_RESERVED_CPUS slots free, probes keep running (one at a time per reserved slot) alongside an encode.
+
+    Camera pool processes are configured with their share of the budget (see camera_share), a camera never runs more
+    ffmpeg threads than its share so all cameras together stay within the cgroup's CPU limit.
+    """
+
+    def __init__(self, cpus: Optional[int] = None, memory_bytes: Optional[int] = None):
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        self._slots_in_use = 0
+        self.cpus = 1
+        self.memory_bytes = None
+        self.configure(cpus=cpus, memory_bytes=memory_bytes)
+
+    def configure(self, cpus: Optional[int] = None, memory_bytes: Optional[int] = None):
+        """
+        Set the budget, by default the CPUs and memory the container's cgroup allows
+        """
+        with self._condition:
+            self.cpus = max(1, int(cpus)) if cpus is not None else available_cpus()
+            self.memory_bytes = memory_bytes if memory_bytes is not None else cgroup_memory_limit()
+            self._condition.notify_all()
+
+    def ffmpeg_threads(self) -> int:
+        """
+        Threads for an encode: the budget less PROBE_RESERVED_CPUS slots, which stay free for probes while it runs.
+        Concurrent encodes take turns.
+        """
+        return max(1, self.cpus - max(0, PROBE_RESERVED_CPUS))
+
+    def io_workers(self) -> int:
+        """
+        Threads for concurrent downloads and copies
+        """
+        return max(1, IO_WORKERS)
+
+    def probe_workers(self) -> int:
+        """
+        Threads for concurrent probes/validations. Each one runs an ffprobe holding a slot, twice the slots keeps every
+        slot busy while the rest wait on their files.
+        """
+        return 2 * self.cpus
+
+    def camera_workers(self) -> int:
+        """
+        How many cameras to prepare at once: half the CPUs (each camera gets two, its encodes and its probes keep one
+        busy each), fewer if the memory limit can't hold that many camera pipelines
+        """
+        workers = max(1, self.cpus // 2)
+        if self.memory_bytes is not None:
+            workers = min(workers, max(1, self.memory_bytes // CAMERA_MEMORY_BYTES))
+        return workers
+
+    def camera_share(self, camera_workers: int) -> dict:
+        """
+        Budget of each of camera_workers camera processes, keyword arguments for configure()
+        """
+        camera_workers = max(1, camera_workers)
+        return {
+            "cpus": max(1, self.cpus // camera_workers),
+            "memory_bytes": None if self.memory_bytes is None else self.memory_bytes // camera_workers,
+        }
+
+    @contextmanager
+    def ffmpeg_slot(self, threads: int = 1):
+        """
+        Hold CPU slots for an ffmpeg process while it runs
+
+        :param threads: slots to hold, capped at the budget
+        :return: the number of slots held
+        """
+        ticket = object()
+        with self._condition:
+            threads = max(1, min(int(threads), self.cpus))
+            self._waiting.append(ticket)
+            self._condition.wait_for(
+                lambda: self._waiting[0] is ticket
+                and (self._slots_in_use == 0 or self._slots_in_use + threads <= self.cpus)
+            )
+            self._waiting.popleft()
+            self._slots_in_use += threads
+            self._condition.notify_all()
+
+        try:
+            yield threads
+        finally:
+            with self._condition:
+                self._slots_in_use -= threads
+                self._condition.notify_all()
+
+    def describe(self) -> str:
+        memory = "unlimited" if self.memory_bytes is None else f"{self.memory_bytes / (1024 * 1024):.0f}MiB"
+        return f"{self.cpus} CPU(s), {memory} memory"
+
+
+# Budget of this process. Camera pool processes configure it with their share of the parent's budget.
+governor = ResourceGovernor()
+
+
+def configure(cpus: Optional[int] = None, memory_bytes: Optional[int] = None):
+    governor.configure(cpus=cpus, memory_bytes=memory_bytes)
+    logger.debug(f"Resource governor budget: {governor.describe()}")
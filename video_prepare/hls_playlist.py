@@ -0,0 +1,141 @@
+import glob
+import os
+
+
+def media_playlist_paths(hls_directory):
+    """
+    Paths to the media (variant) playlists written alongside an HLS master playlist, ordered by variant index
+    """
+    return sorted(glob.glob(os.path.join(hls_directory, "output_stream_*.m3u8")))
+
+
+def read_media_playlist(playlist_path):
+    """
+    Parse an HLS media playlist
+
+    :param playlist_path: Path to a media playlist
+    :return: tuple of the playlist's header lines, its segments and whether the playlist is ended (#EXT-X-ENDLIST).
+             Segments are dicts with the segment's duration, uri and any tags preceding the segment's EXTINF.
+    """
+    header = []
+    segments = []
+    ended = False
+
+    tags = []
+    duration = None
+    with open(playlist_path, "r", encoding="utf-8") as fp:
+        for line in fp:
+            line = line.strip()
+            if line == "":
+                continue
+
+            if line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:") :].split(",")[0])
+            elif line == "#EXT-X-ENDLIST":
+                ended = True
+            elif line.startswith("#"):
+                if _is_segment_tag(line):
+                    tags.append(line)
+                elif len(segments) == 0 and duration is None:
+                    header.append(line)
+            elif duration is not None:
+                segments.append({"duration": duration, "uri": line, "tags": tags})
+                tags = []
+                duration = None
+
+    return header, segments, ended
+
+
+def write_media_playlist(playlist_path, header, segments, ended=True):
+    tmp_path = f"{playlist_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        for line in header:
+            fp.write(f"{line}\n")
+
+        for segment in segments:
+            for tag in segment["tags"]:
+                fp.write(f"{tag}\n")
+            fp.write(f"#EXTINF:{segment['duration']:.6f},\n")
+            fp.write(f"{segment['uri']}\n")
+
+        if ended:
+            fp.write("#EXT-X-ENDLIST\n")
+    os.replace(tmp_path, playlist_path)
+
+
+def parse_media_playlist(playlist_path):
+    _, segments, _ = read_media_playlist(playlist_path)
+    return segments
+
+
+def playlist_length(playlist_path):
+    """
+    :return: tuple of the number of segments in a media playlist and their total duration in seconds
+    """
+    segments = parse_media_playlist(playlist_path)
+    return len(segments), sum(segment["duration"] for segment in segments)
+
+
+def mark_discontinuity(playlist_path, segment_index):
+    """
+    Tag a media playlist's segment with EXT-X-DISCONTINUITY, i.e. where the segments appended to a feed were encoded
+    differently from the segments before them
+
+    :param segment_index: Index of the segment to tag, nothing is changed if the playlist doesn't have that many
+    """
+    header, segments, ended = read_media_playlist(playlist_path)
+    if segment_index >= len(segments) or "#EXT-X-DISCONTINUITY" in segments[segment_index]["tags"]:
+        return
+
+    segments[segment_index]["tags"] = ["#EXT-X-DISCONTINUITY"] + segments[segment_index]["tags"]
+    write_media_playlist(playlist_path, header, segments, ended=ended)
+
+
+def insert_gap_segments(playlist_path, timeline, gap_segment_uri, slot_seconds=10, first_segment=0):
+    """
+    Lay the encoded segments of a media playlist out on a timeline with gaps. The encoded segments only cover the
+    timeline's "video" runs, back to back. Every slot of a "gap" run is filled with a reference to a shared,
+    pre-encoded blank segment. Each blank segment reference is preceded by an EXT-X-DISCONTINUITY tag, the blank
+    segment's timestamps start over every time it repeats, as does the first video segment after a gap.
+
+    :param playlist_path: Path to a media playlist
+    :param timeline: list of [kind, slot count] runs where kind is "video" or "gap"
+    :param gap_segment_uri: URI of the blank segment, relative to the playlist
+    :param slot_seconds: Length of a timeline slot (and the blank segment)
+    :param first_segment: Index of the first segment the timeline applies to, earlier segments are left untouched
+    """
+    header, segments, ended = read_media_playlist(playlist_path)
+
+    laid_out = segments[:first_segment]
+    encoded = iter(segments[first_segment:])
+    pending = next(encoded, None)
+    for kind, slots in timeline:
+        if kind == "gap":
+            for _ in range(slots):
+                tags = ["#EXT-X-DISCONTINUITY"] if len(laid_out) > 0 else []
+                laid_out.append({"duration": float(slot_seconds), "uri": gap_segment_uri, "tags": tags})
+        else:
+            # Segments are cut on slot boundaries, so a run of video covers the segments that start within it
+            run_duration = slots * slot_seconds
+            elapsed = 0.0
+            first_in_run = True
+            while pending is not None and elapsed < run_duration - slot_seconds / 2:
+                follows_gap = len(laid_out) > 0 and laid_out[-1]["uri"] == gap_segment_uri
+                if first_in_run and follows_gap and "#EXT-X-DISCONTINUITY" not in pending["tags"]:
+                    pending["tags"] = ["#EXT-X-DISCONTINUITY"] + pending["tags"]
+                first_in_run = False
+
+                laid_out.append(pending)
+                elapsed += pending["duration"]
+                pending = next(encoded, None)
+
+    # Anything left over (shouldn't happen) is kept rather than dropped
+    while pending is not None:
+        laid_out.append(pending)
+        pending = next(encoded, None)
+
+    write_media_playlist(playlist_path, header, laid_out, ended=ended)
+
+
+def _is_segment_tag(line):
+    return line.split(":")[0] in ["#EXT-X-DISCONTINUITY", "#EXT-X-BYTERANGE", "#EXT-X-MAP", "#EXT-X-PROGRAM-DATE-TIME"]
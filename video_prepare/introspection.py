@@ -1,36 +1,94 @@
+import random
 import time
-from datetime import datetime
+from typing import Dict, List, Optional
 
 import requests
 import video_io
 
 from .log import logger
+from .metadata_cache import MetadataCache
 from . import util
 
 
-def fetch_video_metadata_in_range(environment_id, device_id, start, end):
-    start_datetime = start
-    if not isinstance(start, datetime):
-        start_datetime = util.str_to_date(start)
-    end_datetime = end
-    if isinstance(end, datetime):
-        end_datetime = util.str_to_date(end)
-
-    def _fetch(retry=0):
-        try:
-            return video_io.fetch_video_metadata(
-                start=start_datetime,
-                end=end_datetime,
-                environment_id=environment_id,
-                camera_device_ids=[device_id],
-            )
-        except requests.exceptions.HTTPError as e:
-            logger.warning(f"video_io.fetch_video_metadata failed w/ {e.response.status_code} code: {e}")
-            if retry >= 3:
-                raise e
-
-            time.sleep(0.5)
-            return _fetch(retry + 1)
-
-    videos = _fetch()
-    return videos
+# A failed metadata query is retried this many times, backing off exponentially (with jitter) between attempts
+FETCH_RETRIES = 3
+RETRY_BASE_SECONDS = 1
+RETRY_MAX_SECONDS = 30
+
+
+def _retry_delay(retry, error):
+    response = getattr(error, "response", None)
+    if response is not None:
+        # Honor the service's own back off when it's rate limiting
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None and retry_after.isdigit():
+            return min(RETRY_MAX_SECONDS, int(retry_after))
+
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2**retry)
+    return random.uniform(delay / 2, delay)
+
+
+def fetch_video_metadata_for_cameras(
+    environment_id, device_ids, start, end, metadata_cache: Optional[MetadataCache] = None
+) -> Dict[str, List[dict]]:
+    """
+    Video metadata of many cameras between start and end, fetched with a single (paginated) query for all of them and
+    partitioned by camera
+
+    :param metadata_cache: Optional MetadataCache, only the parts of the range it doesn't have are queried
+    :return: dict of device id to the camera's video metadata
+    """
+    start_datetime = util.str_to_date(start)
+    end_datetime = util.str_to_date(end)
+
+    def _fetch(fetch_start, fetch_end, fetch_device_ids):
+        for retry in range(FETCH_RETRIES + 1):
+            try:
+                videos = video_io.fetch_video_metadata(
+                    start=fetch_start,
+                    end=fetch_end,
+                    environment_id=environment_id,
+                    camera_device_ids=list(fetch_device_ids),
+                )
+                break
+            except (
+                requests.exceptions.HTTPError,
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                status_code = e.response.status_code if e.response is not None else None
+                logger.warning(f"video_io.fetch_video_metadata failed w/ {status_code} code: {e}")
+                if retry >= FETCH_RETRIES:
+                    raise e
+
+                time.sleep(_retry_delay(retry, e))
+
+        if len(fetch_device_ids) == 1:
+            return {fetch_device_ids[0]: list(videos)}
+
+        videos_by_device = {device_id: [] for device_id in fetch_device_ids}
+        device_ids_by_str = {str(device_id): device_id for device_id in fetch_device_ids}
+        for video in videos:
+            device_id = device_ids_by_str.get(str(video.get("device_id")))
+            if device_id is not None:
+                videos_by_device[device_id].append(video)
+        return videos_by_device
+
+    device_ids = list(device_ids)
+    if len(device_ids) == 0:
+        return {}
+    if metadata_cache is None:
+        return _fetch(start_datetime, end_datetime, device_ids)
+
+    return metadata_cache.fetch(environment_id, device_ids, start_datetime, end_datetime, _fetch)
+
+
+def fetch_video_metadata_in_range(
+    environment_id, device_id, start, end, metadata_cache: Optional[MetadataCache] = None
+) -> List[dict]:
+    """
+    Video metadata of a camera between start and end
+    """
+    return fetch_video_metadata_for_cameras(
+        environment_id, [device_id], start=start, end=end, metadata_cache=metadata_cache
+    )[device_id]
@@ -0,0 +1,184 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from . import util
+from .const import INVENTORY_FORMATS
+from .governor import governor
+from .introspection import fetch_video_metadata_for_cameras
+from .log import logger
+from .metadata_cache import MetadataCache
+
+
+INVENTORY_COLUMNS = ["assignment_id", "device_id", "assigned_name", "timestamp", "data_id"]
+
+
+def _time_chunks(start: datetime, end: datetime, chunk: timedelta) -> List[Tuple[datetime, datetime]]:
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + chunk, end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    return chunks
+
+
+def inventory_rows(
+    environment_id,
+    camera_assignments: List[Tuple[str, str, str]],
+    start: datetime,
+    end: datetime,
+    chunk: timedelta = timedelta(days=1),
+    workers: Optional[int] = None,
+    metadata_cache: Optional[MetadataCache] = None,
+) -> Iterator[List[tuple]]:
+    """
+    Video inventory of the cameras between start and end, as lists of rows (see INVENTORY_COLUMNS) per chunk of time.
+
+    The range is split into chunks that are fetched concurrently, each with one query for every camera. Chunks are
+    yielded in order as soon as they (and every chunk before them) arrive, at most a few chunks are held in memory.
+
+    :param camera_assignments: list of (assignment_id, device_id, assigned_name) tuples
+    :param workers: number of chunks fetched at once, by default the resource governor's I/O workers
+    """
+    if workers is None:
+        workers = governor.io_workers()
+
+    device_ids = [device_id for _, device_id, _ in camera_assignments]
+
+    def _fetch(time_range):
+        chunk_start, chunk_end = time_range
+        videos_by_device = fetch_video_metadata_for_cameras(
+            environment_id=environment_id,
+            device_ids=device_ids,
+            start=chunk_start,
+            end=chunk_end,
+            metadata_cache=metadata_cache,
+        )
+        return [
+            (
+                assignment_id,
+                device_id,
+                assigned_name,
+                util.str_to_date(video["video_timestamp"]),
+                video["data_id"],
+            )
+            for assignment_id, device_id, assigned_name in camera_assignments
+            for video in videos_by_device[device_id]
+        ]
+
+    chunks = deque(_time_chunks(start, end, chunk))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while len(chunks) > 0 or len(pending) > 0:
+            while len(chunks) > 0 and len(pending) < 2 * workers:
+                pending.append(executor.submit(_fetch, chunks.popleft()))
+            yield pending.popleft().result()
+
+
+class CsvInventoryWriter:
+    """
+    Inventory rows as CSV, values are quoted and escaped as needed and timestamps written in ISO 8601
+    """
+
+    def __init__(self, path):
+        self._fp = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._fp)
+        self._writer.writerow(INVENTORY_COLUMNS)
+
+    def write(self, rows: List[tuple]):
+        self._writer.writerows(
+            (assignment_id, device_id, assigned_name, timestamp.isoformat(), data_id)
+            for assignment_id, device_id, assigned_name, timestamp, data_id in rows
+        )
+
+    def close(self):
+        self._fp.close()
+
+
+class ArrowInventoryWriter:
+    """
+    Inventory rows as Parquet or an Arrow IPC file, written a record batch per chunk. Timestamps are typed
+    (timestamp[us, UTC]) columns. Requires pyarrow, which is an optional dependency.
+    """
+
+    def __init__(self, path, output_format):
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(
+                f"Writing {output_format} inventories requires pyarrow, install the 'inventory' extra (poetry install --extras inventory)"
+            ) from e
+
+        self._pa = pyarrow
+        self.schema = pyarrow.schema(
+            [
+                ("assignment_id", pyarrow.string()),
+                ("device_id", pyarrow.string()),
+                ("assigned_name", pyarrow.string()),
+                ("timestamp", pyarrow.timestamp("us", tz="UTC")),
+                ("data_id", pyarrow.string()),
+            ]
+        )
+        if output_format == "parquet":
+            self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+        else:
+            self._writer = pyarrow.ipc.new_file(path, self.schema)
+
+    def write(self, rows: List[tuple]):
+        if len(rows) == 0:
+            return
+
+        columns = [list(column) for column in zip(*rows)]
+        for index in [0, 1, 2, 4]:
+            columns[index] = [str(value) for value in columns[index]]
+        self._writer.write_table(self._pa.Table.from_pydict(dict(zip(INVENTORY_COLUMNS, columns)), schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+def export_inventory(
+    path,
+    environment_id,
+    camera_assignments: List[Tuple[str, str, str]],
+    start: datetime,
+    end: datetime,
+    output_format: str = "csv",
+    chunk: timedelta = timedelta(days=1),
+    workers: Optional[int] = None,
+    metadata_cache: Optional[MetadataCache] = None,
+) -> int:
+    """
+    Write the video inventory of the cameras between start and end to path, streaming rows to the file as they're
+    fetched
+
+    :param output_format: "csv", "parquet" or "arrow"
+    :return: number of rows written
+    """
+    if output_format not in INVENTORY_FORMATS:
+        raise ValueError(f"Unknown inventory format '{output_format}', expected one of {INVENTORY_FORMATS}")
+
+    writer = CsvInventoryWriter(path) if output_format == "csv" else ArrowInventoryWriter(path, output_format)
+    row_count = 0
+    try:
+        for rows in inventory_rows(
+            environment_id,
+            camera_assignments,
+            start=start,
+            end=end,
+            chunk=chunk,
+            workers=workers,
+            metadata_cache=metadata_cache,
+        ):
+            writer.write(rows)
+            row_count += len(rows)
+    finally:
+        writer.close()
+
+    logger.info(f"Wrote {row_count} videos of {len(camera_assignments)} camera(s) to '{path}'")
+    return row_count
@@ -0,0 +1,217 @@
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import socket
+import sqlite3
+from typing import List, Optional
+
+import pytz
+
+from .log import logger
+from .util import DateTimeEncoder, str_to_date
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_STATUSES = [JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED]
+
+# Job params that are datetimes, stored as ISO strings
+JOB_DATETIME_PARAMS = ["start", "end"]
+
+
+class JobQueue:
+    """
+    Durable queue of prepare jobs, stored in a local SQLite database so queued jobs survive worker restarts.
+
+    A job is the set of keyword arguments for core.prepare_videos_for_environment_for_time_range (environment, time
+    range, cameras and options). Jobs are claimed in the order they were queued. A job claimed by a worker that died
+    before finishing it is put back on the queue when a worker on the same host starts, until it has used up its
+    attempts.
+    """
+
+    def __init__(self, queue_path, max_attempts: int = 3):
+        self.queue_path = queue_path
+        self.max_attempts = max_attempts
+
+        queue_directory = os.path.dirname(os.path.abspath(queue_path))
+        os.makedirs(queue_directory, exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS job (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    params TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    claimed_by TEXT,
+                    error TEXT,
+                    queued_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS job_status ON job (status, id)")
+
+    @contextmanager
+    def _connect(self):
+        connection = sqlite3.connect(self.queue_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Write transaction that holds the database's write lock from the start, so a job can't be claimed twice
+        """
+        with self._connect() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield connection
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    @staticmethod
+    def _now():
+        return datetime.now(tz=pytz.UTC).isoformat()
+
+    @staticmethod
+    def _worker_id():
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @staticmethod
+    def _decode_params(params):
+        params = json.loads(params)
+        for key in JOB_DATETIME_PARAMS:
+            if params.get(key) is not None:
+                params[key] = str_to_date(params[key])
+        return params
+
+    def _to_job(self, row):
+        job = dict(row)
+        job["params"] = self._decode_params(job["params"])
+        return job
+
+    def enqueue(self, params: dict) -> int:
+        """
+        Add a job to the end of the queue
+
+        :param params: keyword arguments for core.prepare_videos_for_environment_for_time_range
+        :return: the job's id
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "INSERT INTO job (params, status, queued_at) VALUES (?, ?, ?)",
+                (json.dumps(params, cls=DateTimeEncoder), JOB_QUEUED, self._now()),
+            )
+            job_id = cursor.lastrowid
+
+        logger.info(f"Queued job {job_id}")
+        return job_id
+
+    def claim(self) -> Optional[dict]:
+        """
+        Mark the oldest queued job as running
+
+        :return: the job (id, params, attempts...) or None if the queue is empty
+        """
+        with self._transaction() as connection:
+            row = connection.execute("SELECT * FROM job WHERE status = ? ORDER BY id LIMIT 1", (JOB_QUEUED,)).fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                "UPDATE job SET status = ?, attempts = attempts + 1, claimed_by = ?, started_at = ? WHERE id = ?",
+                (JOB_RUNNING, self._worker_id(), self._now(), row["id"]),
+            )
+
+        job = self._to_job(row)
+        job["status"] = JOB_RUNNING
+        job["attempts"] += 1
+        return job
+
+    def complete(self, job_id: int):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE job SET status = ?, error = NULL, finished_at = ? WHERE id = ?",
+                (JOB_SUCCEEDED, self._now(), job_id),
+            )
+
+    def fail(self, job_id: int, error: str):
+        """
+        Record a job's failure. Jobs with attempts left go back on the queue.
+        """
+        with self._transaction() as connection:
+            row = connection.execute("SELECT attempts FROM job WHERE id = ?", (job_id,)).fetchone()
+            status = JOB_QUEUED if row is not None and row["attempts"] < self.max_attempts else JOB_FAILED
+            connection.execute(
+                "UPDATE job SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, error, self._now(), job_id),
+            )
+
+        if status == JOB_QUEUED:
+            logger.warning(f"Job {job_id} failed, requeued: {error}")
+        else:
+            logger.error(f"Job {job_id} failed after {self.max_attempts} attempts: {error}")
+
+    def requeue_abandoned(self) -> int:
+        """
+        Put running jobs that were claimed by a worker process on this host that no longer exists back on the queue.
+        Call before the worker claims any jobs, a restarted container's worker can get the same pid as the worker it
+        replaced.
+
+        :return: number of jobs requeued
+        """
+        hostname = socket.gethostname()
+        requeued = 0
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT id, attempts, claimed_by FROM job WHERE status = ?", (JOB_RUNNING,)
+            ).fetchall()
+            for row in rows:
+                host, _, pid = (row["claimed_by"] or "").rpartition(":")
+                if host != hostname or not pid.isdigit():
+                    continue
+                if int(pid) != os.getpid() and _process_exists(int(pid)):
+                    continue
+
+                # A job that keeps taking its worker down (i.e. OOM) runs out of attempts like any failing job
+                status = JOB_QUEUED if row["attempts"] < self.max_attempts else JOB_FAILED
+                connection.execute(
+                    "UPDATE job SET status = ?, error = ? WHERE id = ?",
+                    (status, f"Worker {row['claimed_by']} exited before finishing the job", row["id"]),
+                )
+                requeued += 1
+
+        if requeued > 0:
+            logger.warning(f"Released {requeued} job(s) abandoned by exited workers")
+        return requeued
+
+    def list_jobs(self, status: Optional[str] = None) -> List[dict]:
+        with self._connect() as connection:
+            if status is None:
+                rows = connection.execute("SELECT * FROM job ORDER BY id").fetchall()
+            else:
+                rows = connection.execute("SELECT * FROM job WHERE status = ? ORDER BY id", (status,)).fetchall()
+
+        return [self._to_job(row) for row in rows]
+
+
+def _process_exists(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
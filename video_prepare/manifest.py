@@ -0,0 +1,151 @@
+from datetime import datetime
+import hashlib
+import json
+import os
+from typing import Optional
+
+import pytz
+
+from .log import logger
+from .util import DateTimeEncoder
+
+
+STAGES = ["download", "normalize", "concat", "hls", "preview"]
+
+
+def fingerprint(inputs) -> str:
+    """
+    Stable hash of a JSON serializable description of a pipeline's inputs
+    """
+    serialized = json.dumps(inputs, sort_keys=True, cls=DateTimeEncoder)
+    return hashlib.sha256(serialized.encode("utf-8")).hexdigest()
+
+
+class StageManifest:
+    """
+    Per-camera record of the prepare pipeline's progress. The manifest stores the fingerprint of the inputs the
+    pipeline was run with and when each stage was started and completed, so an interrupted run can resume at the first
+    incomplete stage and a camera whose inputs haven't changed can be skipped entirely.
+
+    It also records where the camera's HLS feed ends. Unlike the stages, the feed end is kept when the manifest is
+    reset for new inputs, it's how far appends have got whatever inputs they were run with.
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+
+        self.fingerprint = None
+        self.inputs = {}
+        self.stages = {}
+        self.feed_end = None
+
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as fp:
+                    manifest = json.load(fp)
+
+                self.fingerprint = manifest.get("fingerprint")
+                self.inputs = manifest.get("inputs", {})
+                self.stages = manifest.get("stages", {})
+                if manifest.get("feed_end") is not None:
+                    self.feed_end = datetime.fromisoformat(manifest["feed_end"])
+            except (IOError, ValueError) as e:
+                logger.warning(f"Unable to load stage manifest '{manifest_path}', pipeline will start over: {e}")
+
+    def reset(self, input_fingerprint, inputs):
+        self.fingerprint = input_fingerprint
+        self.inputs = inputs
+        self.stages = {}
+        self.save()
+
+    def is_started(self, stage) -> bool:
+        return stage in self.stages
+
+    def is_complete(self, stage=None) -> bool:
+        """
+        Check whether the given stage (or every stage if no stage is given) has completed
+        """
+        if stage is None:
+            return self.fingerprint is not None and all(self.is_complete(s) for s in STAGES)
+
+        return self.stages.get(stage, {}).get("completed_at") is not None
+
+    def first_incomplete_stage(self) -> Optional[str]:
+        return next((stage for stage in STAGES if not self.is_complete(stage)), None)
+
+    def details(self, stage) -> dict:
+        return self.stages.get(stage, {}).get("details", {})
+
+    def start(self, stage):
+        self.stages[stage] = {"started_at": datetime.now(tz=pytz.UTC), "completed_at": None, "details": {}}
+        self.save()
+
+    def complete(self, stage, details=None):
+        if stage not in self.stages:
+            self.stages[stage] = {"started_at": None}
+
+        self.stages[stage]["completed_at"] = datetime.now(tz=pytz.UTC)
+        self.stages[stage]["details"] = details if details is not None else {}
+        self.save()
+
+    def complete_feed(self, feed_end):
+        """
+        Record that the camera's HLS feed now ends at feed_end
+        """
+        self.feed_end = feed_end
+        self.save()
+
+    def save(self):
+        manifest = {"fingerprint": self.fingerprint, "inputs": self.inputs, "stages": self.stages}
+        if self.feed_end is not None:
+            manifest["feed_end"] = self.feed_end
+
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp, cls=DateTimeEncoder)
+        os.replace(tmp_path, self.manifest_path)
+
+
+class JobManifest:
+    """
+    Playset-level record of a prepare run. It's started before the playset is created and completed once every camera
+    has been prepared, a playset whose job manifest was started but never completed belongs to an interrupted run
+    (even one killed before any camera wrote its stage manifest).
+    """
+
+    def __init__(self, manifest_path):
+        self.manifest_path = manifest_path
+
+        self.started_at = None
+        self.completed_at = None
+
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r", encoding="utf-8") as fp:
+                    manifest = json.load(fp)
+
+                self.started_at = manifest.get("started_at")
+                self.completed_at = manifest.get("completed_at")
+            except (IOError, ValueError) as e:
+                logger.warning(f"Unable to load job manifest '{manifest_path}', treating the run as interrupted: {e}")
+                self.started_at = "unknown"
+
+    def is_interrupted(self) -> bool:
+        return self.started_at is not None and self.completed_at is None
+
+    def start(self):
+        self.started_at = datetime.now(tz=pytz.UTC)
+        self.completed_at = None
+        self.save()
+
+    def complete(self):
+        self.completed_at = datetime.now(tz=pytz.UTC)
+        self.save()
+
+    def save(self):
+        manifest = {"started_at": self.started_at, "completed_at": self.completed_at}
+
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(manifest, fp, cls=DateTimeEncoder)
+        os.replace(tmp_path, self.manifest_path)
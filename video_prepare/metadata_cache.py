@@ -0,0 +1,170 @@
+from datetime import datetime, timedelta
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional
+
+import pytz
+
+from . import util
+from .log import logger
+
+
+# Length of the time buckets video metadata is cached in
+BUCKET_SECONDS = 3600
+# Clips are uploaded (and their metadata written) after they're captured, a bucket is only considered complete once
+# this long has passed since it ended
+SETTLE_SECONDS = int(os.getenv("VIDEO_METADATA_CACHE_SETTLE_SECONDS", 3600))
+
+
+class MetadataCache:
+    """
+    Local cache of video metadata, one JSON file per environment, camera and hour of video.
+
+    A bucket is only written once it has fully elapsed (and settled, late uploads still land in recent buckets), from
+    then on it's immutable and never fetched again. Buckets that aren't cached yet or are still open are fetched, runs
+    of consecutive buckets with a single query. Reruns, a list-videos followed by a prepare and playsets that overlap
+    only query the video service for the time they haven't seen yet.
+    """
+
+    def __init__(self, cache_directory, bucket_seconds=BUCKET_SECONDS, settle_seconds=SETTLE_SECONDS):
+        self.cache_directory = cache_directory
+        self.bucket_seconds = bucket_seconds
+        self.settle_seconds = settle_seconds
+
+    def _bucket_path(self, environment_id, device_id, bucket_start: datetime):
+        return os.path.join(
+            self.cache_directory,
+            str(environment_id),
+            str(device_id),
+            f"{bucket_start.strftime('%Y-%m-%dT%H%M%S')}_{self.bucket_seconds}.json",
+        )
+
+    def _buckets(self, start: datetime, end: datetime) -> List[datetime]:
+        first = int(start.timestamp()) // self.bucket_seconds * self.bucket_seconds
+        return [
+            datetime.fromtimestamp(bucket, tz=pytz.UTC)
+            for bucket in range(first, int(end.timestamp()), self.bucket_seconds)
+        ]
+
+    def _bucket_of(self, video) -> datetime:
+        timestamp = int(util.str_to_date(video["video_timestamp"]).timestamp())
+        return datetime.fromtimestamp(timestamp // self.bucket_seconds * self.bucket_seconds, tz=pytz.UTC)
+
+    def _is_settled(self, bucket_start: datetime, now: datetime) -> bool:
+        return bucket_start + timedelta(seconds=self.bucket_seconds + self.settle_seconds) <= now
+
+    def _load(self, path) -> Optional[List[dict]]:
+        try:
+            with open(path, "r", encoding="utf-8") as fp:
+                return json.load(fp, object_hook=_decode)["videos"]
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable video metadata cache file '{path}': {e}")
+            return None
+
+    def _store(self, path, videos):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Concurrent inventory chunks store the hours on their boundaries from the same process, every write gets its
+        # own temp file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fp:
+                json.dump({"fetched_at": datetime.now(tz=pytz.UTC), "videos": videos}, fp, default=_encode)
+            os.replace(tmp_path, path)
+        except TypeError as e:
+            logger.warning(f"Unable to cache video metadata in '{path}': {e}")
+        finally:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+
+    def fetch(
+        self,
+        environment_id,
+        device_ids: List[str],
+        start: datetime,
+        end: datetime,
+        fetch_fn: Callable[[datetime, datetime, List[str]], Dict[str, List[dict]]],
+    ) -> Dict[str, List[dict]]:
+        """
+        Video metadata of the cameras between start and end, from the cache where possible
+
+        :param fetch_fn: called with the start and end of each range that has to be fetched and the cameras missing any
+                         of it, returns each camera's video metadata in that range by device id
+        :return: dict of device id to the camera's video metadata
+        """
+        buckets = self._buckets(start, end)
+        videos_by_bucket = {device_id: {} for device_id in device_ids}
+        missing = set()
+        for device_id in device_ids:
+            for bucket in buckets:
+                videos = self._load(self._bucket_path(environment_id, device_id, bucket))
+                if videos is None:
+                    missing.add(bucket)
+                else:
+                    videos_by_bucket[device_id][bucket] = videos
+
+        if len(missing) > 0:
+            logger.info(
+                f"Video metadata for {len(device_ids)} camera(s): {len(buckets) - len(missing)} of {len(buckets)} hour(s) cached for every camera, fetching the rest"
+            )
+
+        # Every camera missing any hour of a run is fetched with the run, one query per run
+        for run in _consecutive_runs(sorted(missing), self.bucket_seconds):
+            run_end = run[-1] + timedelta(seconds=self.bucket_seconds)
+            run_device_ids = [
+                device_id
+                for device_id in device_ids
+                if any(bucket not in videos_by_bucket[device_id] for bucket in run)
+            ]
+            fetched = {device_id: {bucket: [] for bucket in run} for device_id in run_device_ids}
+            for device_id, videos in fetch_fn(run[0], run_end, run_device_ids).items():
+                for video in videos:
+                    bucket = self._bucket_of(video)
+                    if device_id in fetched and bucket in fetched[device_id]:
+                        fetched[device_id][bucket].append(video)
+
+            now = datetime.now(tz=pytz.UTC)
+            for device_id, device_buckets in fetched.items():
+                for bucket, videos in device_buckets.items():
+                    if bucket in videos_by_bucket[device_id]:
+                        continue
+                    videos_by_bucket[device_id][bucket] = videos
+                    if self._is_settled(bucket, now):
+                        self._store(self._bucket_path(environment_id, device_id, bucket), videos)
+
+        # Buckets are whole hours, the first and last can reach outside the requested range
+        return {
+            device_id: [
+                video
+                for bucket in buckets
+                for video in videos_by_bucket[device_id][bucket]
+                if start <= util.str_to_date(video["video_timestamp"]) < end
+            ]
+            for device_id in device_ids
+        }
+
+
+def _consecutive_runs(buckets, bucket_seconds):
+    runs = []
+    for bucket in buckets:
+        if len(runs) > 0 and bucket - runs[-1][-1] == timedelta(seconds=bucket_seconds):
+            runs[-1].append(bucket)
+        else:
+            runs.append([bucket])
+    return runs
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import resource
+import threading
+import time
+from typing import Optional
+
+import pytz
+
+from .log import logger
+
+
+# getrusage reports block I/O in 512 byte blocks
+RUSAGE_BLOCK_SIZE = 512
+
+STAGE_FIELDS = [
+    "wall_seconds",
+    "cpu_seconds",
+    "child_cpu_seconds",
+    "read_bytes",
+    "written_bytes",
+    "output_bytes",
+]
+
+
+def _rusage_totals():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        "cpu_seconds": own.ru_utime + own.ru_stime,
+        "child_cpu_seconds": children.ru_utime + children.ru_stime,
+        "read_bytes": (own.ru_inblock + children.ru_inblock) * RUSAGE_BLOCK_SIZE,
+        "written_bytes": (own.ru_oublock + children.ru_oublock) * RUSAGE_BLOCK_SIZE,
+    }
+
+
+def _directory_bytes(directory):
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    except FileNotFoundError:
+        return 0
+
+
+class CameraMetrics:
+    """
+    Timing and resource usage of one camera's prepare pipeline, by stage, plus counts of what happened to its clips.
+
+    Stage CPU and I/O come from getrusage, for this process and the ffmpeg processes it waited on. Each camera runs in
+    its own camera pool process, so they're the camera's own. read_bytes and written_bytes are block device I/O, reads
+    served from the page cache and I/O on network filesystems (i.e. EFS) aren't counted. output_bytes is how much the
+    camera's output directory grew during the stage.
+
+    Stages that run concurrently (the pipelined mode's download and normalize threads) are measured with measure_busy,
+    which only records the time the stage spent working.
+    """
+
+    def __init__(self, output_directory):
+        self.output_directory = output_directory
+        self.stages = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = {"runs": 0, "skipped": False}
+        return self.stages[stage]
+
+    @contextmanager
+    def measure(self, stage):
+        before = _rusage_totals()
+        output_bytes_before = _directory_bytes(self.output_directory)
+        wall_before = time.perf_counter()
+        try:
+            yield
+        finally:
+            wall_seconds = time.perf_counter() - wall_before
+            after = _rusage_totals()
+            measurements = {key: after[key] - before[key] for key in before}
+            measurements["wall_seconds"] = wall_seconds
+            measurements["output_bytes"] = _directory_bytes(self.output_directory) - output_bytes_before
+            self.record(stage, measurements)
+
+    @contextmanager
+    def measure_busy(self, stage):
+        wall_before = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, {"wall_seconds": time.perf_counter() - wall_before})
+
+    def record(self, stage, measurements):
+        with self._lock:
+            metrics = self._stage(stage)
+            metrics["runs"] += 1
+            for key, value in measurements.items():
+                metrics[key] = metrics.get(key, 0) + value
+
+    def skip(self, stage):
+        with self._lock:
+            self._stage(stage)["skipped"] = True
+
+    def count(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "stages": {stage: dict(metrics) for stage, metrics in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+
+class JobMetrics:
+    """
+    Metrics of a whole prepare job: every camera's CameraMetrics summary plus the job's own wall time. Written at the
+    end of the job as a JSON summary and/or a Prometheus text file (node_exporter textfile collector format, which can
+    also be pushed to a Pushgateway as is).
+    """
+
+    def __init__(self, environment_name, video_name):
+        self.environment_name = environment_name
+        self.video_name = video_name
+        self.started_at = datetime.now(tz=pytz.UTC)
+        self._wall_before = time.perf_counter()
+        self.wall_seconds = None
+        self.cameras = {}
+
+    def add_camera(self, assigned_name, device_id, status, camera_summary: Optional[dict] = None):
+        """
+        :param status: "generated", "skipped" or "failed"
+        """
+        self.cameras[assigned_name] = {"device_id": str(device_id), "status": status, **(camera_summary or {})}
+
+    def finish(self):
+        self.wall_seconds = time.perf_counter() - self._wall_before
+
+    def summary(self) -> dict:
+        statuses = {}
+        for camera in self.cameras.values():
+            statuses[camera["status"]] = statuses.get(camera["status"], 0) + 1
+
+        return {
+            "environment_name": self.environment_name,
+            "video_name": self.video_name,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": self.wall_seconds,
+            "camera_statuses": statuses,
+            "cameras": self.cameras,
+        }
+
+    def write_json(self, path):
+        _write_atomically(path, json.dumps(self.summary(), indent=2))
+        logger.info(f"Wrote job metrics to '{path}'")
+
+    def write_prometheus_textfile(self, path):
+        _write_atomically(path, self.prometheus_text())
+        logger.info(f"Wrote Prometheus metrics to '{path}'")
+
+    def prometheus_text(self) -> str:
+        job_labels = {"environment": self.environment_name, "playset": self.video_name}
+        samples = {}
+
+        def _sample(name, help_text, labels, value):
+            if value is None:
+                return
+            samples.setdefault(name, (help_text, []))[1].append(({**job_labels, **labels}, value))
+
+        _sample("video_prepare_job_wall_seconds", "Wall time of the prepare job", {}, self.wall_seconds)
+        _sample(
+            "video_prepare_job_last_run_timestamp_seconds",
+            "Unix time the prepare job started",
+            {},
+            self.started_at.timestamp(),
+        )
+        for status, cameras in self.summary()["camera_statuses"].items():
+            _sample("video_prepare_job_cameras", "Cameras by outcome", {"status": status}, cameras)
+
+        for camera_name, camera in self.cameras.items():
+            camera_labels = {"camera": camera_name}
+            for stage, metrics in camera.get("stages", {}).items():
+                stage_labels = {**camera_labels, "stage": stage}
+                for field in STAGE_FIELDS:
+                    _sample(
+                        f"video_prepare_stage_{field}",
+                        f"Stage {field.replace('_', ' ')}",
+                        stage_labels,
+                        metrics.get(field),
+                    )
+            for counter, value in camera.get("counters", {}).items():
+                _sample(f"video_prepare_camera_{counter}", f"Camera {counter.replace('_', ' ')}", camera_labels, value)
+
+        lines = []
+        for name, (help_text, values) in samples.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in values:
+                label_text = ",".join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _write_atomically(path, text):
+    """
+    Collectors read the file at any time, so it's replaced in one step rather than written in place
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        fp.write(text)
+    os.replace(tmp_path, path)
@@ -1,4 +1,5 @@
 import os
+import time
 import requests
 from requests.adapters import HTTPAdapter
 from requests.exceptions import HTTPError
@@ -25,6 +26,7 @@ class StreamServiceClient:
         auth_audience: str = os.getenv(
             "VIDEO_STREAM_SERVICE_AUDIENCE", os.getenv("API_AUDIENCE", "wildflower-tech.org")
         ),
+        token_refresh_seconds: int = int(os.getenv("VIDEO_STREAM_SERVICE_TOKEN_REFRESH_SECONDS", 12 * 60 * 60)),
     ):
         self.url = url
 
@@ -32,6 +34,8 @@ class StreamServiceClient:
         self.client_id = auth_client_id
         self.client_secret = auth_client_secret
         self.audience = auth_audience
+        # Long lived clients (i.e. the prepare worker) fetch a new token before the current one expires
+        self.token_refresh_seconds = token_refresh_seconds
 
         if self.url is None:
             raise ValueError("StreamServiceClient 'url' is not optional, set with VIDEO_STREAM_SERVICE_URI")
@@ -49,6 +53,7 @@ class StreamServiceClient:
         self.session = self._request_session()
 
         self.access_token = None
+        self.access_token_fetched_at = None
         self.auth0_token_generator = GetToken(self.domain, timeout=10)
 
         self._reset_token()
@@ -74,8 +79,12 @@ class StreamServiceClient:
         )
 
         self.access_token = token["access_token"]
+        self.access_token_fetched_at = time.monotonic()
 
     def _request(self, method="GET", path="/", params={}, body=None):
+        if time.monotonic() - self.access_token_fetched_at > self.token_refresh_seconds:
+            self._reset_token()
+
         headers = {"Authorization": f"Bearer {self.access_token}"}
 
         try:
@@ -101,6 +110,9 @@ class StreamServiceClient:
     def _post(self, path="/", params={}, body=None):
         return self._request(path=path, method="POST", params=params, body=body)
 
+    def _patch(self, path="/", params={}, body=None):
+        return self._request(path=path, method="PATCH", params=params, body=body)
+
     def _delete(self, path="/", params={}, body=None):
         return self._request(path=path, method="DELETE", params=params, body=body)
 
@@ -132,6 +144,13 @@ class StreamServiceClient:
 
         return models.PlaysetResponse(**response)
 
+    def update_playset(self, playset_id: uuid.UUID, playset: models.PlaysetUpdate) -> models.PlaysetResponse:
+        response = self._patch(path=f"/videos/playsets/{playset_id}", body=playset.json(exclude_none=True))
+        if response is None:
+            raise ValueError("Failed updating playset, server responded with None")
+
+        return models.PlaysetResponse(**response)
+
     def delete_playset(self, playset_id: uuid.UUID):
         return self._delete(
             path=f"/videos/playsets/{playset_id}",
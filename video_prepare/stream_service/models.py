@@ -12,6 +12,7 @@ class Video(BaseModel):
     url: Optional[str]
     preview_url: Optional[str]
     preview_thumbnail_url: Optional[str]
+    thumbnails_url: Optional[str]
 
 
 class VideoResponse(BaseModel):
@@ -22,6 +23,7 @@ class VideoResponse(BaseModel):
     url: str
     preview_url: str
     preview_thumbnail_url: str
+    thumbnails_url: Optional[str]
 
 
 class Playset(BaseModel):
@@ -31,6 +33,12 @@ class Playset(BaseModel):
     end_time: datetime.datetime
 
 
+class PlaysetUpdate(BaseModel):
+    name: Optional[str]
+    start_time: Optional[datetime.datetime]
+    end_time: Optional[datetime.datetime]
+
+
 class PlaysetResponse(BaseModel):
     id: UUID
     classroom_id: UUID
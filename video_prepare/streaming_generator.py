@@ -1,31 +1,52 @@
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
-import copy
 from datetime import timedelta
 import os
-from multiprocessing import cpu_count
+import queue
 import shutil
 import tempfile
-from typing import Optional
+import threading
+from typing import List, Optional
 
-import pandas as pd
-import pytz
-import video_io
+import numpy as np
 
-from . import util
+from . import const, thumbnails, util
+from .governor import governor
 from .log import logger
+from .hls_playlist import insert_gap_segments, mark_discontinuity, media_playlist_paths, playlist_length
+from .manifest import StageManifest, fingerprint
+from .metrics import CameraMetrics
 from .transcode import (
+    VALIDATION_STRUCTURE,
+    ProbeCache,
     concat_videos,
+    conform_video,
     count_frames,
     generate_preview_image,
-    pad_video,
+    is_stream_copy_compatible,
     prepare_hls,
-    trim_video,
+    validate_video,
+    video_stream_format,
 )
 
 
+# Length of each clip's slot on the timeline
+SLOT_SECONDS = 10
+# Frames in a slot at the cameras' 10 fps
+SLOT_FRAMES = SLOT_SECONDS * 10
+
+# Runs of missing clips at least this many slots long are played from the shared blank segment instead of being encoded
+MIN_COLLAPSED_GAP_SLOTS = 3
+
+# Pipelined mode moves clips between the download, normalize and encode stages in sections of this many clips, with at
+# most PIPELINE_QUEUE_DEPTH sections waiting between two stages
+PIPELINE_SECTION_CLIPS = 60
+PIPELINE_QUEUE_DEPTH = 2
+
+
 class StreamingGenerator:
     """
-    The StreamingGenerator is responsible for parsing video_metadata, fetching videos from the video_io service, preparing those videos (trimming/padding), and converting the videos into streamable video.
+    The StreamingGenerator is responsible for parsing video_metadata, fetching videos from the video_io service, lining those videos up on a 10 second per clip timeline (trimming/padding), and converting the videos into streamable video.
     """
 
     def __init__(
@@ -36,6 +57,19 @@ class StreamingGenerator:
         output_directory="",
         empty_clip_path="",
         raw_video_storage_directory=None,
+        ffmpeg_threads=None,
+        single_pass=False,
+        stream_copy=False,
+        append=False,
+        collapse_gaps=False,
+        blank_segment_path=None,
+        pipelined=False,
+        remove_encoded_clips=False,
+        read_raw_in_place=False,
+        clip_cache=None,
+        renditions=None,
+        hls_segment_type="mpegts",
+        thumbnail_interval=None,
     ):
         if video_metadata is None:
             video_metadata = []
@@ -62,12 +96,82 @@ class StreamingGenerator:
         self.preview_image_path = os.path.join(output_directory, "output-preview.jpg")
         self.m3u8_files_path = os.path.join(output_directory, "m3u8_files.txt")
         self.video_out_path = os.path.join(output_directory, "output.mp4")
+        self.probe_cache_path = os.path.join(output_directory, "probe_cache.json")
+        self.manifest_path = const.manifest_path(output_directory)
 
         self.empty_clip_path = empty_clip_path
 
         # On production, this is the EFS mount where raw videos are stored and copied from
         self.raw_video_storage_directory = raw_video_storage_directory
 
+        # When enabled, clips found in raw_video_storage_directory are read where they are instead of being copied into
+        # the output directory. Only clips that have to be rewritten (conformed for stream copy) get a local copy.
+        self.read_raw_in_place = read_raw_in_place and raw_video_storage_directory is not None
+
+        # ABR ladder encoded alongside the source resolution, list of {"height": int, "bitrate": str} dicts. Stream
+        # copied feeds are never decoded, so they only have the source resolution.
+        self.renditions = [] if renditions is None or stream_copy else renditions
+
+        # "mpegts" for a .ts file per segment, "fmp4" for a single fragmented MP4 per variant addressed by byte range
+        self.hls_segment_type = hls_segment_type
+
+        # Seconds between trick play thumbnails, None disables thumbnail sprite sheets and the WebVTT thumbnail track
+        self.thumbnail_interval = thumbnail_interval
+
+        # Node wide ClipCache downloads go through, so clips shared with other playsets are only downloaded once
+        self.clip_cache = clip_cache
+
+        # Number of threads each ffmpeg encode may use, None uses the resource governor's encode threads
+        self.ffmpeg_threads = ffmpeg_threads
+
+        # When enabled, the HLS feed and preview image are generated directly from the concat list in a single ffmpeg
+        # pass and the full length output.mp4 is never written
+        self.single_pass = single_pass
+        self.total_frames = 0
+        self.total_bytes = 0
+
+        # When enabled, clips are packaged into HLS without re-encoding, only clips that don't conform to the
+        # camera's format are re-encoded
+        self.stream_copy = stream_copy
+        # Runs of consecutive clips that are stream copied or re-encoded together, in timeline order, as
+        # {"stream_copy": bool, "concat_list": path, "clips": int, "bytes": int} dicts. The concat demuxer only passes
+        # on the first clip's H.264 parameter sets (SPS/PPS), so x264 encoded clips (conformed clips or the empty clip)
+        # can't be stream copied in the same concat list as the camera's clips.
+        self.stream_copy_runs = []
+
+        # When enabled, the generated video is appended to the camera's existing HLS feed
+        self.append = append
+
+        # When enabled, long runs of missing clips aren't encoded, the HLS playlists reference a pre-encoded blank
+        # segment for them instead
+        self.collapse_gaps = collapse_gaps and blank_segment_path is not None
+        self.blank_segment_path = blank_segment_path
+
+        # When enabled, clips are downloaded, normalized and encoded section by section with the stages running
+        # concurrently, each section's HLS segments are appended to the feed as soon as the section is encoded
+        self.pipelined = pipelined
+
+        # When enabled (pipelined mode only), downloaded clips are deleted as soon as their section has been encoded
+        self.remove_encoded_clips = remove_encoded_clips
+
+        # Resolution clips are conformed to for stream copy, chosen from the first clips conformed
+        self.stream_copy_resolution = None
+
+        # (num_frames, path) for every entry written to the concat list
+        self.concat_entries = []
+
+        # [kind, slot count] runs of encoded video and collapsed gaps, in timeline order
+        self.timeline = []
+
+        # ffprobe results shared by every probe of this camera's clips, persisted so re-runs don't probe again
+        self.probe_cache = ProbeCache(self.probe_cache_path)
+
+        # Records progress through the pipeline's stages so an interrupted run can be resumed
+        self.manifest = StageManifest(self.manifest_path)
+
+        # Per stage timing and resource usage, and counts of what happened to the clips
+        self.metrics = CameraMetrics(output_directory)
+
     def _reset_lists(self):
         self.captured_video_list = []
         self.missing_video_list = []
@@ -96,52 +200,52 @@ class StreamingGenerator:
         """
         Parse the video_metadata list. Track any missing videos not known to the video API service and track all video
         files that should be downloaded (or copied from the local EFS volume if available)
+
+        Clips are placed on a timeline of 10 second slots, slot = (video_timestamp - start) // 10 seconds. If more than
+        one clip lands in the same slot, the first one in video_metadata wins.
         """
-        datetimeindex = pd.date_range(
-            self.start_datetime, self.end_datetime - timedelta(seconds=10), freq="10S", tz=pytz.UTC
+        start_epoch = int(self.start_datetime.timestamp())
+        slot_count = max(0, (int(self.end_datetime.timestamp()) - start_epoch) // SLOT_SECONDS)
+
+        # Only clips that can be fetched are placed on the timeline
+        metadata = [m for m in self.video_metadata if m.get("data_id") is not None and m.get("path") is not None]
+        timestamps = np.fromiter(
+            (util.str_to_epoch_seconds(m["video_timestamp"]) for m in metadata), dtype=np.int64, count=len(metadata)
         )
 
-        # Convert datapoints to a dataframe to use pd timeseries functionality
-        df_datapoints = pd.DataFrame(self.video_metadata)
-        if len(self.video_metadata) > 0:
-            # Move timestamp column to datetime index
-            df_datapoints["video_timestamp"] = pd.to_datetime(df_datapoints["video_timestamp"], utc=True)
-            df_datapoints = df_datapoints.set_index(pd.DatetimeIndex(df_datapoints["video_timestamp"]))
-            df_datapoints = df_datapoints.drop(columns=["video_timestamp"])
-            # Scrub duplicates (these shouldn't exist)
-            df_datapoints = df_datapoints[~df_datapoints.index.duplicated(keep="first")]
-
-        # Fill in missing time indices
-        df_datapoints = df_datapoints.reindex(datetimeindex)
-        # TODO: Consider handling empty df_datapoints and lining it up with timestamps that cover a given start and end time
-        for idx_datetime, row in df_datapoints.iterrows():
-            start_formatted_time = util.clean_pd_ts(idx_datetime)
-            end_formatted_time = util.clean_pd_ts(idx_datetime + timedelta(seconds=10))
-            # output = os.path.join(target, f"{start_formatted_time}.video.mp4")
-
-            if "data_id" not in row or pd.isnull(row["data_id"]) or "path" not in row or pd.isnull(row["path"]):
-                self.add_to_missing(start=start_formatted_time, end=end_formatted_time)
+        slots = (timestamps - start_epoch) // SLOT_SECONDS
+        in_range = np.flatnonzero((slots >= 0) & (slots < slot_count))
+
+        # np.unique returns the index of the first occurrence of each slot, scrubbing duplicates (these shouldn't exist)
+        captured_slots, first_occurrence = np.unique(slots[in_range], return_index=True)
+        slot_index = np.full(slot_count, -1, dtype=np.int64)
+        slot_index[captured_slots] = in_range[first_occurrence]
+
+        for slot, metadata_index in enumerate(slot_index.tolist()):
+            start = self.start_datetime + timedelta(seconds=slot * SLOT_SECONDS)
+            end = start + timedelta(seconds=SLOT_SECONDS)
+
+            if metadata_index < 0:
+                self.add_to_missing(start=start, end=end, slot=slot)
             else:
-                self.add_to_download(video_metadatum=row.to_dict(), start=start_formatted_time, end=end_formatted_time)
+                self.add_to_download(video_metadatum=dict(metadata[metadata_index]), start=start, end=end, slot=slot)
 
-    def get_files(self) -> Optional[pd.DataFrame]:
+    def get_files(self) -> Optional[List[dict]]:
+        """
+        All captured and missing clips ordered by their timeline slot. Entries are copies, safe to modify.
+        """
         if not self.loaded:
             logger.warning(
                 "Calling StreamingGenerator::get_files before load() method has been called. May misleadingly make it appear there are no videos to process."
             )
 
-        files = copy.copy(self.captured_video_list)
-
-        for missing_file in self.missing_video_list:
-            files.append(missing_file)
+        files = [dict(f) for f in self.captured_video_list] + [dict(f) for f in self.missing_video_list]
 
         if len(files) == 0:
             return None
 
-        df_files = pd.DataFrame(files)
-        df_files.index = pd.to_datetime(df_files["start"])
-        df_files = df_files.sort_index()
-        return df_files
+        files.sort(key=lambda f: f["slot"])
+        return files
 
     def file_count(self):
         if not self.loaded:
@@ -149,31 +253,38 @@ class StreamingGenerator:
                 "Calling StreamingGenerator::file_count before load() method has been called. May misleadingly make it appear there are no videos to process."
             )
 
-        files = self.get_files()
-        if files is None or len(files) == 0:
-            return 0
+        return len(self.captured_video_list) + len(self.missing_video_list)
 
-        return len(files)
+    def add_to_download(self, video_metadatum, start, end, slot):
+        video_metadatum["start"] = start
+        video_metadatum["end"] = end
+        video_metadatum["slot"] = slot
+        video_metadatum["missing"] = False
 
-    def add_to_download(self, video_metadatum, start, end):
-        video_metadatum["start"] = util.str_to_date(start)
-        video_metadatum["end"] = util.str_to_date(end)
+        video_metadatum["video_streamer_path"] = self._local_clip_path(video_metadatum)
+        if self.read_raw_in_place:
+            raw_video_path = os.path.join(self.raw_video_storage_directory, video_metadatum["path"])
+            if os.path.exists(raw_video_path):
+                video_metadatum["video_streamer_path"] = raw_video_path
+
+        self.captured_video_list.append(video_metadatum)
 
+    def _local_clip_path(self, video_metadatum):
+        """
+        Path a captured clip is downloaded (or copied) to
+        """
         file_extension = os.path.splitext(video_metadatum["path"])[1]
         video_timestamp = video_metadatum["start"].strftime("%Y-%m-%dT%H:%M:%SZ")
-        new_path = os.path.join(
-            self.output_directory, f"{video_timestamp}_{video_metadatum['data_id']}{file_extension}"
-        )
-        video_metadatum["video_streamer_path"] = new_path
-
-        self.captured_video_list.append(video_metadatum)
+        return os.path.join(self.output_directory, f"{video_timestamp}_{video_metadatum['data_id']}{file_extension}")
 
-    def add_to_missing(self, start, end):
+    def add_to_missing(self, start, end, slot):
         self.missing_video_list.append(
             {
                 "video_streamer_path": self.empty_clip_path,
-                "start": util.str_to_date(start),
-                "end": util.str_to_date(end),
+                "start": start,
+                "end": end,
+                "slot": slot,
+                "missing": True,
             }
         )
 
@@ -184,16 +295,28 @@ class StreamingGenerator:
 
         return last_available_video_end_time
 
-    def download_or_copy_files(self, workers=cpu_count() - 1):
+    def download_or_copy_files(self, workers=None, videos=None):
+        """
+        Download (or copy) the given captured clips, all captured clips if none are given
+
+        :param workers: Concurrent downloads/copies, by default the resource governor's I/O workers
+        """
+        if workers is None:
+            workers = governor.io_workers()
+
         logger.info("Downloading/copying raw video files")
 
+        if videos is None:
+            videos = self.captured_video_list
+
         video_not_on_disk = []
         video_needing_download = []
 
         # 1. First filter out any videos already available on disk
-        for v in self.captured_video_list:
+        for v in videos:
             if not os.path.exists(v["video_streamer_path"]):
                 video_not_on_disk.append(v)
+        self.metrics.count("clips_on_disk", len(videos) - len(video_not_on_disk))
 
         def _copy_from_raw_video_storage(video):
             copy_success = False
@@ -214,18 +337,27 @@ class StreamingGenerator:
             return video, copy_success
 
         # 2. Try to copy videos from the raw_video_directory (if that's available)
-        with ThreadPoolExecutor(max_workers=20) as executor:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
             results = executor.map(_copy_from_raw_video_storage, video_not_on_disk)
             executor.shutdown(wait=True)
 
         for (v, success) in results:
             if not success:
                 video_needing_download.append(v)
+            else:
+                self.metrics.count("clips_copied")
+                self.metrics.count("bytes_copied", os.path.getsize(v["video_streamer_path"]))
 
         # 3. After attempting to copy the video files, fall back to downloading the files
+        if self.clip_cache is not None:
+            return self._fetch_from_clip_cache(video_needing_download, workers=workers)
+
+        # video_io (and its API clients) is only imported once a clip has to be downloaded
+        import video_io
+
         #    Files are first downloaded to a tmp directory before they are moved to permanent storage (files are renamed when they are moved)
         with tempfile.TemporaryDirectory() as tmp_dir:
-            videos = video_io.download_video_files(
+            downloaded_videos = video_io.download_video_files(
                 video_metadata=video_needing_download, local_video_directory=tmp_dir, max_workers=workers
             )
 
@@ -237,74 +369,882 @@ class StreamingGenerator:
                     logger.error(err)
                     raise ex
 
+        self._count_downloads(video_needing_download)
+
         # Return a list of all files that were downloaded
-        return videos
+        return downloaded_videos
+
+    def _count_downloads(self, videos):
+        self.metrics.count("clips_downloaded", len(videos))
+        self.metrics.count(
+            "bytes_downloaded",
+            sum(os.path.getsize(v["video_streamer_path"]) for v in videos if os.path.exists(v["video_streamer_path"])),
+        )
+
+    def _fetch_from_clip_cache(self, videos, workers):
+        def _download(videos_to_download, directory):
+            import video_io
+
+            return video_io.download_video_files(
+                video_metadata=videos_to_download, local_video_directory=directory, max_workers=workers
+            )
+
+        downloaded_videos = self.clip_cache.fetch(videos, _download)
+        self._count_downloads(downloaded_videos)
+        self.metrics.count("clips_cached", len(videos) - len(downloaded_videos))
+
+        for video in videos:
+            if not os.path.exists(video["video_streamer_path"]):
+                err = f"Failed fetching video '{video['path']}' to final storage path '{video['video_streamer_path']}'"
+                logger.error(err)
+                raise FileNotFoundError(err)
+
+        return downloaded_videos
 
     def process_raw_files(self):
+        """
+        Probe each clip's frame count and write the concat list. Clips aren't re-encoded to fix their length: clips
+        longer than 10 seconds are cut with an outpoint directive and every clip is given a 10 second duration so a
+        short clip's last frame is held by the encoder until the next clip starts.
+        """
         logger.info("Processing raw video files, verifying FPS and file length")
 
-        def _process(file_tuple):
-            idx, file = file_tuple
+        results = self._probe_files(self.get_files())
+        if self.stream_copy:
+            results = self._conform_for_stream_copy(results)
+
+        results, self.timeline = self._collapse_gaps(results)
+
+        self.concat_entries = []
+        if self.stream_copy:
+            self.total_frames, self.total_bytes = self._write_stream_copy_runs(results)
+        else:
+            self.total_frames, self.total_bytes = self._write_concat_list(self.m3u8_files_path, results)
+
+        self.probe_cache.save()
+
+        return self.normalized_details()
+
+    def normalized_details(self):
+        return {
+            "concat_entries": self.concat_entries,
+            "total_frames": self.total_frames,
+            "total_bytes": self.total_bytes,
+            "timeline": self.timeline,
+            "stream_copy_runs": self.stream_copy_runs,
+        }
+
+    def _probe_files(self, files):
+        """
+        Count each clip's frames, clips that are truncated, can't be probed or have no frames are replaced with the
+        empty clip
+
+        :return: list of (num_frames, file) tuples in the order of files
+        """
+
+        def _process(file):
             video_snippet_path = file["video_streamer_path"]
 
             # Process new video files
             logger.info(f"Preparing '{video_snippet_path}' for HLS generation...")
             try:
-                num_frames = count_frames(video_snippet_path)
+                # Catches truncated downloads without spawning ffprobe
+                if not validate_video(video_snippet_path, level=VALIDATION_STRUCTURE):
+                    raise ValueError(f"'{video_snippet_path}' failed structure validation")
+                num_frames = count_frames(video_snippet_path, probe_cache=self.probe_cache)
             except Exception:
                 logger.warning(f"Unable to probe '{video_snippet_path}', replacing with empty video clip")
+                self.metrics.count("empty_clip_fallbacks")
                 file["video_streamer_path"] = self.empty_clip_path
+                file["missing"] = True
                 video_snippet_path = self.empty_clip_path
-                num_frames = count_frames(video_snippet_path)
-
-            success = True
-            if num_frames < 100:
-                success = pad_video(video_snippet_path, video_snippet_path, frames=(100 - num_frames))
-            if num_frames > 100:
-                success = trim_video(video_snippet_path, video_snippet_path, duration=10)
+                num_frames = count_frames(video_snippet_path, probe_cache=self.probe_cache)
 
-            if not success:
-                logger.warning(f"Unable to pad/trim '{video_snippet_path}', replacing with empty video clip")
+            if num_frames == 0:
+                logger.warning(f"'{video_snippet_path}' has no frames, replacing with empty video clip")
+                self.metrics.count("empty_clip_fallbacks")
                 file["video_streamer_path"] = self.empty_clip_path
-                video_snippet_path = self.empty_clip_path
-
-            num_frames = count_frames(video_snippet_path)
+                file["missing"] = True
+                num_frames = count_frames(self.empty_clip_path, probe_cache=self.probe_cache)
 
             return num_frames, file
 
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            results = executor.map(_process, self.get_files().iterrows())
+        with ThreadPoolExecutor(max_workers=governor.probe_workers()) as executor:
+            results = list(executor.map(_process, files))
             executor.shutdown(wait=True)
 
-        with open(self.m3u8_files_path, "w", encoding="utf-8") as fp:
+        return results
+
+    def _write_concat_list(self, concat_list_path, results):
+        """
+        Write a concat list of the probed clips, adding each clip to concat_entries
+
+        :return: tuple of the number of frames (SLOT_FRAMES per clip) and bytes in the concat list
+        """
+        with open(concat_list_path, "w", encoding="utf-8") as fp:
             count = 0
+            total_bytes = 0
             for num_frames, file in results:
                 video_snippet_path = file["video_streamer_path"]
+                total_bytes += os.path.getsize(video_snippet_path)
+
+                # Every clip fills exactly its slot: frames beyond the 10 second slot are dropped by the outpoint and
+                # missing frames are filled by the encoder (a short clip's last frame is held)
+                self.concat_entries.append((SLOT_FRAMES, video_snippet_path))
 
-                fp.write(
-                    f"file 'file:{video_snippet_path}' duration 00:00:{util.format_frames(num_frames)} inpoint {util.vts(count)} outpoint {util.vts(count + num_frames)}\n"
-                )
+                fp.write(f"file 'file:{video_snippet_path}'\n")
+                if num_frames > SLOT_FRAMES:
+                    fp.write(f"outpoint {util.vts(SLOT_FRAMES)}\n")
+                fp.write(f"duration {util.vts(SLOT_FRAMES)}\n")
 
-                count += num_frames
+                count += SLOT_FRAMES
             fp.flush()
 
-    def generate_hls_feed(self, rewrite):
+        return count, total_bytes
+
+    def _collapse_gaps(self, results):
+        """
+        Split the slot ordered clips into runs of video and runs of missing clips. Runs of missing clips at least
+        MIN_COLLAPSED_GAP_SLOTS long are dropped from the clips to encode and recorded as gaps on the timeline, shorter
+        runs are encoded from the empty clip like any other clip.
+
+        :return: tuple of the clips to encode and the [kind, slot count] timeline
+        """
+        if not self.collapse_gaps or all(file.get("missing", False) for _, file in results):
+            return results, [["video", len(results)]]
+
+        runs = []
+        for entry in results:
+            missing = entry[1].get("missing", False)
+            if len(runs) > 0 and runs[-1][0] == missing:
+                runs[-1][1].append(entry)
+            else:
+                runs.append((missing, [entry]))
+
+        encoded = []
+        timeline = []
+        for missing, entries in runs:
+            kind = "gap" if missing and len(entries) >= MIN_COLLAPSED_GAP_SLOTS else "video"
+            for _, file in entries:
+                file["collapsed"] = kind == "gap"
+            if kind == "video":
+                encoded.extend(entries)
+
+            if len(timeline) > 0 and timeline[-1][0] == kind:
+                timeline[-1][1] += len(entries)
+            else:
+                timeline.append([kind, len(entries)])
+
+        collapsed = len(results) - len(encoded)
+        if collapsed > 0:
+            logger.info(f"Collapsed {collapsed} missing clips into blank segment references")
+        return encoded, timeline
+
+    def _conform_for_stream_copy(self, results):
+        """
+        Make every clip safe to stream copy into a single HLS feed. Clips that don't match the camera's most common
+        resolution (or aren't 10 fps H.264 starting on a keyframe) are re-encoded once into the output directory. Clips
+        that can't be re-encoded are replaced with the (conformed) empty clip.
+        """
+        paths = {file["video_streamer_path"] for _, file in results}
+        paths.add(self.empty_clip_path)
+
+        def _probe(path):
+            try:
+                return path, video_stream_format(path, probe_cache=self.probe_cache)
+            except Exception:
+                logger.warning(f"Unable to probe stream format of '{path}'")
+                return path, None
+
+        with ThreadPoolExecutor(max_workers=governor.probe_workers()) as executor:
+            formats = dict(executor.map(_probe, paths))
+            executor.shutdown(wait=True)
+
+        if self.stream_copy_resolution is None:
+            resolutions = Counter(
+                (video_format["width"], video_format["height"])
+                for path, video_format in formats.items()
+                if video_format is not None and path != self.empty_clip_path
+            )
+            if len(resolutions) == 0:
+                resolutions[(formats[self.empty_clip_path]["width"], formats[self.empty_clip_path]["height"])] += 1
+            (self.stream_copy_resolution, _) = resolutions.most_common(1)[0]
+        width, height = self.stream_copy_resolution
+
+        def _conform(path):
+            video_format = formats[path]
+            if video_format is not None and is_stream_copy_compatible(video_format, width=width, height=height):
+                return path, path
+
+            conformed_path = os.path.join(
+                self.output_directory, f"{os.path.splitext(os.path.basename(path))[0]}.conformed.mp4"
+            )
+            if os.path.exists(conformed_path) or conform_video(
+                path, conformed_path, width=width, height=height, threads=self.ffmpeg_threads
+            ):
+                return path, conformed_path
+
+            return path, None
+
+        with ThreadPoolExecutor(max_workers=governor.probe_workers()) as executor:
+            conformed_paths = dict(executor.map(_conform, paths))
+            executor.shutdown(wait=True)
+
+        conformed_empty_clip_path = conformed_paths[self.empty_clip_path]
+        if conformed_empty_clip_path is None:
+            raise ValueError(f"Unable to conform empty clip '{self.empty_clip_path}' for stream copy")
+
+        conformed_results = []
+        reencoded = 0
+        for num_frames, file in results:
+            source_path = file["video_streamer_path"]
+            conformed_path = conformed_paths[source_path]
+            if conformed_path is None:
+                logger.warning(f"Unable to conform '{source_path}', replacing with empty video clip")
+                conformed_path = conformed_empty_clip_path
+                file["missing"] = True
+
+            if conformed_path != source_path:
+                reencoded += 1
+                file["video_streamer_path"] = conformed_path
+                file["conformed"] = True
+                num_frames = count_frames(conformed_path, probe_cache=self.probe_cache)
+
+            conformed_results.append((num_frames, file))
+
+        logger.info(f"Stream copying {len(results) - reencoded} clips, re-encoded {reencoded} non-conforming clips")
+        return conformed_results
+
+    def _stream_copy_runs(self, results):
+        """
+        Split the clips into runs of consecutive clips that are stream copied or re-encoded together. Only the
+        camera's own clips share its H.264 parameter sets, clips that were conformed or replaced with the empty clip
+        are re-encoded. Single file (fmp4) feeds can't be appended to, so they're packaged in one run that's only
+        stream copied if every clip can be.
+
+        :return: list of (stream copied, clips) tuples in timeline order
+        """
+        runs = []
+        for entry in results:
+            copyable = not entry[1].get("missing", False) and not entry[1].get("conformed", False)
+            if len(runs) > 0 and runs[-1][0] == copyable:
+                runs[-1][1].append(entry)
+            else:
+                runs.append((copyable, [entry]))
+
+        if self.hls_segment_type == "fmp4" and len(runs) > 1:
+            runs = [(False, list(results))]
+
+        reencoded = sum(len(clips) for copyable, clips in runs if not copyable)
+        if reencoded > 0:
+            logger.info(
+                f"Re-encoding {reencoded} conformed or missing clips of '{self.output_directory}', stream copying the rest"
+            )
+            self.metrics.count("stream_copy_fallbacks", reencoded)
+        return runs
+
+    def _write_stream_copy_runs(self, results):
+        """
+        Write a concat list for each stream copy run, adding each clip to concat_entries
+
+        :return: tuple of the number of frames and bytes in all the runs' concat lists
+        """
+        self.stream_copy_runs = []
+        total_frames, total_bytes = 0, 0
+        for index, (copyable, clips) in enumerate(self._stream_copy_runs(results)):
+            concat_list_path = os.path.join(self.output_directory, f"m3u8_files_{index}.txt")
+            frames, run_bytes = self._write_concat_list(concat_list_path, clips)
+            self.stream_copy_runs.append(
+                {"stream_copy": copyable, "concat_list": concat_list_path, "clips": len(clips), "bytes": run_bytes}
+            )
+            total_frames += frames
+            total_bytes += run_bytes
+
+        return total_frames, total_bytes
+
+    def get_clip_at_frame(self, frame):
+        """
+        Find the clip in the concat list that contains the given frame index
+        """
+        count = 0
+        for num_frames, path in self.concat_entries:
+            if frame < count + num_frames:
+                return path
+            count += num_frames
+
+        return None
+
+    def estimated_bitrate(self, total_bytes=None, clip_count=None):
+        """
+        Estimate the bitrate of the concatenated video from the size and length of the clips in the concat list
+        """
+        if total_bytes is None:
+            total_bytes = self.total_bytes
+        if clip_count is None:
+            clip_count = len(self.concat_entries)
+
+        if clip_count == 0 or total_bytes == 0:
+            return None
+
+        return int(total_bytes * 8 / (clip_count * SLOT_SECONDS))
+
+    def concatenate_videos(self):
+        """
+        Concatenate the clips in the concat list into output.mp4. Skipped in single pass and stream copy mode, stream
+        copy runs are packaged straight from their concat lists.
+        """
+        if self.single_pass or self.stream_copy:
+            return {"skipped": True}
+
         logger.info(f"Generating video for subsequent conversion to HLS: {self.video_out_path}...")
         concat_videos(input_path=self.m3u8_files_path, output_path=self.video_out_path, rewrite=True)
         logger.info(f"Generated video: {self.video_out_path}")
+        return {}
+
+    def generate_hls(self, rewrite):
+        appending = self.append and os.path.exists(self.hls_path)
+        first_segment, feed_seconds = 0, 0.0
+        if appending:
+            # Never discard the feed being appended to
+            rewrite = False
+            self._snapshot_feed()
+            first_segment, feed_seconds = playlist_length(media_playlist_paths(self.output_directory)[0])
+        elif rewrite or not os.path.exists(self.hls_path):
+            self.remove_thumbnails()
+
+        thumbnail_options = self._thumbnail_options(appending=appending)
+        if self.stream_copy:
+            encoded = self.generate_hls_stream_copy_runs(rewrite=rewrite)
+        elif self.single_pass:
+            encoded = self.generate_hls_single_pass(rewrite=rewrite, thumbnail_options=thumbnail_options)
+        else:
+            logger.info(f"Generating HLS stream: {self.hls_path}...")
+            encoded = prepare_hls(
+                input_path=self.video_out_path,
+                output_path=self.hls_path,
+                rewrite=rewrite,
+                append=self.append,
+                threads=self.ffmpeg_threads,
+                renditions=self.renditions,
+                segment_type=self.hls_segment_type,
+                probe_cache=self.probe_cache,
+                **thumbnail_options,
+            )
+            logger.info(f"Generated HLS stream: {self.hls_path}")
+
+        if encoded and len(thumbnail_options) > 0:
+            self.write_thumbnail_track(self.timeline, thumbnail_options, start_seconds=feed_seconds)
+
+        if any(kind == "gap" for kind, _ in self.timeline):
+            self.insert_gaps(first_segment=first_segment)
+
+        if appending:
+            self._discard_feed_snapshot()
+
+    def generate_hls_stream_copy_runs(self, rewrite):
+        """
+        Package the stream copy runs one after the other, straight from their concat lists. Every run after the first
+        is appended to the feed, as is the first when appending to an existing feed. The first segment of every run
+        appended to the feed is marked as a discontinuity: the run before it was encoded differently (the encoding of
+        a feed being appended to isn't known).
+        """
+        if len(self.stream_copy_runs) == 0:
+            return False
+
+        previous_stream_copy = None
+        for index, run in enumerate(self.stream_copy_runs):
+            run_append = index > 0 or (self.append and os.path.exists(self.hls_path))
+            first_segment = 0
+            if run_append:
+                first_segment, _ = playlist_length(media_playlist_paths(self.output_directory)[0])
+
+            action = "Stream copying" if run["stream_copy"] else "Re-encoding"
+            logger.info(f"{action} {run['clips']} clips of '{run['concat_list']}' into HLS stream: {self.hls_path}...")
+            encoded = prepare_hls(
+                input_path=run["concat_list"],
+                output_path=self.hls_path,
+                rewrite=rewrite and index == 0,
+                append=self.append or index > 0,
+                threads=self.ffmpeg_threads,
+                input_format="concat",
+                video_bitrate=self.estimated_bitrate(total_bytes=run["bytes"], clip_count=run["clips"]),
+                stream_copy=run["stream_copy"],
+                segment_type=self.hls_segment_type,
+            )
+            if not encoded:
+                # The existing feed was left untouched
+                return False
+
+            if run_append and run["stream_copy"] is not previous_stream_copy:
+                self.mark_discontinuity(first_segment)
+            previous_stream_copy = run["stream_copy"]
 
-        logger.info(f"Generating HLS stream: {self.hls_path}...")
-        prepare_hls(input_path=self.video_out_path, output_path=self.hls_path, rewrite=rewrite)
         logger.info(f"Generated HLS stream: {self.hls_path}")
+        return True
+
+    def mark_discontinuity(self, first_segment):
+        """
+        Mark the first of the segments just appended to every media playlist as a discontinuity. Stream copied and
+        re-encoded segments have different H.264 parameter sets, players have to reset their decoder between them.
+        """
+        for playlist_path in media_playlist_paths(self.output_directory):
+            mark_discontinuity(playlist_path, first_segment)
+
+    def insert_gaps(self, timeline=None, first_segment=0):
+        """
+        Add the timeline's collapsed gaps to every media playlist as references to the shared blank segment of the
+        playlist's resolution
+        """
+        if timeline is None:
+            timeline = self.timeline
+
+        blank_segment_paths = [self.blank_segment_path] + [
+            const.blank_segment_path(os.path.dirname(self.blank_segment_path), height=rendition["height"])
+            for rendition in self.renditions
+        ]
+        for variant, blank_segment_path in enumerate(blank_segment_paths):
+            playlist_path = os.path.join(self.output_directory, f"output_stream_{variant}.m3u8")
+            logger.info(f"Inserting gaps into '{playlist_path}'")
+            insert_gap_segments(
+                playlist_path,
+                timeline,
+                os.path.relpath(blank_segment_path, self.output_directory),
+                slot_seconds=SLOT_SECONDS,
+                first_segment=first_segment,
+            )
+
+    def _snapshot_feed(self):
+        """
+        Keep a copy of the media playlists and the thumbnail track before appending to them. If a snapshot already
+        exists a previous append was interrupted, so the feed is restored from it before appending again.
+        """
+        for playlist_path in media_playlist_paths(self.output_directory):
+            snapshot_path = f"{playlist_path}.pre_append"
+            if os.path.exists(snapshot_path):
+                logger.warning(f"Restoring '{playlist_path}' from interrupted append")
+                shutil.copy(snapshot_path, playlist_path)
+            else:
+                shutil.copy(playlist_path, snapshot_path)
+
+        thumbnails.snapshot_thumbnails(self.output_directory)
+
+    def _discard_feed_snapshot(self):
+        for playlist_path in media_playlist_paths(self.output_directory):
+            snapshot_path = f"{playlist_path}.pre_append"
+            if os.path.exists(snapshot_path):
+                os.remove(snapshot_path)
+
+        thumbnails.discard_thumbnail_snapshot(self.output_directory)
+
+    def generate_hls_single_pass(self, rewrite, thumbnail_options=None):
+        if thumbnail_options is None:
+            thumbnail_options = {}
+
+        logger.info(
+            f"Generating HLS stream and preview image directly from '{self.m3u8_files_path}': {self.hls_path}..."
+        )
+        encoded = prepare_hls(
+            input_path=self.m3u8_files_path,
+            output_path=self.hls_path,
+            rewrite=rewrite,
+            append=self.append,
+            threads=self.ffmpeg_threads,
+            input_format="concat",
+            video_bitrate=self.estimated_bitrate(),
+            preview_output_path=None if self.append else self.preview_image_path,
+            preview_frame=self.total_frames // 2,
+            renditions=self.renditions,
+            segment_type=self.hls_segment_type,
+            **thumbnail_options,
+        )
+        logger.info(f"Generated HLS stream: {self.hls_path}")
+        return encoded
+
+    def _thumbnail_options(self, appending):
+        """
+        prepare_hls options that make the encode write trick play sprite sheets, empty if thumbnails are disabled.
+        Sprite sheets of a feed being appended to are numbered on from the existing ones.
+        """
+        if self.thumbnail_interval is None or self.stream_copy:
+            return {}
+
+        return {
+            "thumbnail_path_pattern": thumbnails.sprite_path_pattern(self.output_directory),
+            "thumbnail_interval": self.thumbnail_interval,
+            "thumbnail_start_number": thumbnails.next_sprite_index(self.output_directory) if appending else 0,
+        }
+
+    def remove_thumbnails(self):
+        """
+        Remove the thumbnail track and sprite sheets of a feed that's about to be generated from scratch. Cues are
+        appended to the track, so the cues of a previous (or interrupted) run would otherwise be kept.
+        """
+        thumbnails.remove_thumbnails(self.output_directory)
+
+    def write_thumbnail_track(self, timeline, thumbnail_options, start_seconds=0.0):
+        thumbnails.write_thumbnail_track(
+            self.output_directory,
+            timeline,
+            first_sprite=thumbnail_options["thumbnail_start_number"],
+            start_seconds=start_seconds,
+            interval=thumbnail_options["thumbnail_interval"],
+            slot_seconds=SLOT_SECONDS,
+        )
+
+    def generate_preview(self, rewrite):
+        if self.append and os.path.exists(self.preview_image_path):
+            logger.info(f"Keeping existing preview image '{self.preview_image_path}' while appending")
+            return
+
+        if (self.pipelined or (self.single_pass and not self.stream_copy)) and os.path.exists(self.preview_image_path):
+            # Already written while the HLS stream was generated
+            logger.info(f"Generated Preview Image: {self.preview_image_path}")
+            return
+
+        if self.single_pass or self.pipelined or self.stream_copy:
+            # Nothing has been decoded or output.mp4 doesn't exist, so grab the preview from the clip in the middle of
+            # the feed
+            input_path = self.get_clip_at_frame(self.total_frames // 2)
+        else:
+            input_path = self.video_out_path
 
         logger.info(f"Generating Preview Image: {self.preview_image_path}...")
-        generate_preview_image(input_path=self.video_out_path, output_path=self.preview_image_path, rewrite=rewrite)
-        logger.info(f"Generated Preview Image: {self.preview_image_path}")
+        generate_preview_image(
+            input_path=input_path,
+            output_path=self.preview_image_path,
+            rewrite=rewrite,
+            probe_cache=self.probe_cache,
+        )
+
+        if not os.path.exists(self.preview_image_path):
+            logger.warning(f"Could not generate preview image '{self.preview_image_path}'")
+        else:
+            logger.info(f"Generated Preview Image: {self.preview_image_path}")
+
+    def run_pipeline(self, rewrite):
+        """
+        Download, normalize and encode the timeline in sections of PIPELINE_SECTION_CLIPS clips. Each stage runs in its
+        own thread and hands finished sections to the next stage through a bounded queue, so early sections are encoded
+        while later sections are still being downloaded and only a few sections of clips wait on disk at any time. Every
+        encoded section's segments are appended to the HLS feed.
+
+        Gaps are collapsed up front from the video metadata, so clips that later fail to probe are encoded as the empty
+        clip instead of being collapsed.
+        """
+        files = self.get_files()
+        _, self.timeline = self._collapse_gaps([(None, file) for file in files])
+        sections = [files[ii : ii + PIPELINE_SECTION_CLIPS] for ii in range(0, len(files), PIPELINE_SECTION_CLIPS)]
+        # The preview is taken from the middle captured clip, so it shows the camera's video rather than the empty clip
+        captured_indices = [ii for ii, file in enumerate(files) if not file["missing"]]
+        if len(captured_indices) == 0:
+            captured_indices = [ii for ii, file in enumerate(files) if not file.get("collapsed", False)]
+        preview_index = captured_indices[len(captured_indices) // 2]
+
+        appending = self.append and os.path.exists(self.hls_path)
+        if appending:
+            self._snapshot_feed()
+        else:
+            self.remove_thumbnails()
+
+        self.concat_entries = []
+        self.total_frames = 0
+        self.total_bytes = 0
+
+        stop = threading.Event()
+        downloaded = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+        normalized = queue.Queue(maxsize=PIPELINE_QUEUE_DEPTH)
+
+        def _put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def _get(q):
+            while not stop.is_set():
+                try:
+                    return q.get(timeout=1)
+                except queue.Empty:
+                    continue
+            return None
+
+        def _download():
+            for section in sections:
+                with self.metrics.measure_busy("pipeline_download"):
+                    self.download_or_copy_files(videos=[file for file in section if not file["missing"]])
+                if not _put(downloaded, section):
+                    return
+            _put(downloaded, None)
+
+        def _normalize():
+            while True:
+                section = _get(downloaded)
+                if section is None or isinstance(section, Exception):
+                    _put(normalized, section)
+                    return
+
+                with self.metrics.measure_busy("pipeline_normalize"):
+                    results = self._probe_files([file for file in section if not file.get("collapsed", False)])
+                    if self.stream_copy and len(results) > 0:
+                        results = self._conform_for_stream_copy(results)
+                if not _put(normalized, (section, results)):
+                    return
+
+        def _run(stage, fn, output):
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Pipeline stage '{stage}' failed for '{self.output_directory}'")
+                _put(output, e)
+
+        threads = [
+            threading.Thread(target=_run, args=("download", _download, downloaded), daemon=True),
+            threading.Thread(target=_run, args=("normalize", _normalize, normalized), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            section_start = 0
+            encoded_sections = 0
+            pending_gap_slots = 0
+            # Whether the previous run was stream copied, unknown for the existing feed being appended to
+            previous_stream_copy = None
+            while True:
+                item = _get(normalized)
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                section, results = item
+                if section_start <= preview_index < section_start + len(section):
+                    self._generate_pipeline_preview(section[preview_index - section_start], rewrite=rewrite)
+                section_start += len(section)
+
+                if len(results) == 0:
+                    # Nothing to encode, the section's gap is added to the playlists with the next encoded section
+                    pending_gap_slots += len(section)
+                    continue
+
+                section_timeline = self._section_timeline(section, pending_gap_slots)
+                pending_gap_slots = 0
+
+                # The first section starts a new feed unless appending to an existing one, every later section is
+                # appended to the feed
+                encoding_append = appending or encoded_sections > 0
+                first_segment, feed_seconds = 0, 0.0
+                if encoding_append:
+                    first_segment, feed_seconds = playlist_length(media_playlist_paths(self.output_directory)[0])
+                thumbnail_options = self._thumbnail_options(appending=encoding_append)
+
+                # In stream copy mode the section is packaged in runs of clips that are stream copied or re-encoded
+                runs = self._stream_copy_runs(results) if self.stream_copy else [(False, results)]
+                frames, total_bytes = 0, 0
+                logger.info(f"Encoding section {encoded_sections} of '{self.output_directory}' ({len(section)} clips)")
+                for run_index, (run_stream_copy, run) in enumerate(runs):
+                    run_append = encoding_append or run_index > 0
+                    run_first_segment = first_segment
+                    if run_index > 0:
+                        run_first_segment, _ = playlist_length(media_playlist_paths(self.output_directory)[0])
+
+                    run_frames, run_bytes = self._write_concat_list(self.m3u8_files_path, run)
+                    with self.metrics.measure_busy("pipeline_encode"):
+                        prepare_hls(
+                            input_path=self.m3u8_files_path,
+                            output_path=self.hls_path,
+                            rewrite=not run_append,
+                            append=run_append,
+                            threads=self.ffmpeg_threads,
+                            input_format="concat",
+                            video_bitrate=self.estimated_bitrate(total_bytes=run_bytes, clip_count=len(run)),
+                            stream_copy=run_stream_copy,
+                            renditions=self.renditions,
+                            segment_type=self.hls_segment_type,
+                            **thumbnail_options,
+                        )
+                    if self.stream_copy and run_append and run_stream_copy is not previous_stream_copy:
+                        self.mark_discontinuity(run_first_segment)
+                    previous_stream_copy = run_stream_copy
+                    frames += run_frames
+                    total_bytes += run_bytes
+                if len(thumbnail_options) > 0:
+                    self.write_thumbnail_track(section_timeline, thumbnail_options, start_seconds=feed_seconds)
+                if any(kind == "gap" for kind, _ in section_timeline):
+                    self.insert_gaps(timeline=section_timeline, first_segment=first_segment)
+
+                encoded_sections += 1
+                self.total_frames += frames
+                self.total_bytes += total_bytes
+
+                if self.remove_encoded_clips:
+                    self._remove_section_clips(section)
+
+            if pending_gap_slots > 0 and encoded_sections > 0:
+                first_segment, _ = playlist_length(media_playlist_paths(self.output_directory)[0])
+                self.insert_gaps(timeline=[["gap", pending_gap_slots]], first_segment=first_segment)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        if appending:
+            self._discard_feed_snapshot()
+
+        self.probe_cache.save()
+        logger.info(f"Generated HLS stream: {self.hls_path}")
+
+        # The pipeline covered the download, normalize and concat stages too
+        self.manifest.complete("download", details={"pipelined": True})
+        self.manifest.complete("normalize", details=self.normalized_details())
+        self.manifest.complete("concat", details={"skipped": True})
+        return self.normalized_details()
+
+    def _section_timeline(self, section, leading_gap_slots=0):
+        timeline = [["gap", leading_gap_slots]] if leading_gap_slots > 0 else []
+        for file in section:
+            kind = "gap" if file.get("collapsed", False) else "video"
+            if len(timeline) > 0 and timeline[-1][0] == kind:
+                timeline[-1][1] += 1
+            else:
+                timeline.append([kind, 1])
+        return timeline
+
+    def _generate_pipeline_preview(self, file, rewrite):
+        if self.append and os.path.exists(self.preview_image_path):
+            return
+
+        logger.info(f"Generating Preview Image: {self.preview_image_path}...")
+        generate_preview_image(
+            input_path=file["video_streamer_path"],
+            output_path=self.preview_image_path,
+            rewrite=rewrite,
+            probe_cache=self.probe_cache,
+        )
+
+    def _remove_section_clips(self, section):
+        """
+        Delete the downloaded (and conformed) clips of an encoded section
+        """
+        for file in section:
+            if "data_id" not in file:
+                continue
+
+            paths = [self._local_clip_path(file)]
+
+            # A conformed clip is written next to the local copy, clips replaced with the (conformed) empty clip are
+            # left alone. Raw clips read in place are never removed.
+            if not file["missing"] and os.path.dirname(file["video_streamer_path"]) == self.output_directory:
+                paths.append(file["video_streamer_path"])
+
+            for path in paths:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def generate_hls_feed(self, rewrite):
+        self.concatenate_videos()
+        self.generate_hls(rewrite=rewrite)
+        self.generate_preview(rewrite=rewrite)
+
+    def manifest_inputs(self):
+        """
+        Everything that determines the output of the pipeline. If none of it changes, neither does the output.
+        """
+        return {
+            "start": self.start_datetime,
+            "end": self.end_datetime,
+            "clips": [[v["data_id"], v["path"]] for v in self.captured_video_list],
+            "empty_clip_path": self.empty_clip_path,
+            "single_pass": self.single_pass,
+            "stream_copy": self.stream_copy,
+            "append": self.append,
+            "collapse_gaps": self.collapse_gaps,
+            "pipelined": self.pipelined,
+            "read_raw_in_place": self.read_raw_in_place,
+            "renditions": self.renditions,
+            "hls_segment_type": self.hls_segment_type,
+            "thumbnail_interval": self.thumbnail_interval,
+        }
+
+    def _restore_normalized_files(self, details):
+        self.concat_entries = [tuple(entry) for entry in details["concat_entries"]]
+        self.total_frames = details["total_frames"]
+        self.total_bytes = details["total_bytes"]
+        self.timeline = details.get("timeline", [["video", len(self.concat_entries)]])
+        self.stream_copy_runs = details.get("stream_copy_runs", [])
+
+    def _run_stage(self, stage, fn, rewrite=False):
+        """
+        Run a pipeline stage unless the manifest shows it already completed. A stage that was started but never
+        completed may have left partial output behind, so it's re-run with rewrite enabled.
+        """
+        if self.manifest.is_complete(stage):
+            logger.info(f"Stage '{stage}' already complete for '{self.output_directory}', skipping")
+            self.metrics.skip(stage)
+            return
+
+        stage_rewrite = rewrite or self.manifest.is_started(stage)
+        self.manifest.start(stage)
+        with self.metrics.measure(stage):
+            details = fn(stage_rewrite)
+        self.manifest.complete(stage, details=details)
+
+    def metrics_summary(self):
+        """
+        Stage metrics and clip counts of this run
+        """
+        summary = self.metrics.summary()
+        summary["counters"].update(
+            {
+                "clips": len(self.captured_video_list),
+                "missing_slots": len(self.missing_video_list),
+                "collapsed_slots": sum(slots for kind, slots in self.timeline if kind == "gap"),
+                "frames": self.total_frames,
+            }
+        )
+        return summary
 
     def execute(self, rewrite=False):
         if not self.loaded:
             self.load()
 
-        self.download_or_copy_files()
-        self.process_raw_files()
-        self.generate_hls_feed(rewrite=rewrite)
+        # A retried append (i.e. after another camera failed) may see different clips for the range it already
+        # appended, whether there's anything left to append is decided by where the feed ends, not by the inputs
+        if self.append and self.manifest.feed_end is not None and self.manifest.feed_end >= self.end_datetime:
+            logger.info(f"'{self.output_directory}' already appended through {self.manifest.feed_end}, skipping")
+            return
+
+        inputs = self.manifest_inputs()
+        input_fingerprint = fingerprint(inputs)
+        if self.manifest.fingerprint == input_fingerprint:
+            if self.manifest.is_complete():
+                logger.info(f"Inputs for '{self.output_directory}' unchanged since the last completed run, skipping")
+                return
+
+            logger.info(f"Resuming '{self.output_directory}' at stage '{self.manifest.first_incomplete_stage()}'")
+        else:
+            if self.manifest.fingerprint is not None and not self.append:
+                # Anything generated by the previous run is stale
+                logger.info(f"Inputs for '{self.output_directory}' changed since the last run, regenerating")
+                rewrite = True
+
+            manifest_inputs = {k: v for k, v in inputs.items() if k != "clips"}
+            manifest_inputs["clip_count"] = len(inputs["clips"])
+            self.manifest.reset(input_fingerprint=input_fingerprint, inputs=manifest_inputs)
+
+        if self.manifest.is_complete("normalize"):
+            self._restore_normalized_files(self.manifest.details("normalize"))
+
+        if self.pipelined:
+            self._run_stage("hls", lambda stage_rewrite: self.run_pipeline(rewrite=stage_rewrite), rewrite=rewrite)
+        else:
+            self._run_stage("download", lambda _: {"downloaded": len(self.download_or_copy_files())})
+            self._run_stage("normalize", lambda _: self.process_raw_files())
+            self._run_stage("concat", lambda _: self.concatenate_videos())
+            self._run_stage("hls", lambda stage_rewrite: self.generate_hls(rewrite=stage_rewrite), rewrite=rewrite)
+        self._run_stage("preview", lambda stage_rewrite: self.generate_preview(rewrite=stage_rewrite), rewrite=rewrite)
+        self.manifest.complete_feed(self.end_datetime)
+        self.probe_cache.save()
@@ -0,0 +1,182 @@
+import glob
+import json
+import os
+import struct
+
+from .log import logger
+
+
+THUMBNAILS_VTT_NAME = "thumbnails.vtt"
+SPRITE_NAME_PATTERN = "thumbnails_%04d.jpg"
+
+
+def sprite_path_pattern(hls_directory):
+    return os.path.join(hls_directory, SPRITE_NAME_PATTERN)
+
+
+def thumbnail_track_path(hls_directory):
+    return os.path.join(hls_directory, THUMBNAILS_VTT_NAME)
+
+
+def thumbnail_snapshot_path(hls_directory):
+    return os.path.join(hls_directory, "thumbnails.pre_append.json")
+
+
+def remove_thumbnails(hls_directory):
+    for path in glob.glob(os.path.join(hls_directory, "thumbnails_*.jpg")) + [thumbnail_track_path(hls_directory)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def snapshot_thumbnails(hls_directory):
+    """
+    Record the thumbnail track and the number of sprite sheets before appending to a feed. If a snapshot already exists
+    a previous append was interrupted, so the cues and sprite sheets it added are removed before appending again.
+    """
+    snapshot_path = thumbnail_snapshot_path(hls_directory)
+    if os.path.exists(snapshot_path):
+        logger.warning(f"Restoring thumbnails of '{hls_directory}' from interrupted append")
+        restore_thumbnails(hls_directory)
+        return
+
+    track_path = thumbnail_track_path(hls_directory)
+    track = None
+    if os.path.exists(track_path):
+        with open(track_path, "r", encoding="utf-8") as fp:
+            track = fp.read()
+
+    tmp_path = f"{snapshot_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fp:
+        json.dump({"track": track, "sprites": next_sprite_index(hls_directory)}, fp)
+    os.replace(tmp_path, snapshot_path)
+
+
+def restore_thumbnails(hls_directory):
+    """
+    Put the thumbnail track and sprite sheets back the way they were when snapshot_thumbnails was called
+    """
+    with open(thumbnail_snapshot_path(hls_directory), "r", encoding="utf-8") as fp:
+        snapshot = json.load(fp)
+
+    # Sprite sheets are numbered on from the existing ones, the ones numbered from the snapshot's count on are new
+    for sprite in range(snapshot["sprites"], next_sprite_index(hls_directory)):
+        os.remove(sprite_path_pattern(hls_directory) % sprite)
+
+    track_path = thumbnail_track_path(hls_directory)
+    if snapshot["track"] is None:
+        if os.path.exists(track_path):
+            os.remove(track_path)
+    else:
+        with open(track_path, "w", encoding="utf-8") as fp:
+            fp.write(snapshot["track"])
+
+
+def discard_thumbnail_snapshot(hls_directory):
+    snapshot_path = thumbnail_snapshot_path(hls_directory)
+    if os.path.exists(snapshot_path):
+        os.remove(snapshot_path)
+
+
+def jpeg_size(path):
+    """
+    Read a JPEG's width and height from its start of frame marker
+
+    :return: tuple of width and height
+    """
+    with open(path, "rb") as fp:
+        if fp.read(2) != b"\xff\xd8":
+            raise ValueError(f"'{path}' isn't a JPEG")
+
+        while True:
+            marker = fp.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                raise ValueError(f"No frame header found in '{path}'")
+
+            (length,) = struct.unpack(">H", fp.read(2))
+            # SOF0-SOF15, excluding DHT (C4), JPG (C8) and DAC (CC)
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">xHH", fp.read(5))
+                return width, height
+
+            fp.seek(length - 2, os.SEEK_CUR)
+
+
+def _vtt_timestamp(seconds):
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02}:{int(minutes):02}:{seconds:06.3f}"
+
+
+def next_sprite_index(hls_directory):
+    """
+    Index the next sprite sheet of a feed being appended to is numbered from
+    """
+    return len(glob.glob(os.path.join(hls_directory, "thumbnails_*.jpg")))
+
+
+def write_thumbnail_track(
+    hls_directory, timeline, first_sprite=0, start_seconds=0.0, interval=10, tile=(10, 10), slot_seconds=10
+):
+    """
+    Append cues for the sprite sheets written by an encode to the camera's WebVTT thumbnail track. Each cue points at
+    one tile of a sprite sheet with a media fragment (sprite.jpg#xywh=x,y,w,h).
+
+    The encode produced one thumbnail every interval seconds of encoded video, tiled columns x rows per sprite sheet
+    starting at sprite index first_sprite. Thumbnails are laid out on the timeline so collapsed gaps, which weren't
+    encoded, get no cues.
+
+    :param timeline: [kind, slot count] runs of the encode, kind is "video" or "gap"
+    :param start_seconds: Position of the encode's first slot in the feed
+    """
+    track_path = thumbnail_track_path(hls_directory)
+    columns, rows = tile
+    per_sprite = columns * rows
+
+    sprite_sizes = {}
+
+    def _tile_geometry(thumbnail):
+        sprite = first_sprite + thumbnail // per_sprite
+        if sprite not in sprite_sizes:
+            sprite_path = sprite_path_pattern(hls_directory) % sprite
+            if not os.path.exists(sprite_path):
+                return None
+            width, height = jpeg_size(sprite_path)
+            sprite_sizes[sprite] = (width // columns, height // rows)
+
+        tile_width, tile_height = sprite_sizes[sprite]
+        position = thumbnail % per_sprite
+        x = (position % columns) * tile_width
+        y = (position // columns) * tile_height
+        return os.path.basename(sprite_path_pattern(hls_directory) % sprite), x, y, tile_width, tile_height
+
+    cues = []
+    encoded_seconds = 0.0
+    timeline_seconds = start_seconds
+    for kind, slots in timeline:
+        run_seconds = slots * slot_seconds
+        if kind == "video":
+            run_end = encoded_seconds + run_seconds
+            thumbnail = int(encoded_seconds // interval)
+            while thumbnail * interval < run_end:
+                cue_start = max(thumbnail * interval, encoded_seconds)
+                cue_end = min((thumbnail + 1) * interval, run_end)
+                geometry = _tile_geometry(thumbnail)
+                if geometry is None:
+                    break
+
+                offset = timeline_seconds - encoded_seconds
+                cues.append((cue_start + offset, cue_end + offset, geometry))
+                thumbnail += 1
+            encoded_seconds = run_end
+        timeline_seconds += run_seconds
+
+    new_track = not os.path.exists(track_path)
+    with open(track_path, "a", encoding="utf-8") as fp:
+        if new_track:
+            fp.write("WEBVTT\n")
+        for cue_start, cue_end, (sprite_name, x, y, width, height) in cues:
+            fp.write(f"\n{_vtt_timestamp(cue_start)} --> {_vtt_timestamp(cue_end)}\n")
+            fp.write(f"{sprite_name}#xywh={x},{y},{width},{height}\n")
+
+    logger.info(f"Wrote {len(cues)} thumbnail cues to '{track_path}'")
+    return len(cues)
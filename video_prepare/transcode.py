@@ -1,77 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+import json
 import os.path
 import shutil
-import subprocess
+import struct
+import threading
 
 import ffmpeg
 
+from . import ffmpeg_supervisor
+from .const import (  # pylint: disable=unused-import
+    HLS_SEGMENT_TYPES,
+    VALIDATION_DECODE,
+    VALIDATION_LEVELS,
+    VALIDATION_PACKETS,
+    VALIDATION_STRUCTURE,
+)
+from .governor import governor
+from .hls_playlist import media_playlist_paths, parse_media_playlist, playlist_length
 from .util import convert_kwargs_to_cmd_line_args
 from .log import logger
-from .stream_reader import NonBlockingStreamReader, StreamTimeout
 
 
 def is_valid_video(video_path):
     """
-    Validate integrity of a video file. Include stream output reader to catch issue
-    with ffmpeg hanging when reading corrupted HLS video file.
-
-    TODO: Consider replacing the repeat_threshold logic with explicit check for repeated log msg that suggest HLS is stuck: "Skip ('#EXT-X-VERSION:3')\n"
-    TODO: Tweak timeout_threshold to find better balance between allowing time for file to be fully scanned and time to assume file read is simply stuck
+    Validate integrity of a video file by decoding all of it. ffmpeg can hang reading a corrupted HLS video file, the
+    supervisor kills the read once decoding stops making progress.
 
     :param video_path: Absolute/relative path to video
     :return: boolean
     """
+    threads = governor.ffmpeg_threads()
     try:
-        # Read video file, output stdout to /dev/null, allow for repeated log
-        # messages, run aynchronously so we can scan output to stderr
-        process_vid = (
-            ffmpeg.input(video_path)
-            .output("/dev/null", f="null")
-            .global_args("-loglevel", "repeat")
-            .run_async(pipe_stderr=True)
+        ffmpeg_supervisor.run_stream(
+            ffmpeg.input(video_path, threads=threads).output("/dev/null", f="null").global_args("-loglevel", "warning"),
+            description=f"decode {video_path}",
+            threads=threads,
         )
-        nb_stderr_stream = NonBlockingStreamReader(process_vid.stderr)
-
-        last_output = ""
-        repeat = 0
-        repeat_threshold = 30  # Number of times to allow a repeated log message
-        timeout_threshold = 1800  # Break if stderr hasn't output a msg in 30 minutes
-        while True:
-            output = nb_stderr_stream.readline(timeout_threshold)
-            if not output:
-                # Stream exhausted, file read successfully!
-                return True
-            logger.info(output)
-
-            if repeat >= repeat_threshold:
-                logger.warning("File read stuck in repeat loop, terminating read")
+    except ffmpeg_supervisor.FfmpegStalled:
+        logger.warning(f"ffmpeg stopped making progress reading '{video_path}', terminated read")
+        return False
+    except ffmpeg._run.Error:
+        logger.error(f"video file '{video_path}' corrupt")
+        return False
+
+    return True
+
+
+MP4_EXTENSIONS = [".mp4", ".m4v", ".mov"]
+
+
+def validate_video(video_path, level=VALIDATION_PACKETS, packet_tolerance=0.05, probe_cache=None):
+    """
+    Tiered integrity check of a video file. Unlike is_valid_video, the default tier never decodes the video: the
+    container structure is checked first (for MP4s every top level box must be intact and both moov and mdat present,
+    for HLS every segment of every media playlist must exist), then ffprobe counts the video stream's packets and the
+    count is compared with the stream's frame count and duration.
+
+    :param video_path: Path to video
+    :param level: Most thorough validation tier to run, one of VALIDATION_LEVELS
+    :param packet_tolerance: Fraction of the packets expected from the stream's duration that may be missing
+    :return: boolean
+    """
+    if level not in VALIDATION_LEVELS:
+        raise ValueError(f"Unknown validation level '{level}', expected one of {VALIDATION_LEVELS}")
+
+    if not os.path.exists(video_path) or os.path.getsize(video_path) == 0:
+        logger.warning(f"video file '{video_path}' missing or empty")
+        return False
+
+    if os.path.splitext(video_path)[1].lower() in MP4_EXTENSIONS and not _is_valid_mp4_structure(video_path):
+        logger.warning(f"video file '{video_path}' has a truncated or incomplete container")
+        return False
+
+    if os.path.splitext(video_path)[1].lower() == ".m3u8" and not _is_valid_hls_structure(video_path):
+        logger.warning(f"HLS feed '{video_path}' is missing media playlists or segments")
+        return False
+
+    if level == VALIDATION_STRUCTURE:
+        return True
+
+    if not _is_valid_packet_count(video_path, packet_tolerance=packet_tolerance, probe_cache=probe_cache):
+        return False
+
+    if level == VALIDATION_PACKETS:
+        return True
+
+    return is_valid_video(video_path)
+
+
+def validate_videos(video_paths, level=VALIDATION_PACKETS, workers=None, probe_cache=None):
+    """
+    Validate many video files in parallel
+
+    :param workers: Number of videos validated at once, by default as many as the resource governor's budget keeps busy
+    :return: dict of video path to boolean
+    """
+    if workers is None:
+        workers = governor.probe_workers()
+
+    def _validate(video_path):
+        try:
+            return video_path, validate_video(video_path, level=level, probe_cache=probe_cache)
+        except Exception as e:
+            logger.warning(f"Failed validating '{video_path}': {e}")
+            return video_path, False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(executor.map(_validate, video_paths))
+        executor.shutdown(wait=True)
+
+    return results
+
+
+def _is_valid_mp4_structure(video_path):
+    """
+    Walk the top level boxes of an MP4. The boxes must exactly cover the file (a truncated download leaves the last box
+    short) and include both the moov (stream table) and mdat (media data) boxes.
+    """
+    file_size = os.path.getsize(video_path)
+    box_types = set()
+    offset = 0
+    with open(video_path, "rb") as fp:
+        while offset < file_size:
+            fp.seek(offset)
+            header = fp.read(8)
+            if len(header) < 8:
                 return False
 
-            if output == last_output:
-                repeat += 1
-            else:
-                repeat = 0
+            box_size, box_type = struct.unpack(">I4s", header)
+            if box_size == 1:
+                large_size = fp.read(8)
+                if len(large_size) < 8:
+                    return False
+                box_size = struct.unpack(">Q", large_size)[0]
+            elif box_size == 0:
+                # Box extends to the end of the file
+                box_size = file_size - offset
+
+            if box_size < 8:
+                return False
+
+            box_types.add(box_type)
+            offset += box_size
 
-            last_output = output
-    except StreamTimeout:
-        logger.warning("Stream timeout, ffmpeg hanging reading video file")
+    return offset == file_size and b"moov" in box_types and b"mdat" in box_types
+
+
+def _is_valid_hls_structure(master_playlist_path):
+    hls_directory = os.path.dirname(master_playlist_path)
+    playlist_paths = media_playlist_paths(hls_directory)
+    if len(playlist_paths) == 0:
         return False
-    except ffmpeg._run.Error:
-        logger.error(f"video file '{video_path}' corrupt")
+
+    for playlist_path in playlist_paths:
+        segments = parse_media_playlist(playlist_path)
+        if len(segments) == 0:
+            return False
+
+        for segment in segments:
+            if not os.path.exists(os.path.join(hls_directory, segment["uri"])):
+                return False
+
+    return True
+
+
+def _ffprobe_count_packets(mp4_video_path):
+    try:
+        return ffmpeg_supervisor.probe(mp4_video_path, select_streams="v:0", count_packets=None)
+    except Exception as err:
+        logger.error(err)
+        raise err
+
+
+def _is_valid_packet_count(video_path, packet_tolerance=0.05, probe_cache=None):
+    try:
+        if probe_cache is None:
+            probe = _ffprobe_count_packets(video_path)
+        else:
+            probe = probe_cache.probe(video_path, "count_packets", _ffprobe_count_packets)
+    except Exception:
+        logger.warning(f"video file '{video_path}' can't be probed")
+        return False
+
+    video_stream = next((stream for stream in probe.get("streams", []) if stream.get("codec_type") == "video"), None)
+    if video_stream is None:
+        logger.warning(f"video file '{video_path}' has no video stream")
+        return False
+
+    packets = int(video_stream.get("nb_read_packets", 0))
+    if packets == 0:
+        logger.warning(f"video file '{video_path}' has no video packets")
+        return False
+
+    # The stream table's frame count (MP4 only) must be backed by packets that can actually be read
+    if "nb_frames" in video_stream and packets < int(video_stream["nb_frames"]):
+        logger.warning(f"video file '{video_path}' has {packets} of {video_stream['nb_frames']} packets")
         return False
 
+    duration = video_stream.get("duration", probe.get("format", {}).get("duration"))
+    if duration is not None and video_stream.get("avg_frame_rate", "0/0") != "0/0":
+        expected_packets = float(duration) * Fraction(video_stream["avg_frame_rate"])
+        if packets < expected_packets * (1 - packet_tolerance):
+            logger.warning(f"video file '{video_path}' has {packets} packets, expected {float(expected_packets):.0f}")
+            return False
+
     return True
 
 
-def probe_file(mp4_video_path):
+class ProbeCache:
+    """
+    Cache of ffprobe results so each file is probed at most once. Entries are keyed by path and invalidated when the
+    file's size or mtime change. If a cache_path is given the cache is loaded from and saved to that JSON file, allowing
+    re-runs to skip probing entirely.
+    """
+
+    def __init__(self, cache_path=None):
+        self.cache_path = cache_path
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r", encoding="utf-8") as fp:
+                    self._entries = json.load(fp)
+            except (IOError, ValueError) as e:
+                logger.warning(f"Unable to load probe cache '{cache_path}', starting with an empty cache: {e}")
+
+    def probe(self, path, kind, probe_fn):
+        """
+        Return the cached result of probe_fn(path), running the probe if the file has no valid entry
+
+        :param path: Path to the file being probed
+        :param kind: Name of the probe, allows caching different probes of the same file
+        :param probe_fn: Function that probes the given path
+        """
+        abs_path = os.path.abspath(path)
+        stat = os.stat(abs_path)
+
+        with self._lock:
+            entry = self._entries.get(abs_path)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                if kind in entry["probes"]:
+                    return entry["probes"][kind]
+
+        result = probe_fn(path)
+
+        with self._lock:
+            entry = self._entries.get(abs_path)
+            if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+                entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "probes": {}}
+                self._entries[abs_path] = entry
+            entry["probes"][kind] = result
+            self._dirty = True
+
+        return result
+
+    def save(self):
+        if self.cache_path is None:
+            return
+
+        with self._lock:
+            if not self._dirty:
+                return
+
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fp:
+                json.dump(self._entries, fp)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
+
+
+def _ffprobe(mp4_video_path):
+    try:
+        return ffmpeg_supervisor.probe(mp4_video_path)
+    except Exception as err:
+        logger.error(err)
+        raise err
+
+
+def _ffprobe_packets(mp4_video_path):
     try:
-        return ffmpeg.probe(mp4_video_path)
+        return ffmpeg_supervisor.probe(mp4_video_path, select_streams="v:0", show_entries="packet=flags")
     except Exception as err:
         logger.error(err)
         raise err
 
 
-def count_frames(mp4_video_path):
-    probe = probe_file(mp4_video_path)
+def probe_file(mp4_video_path, probe_cache=None):
+    if probe_cache is None:
+        return _ffprobe(mp4_video_path)
+
+    return probe_cache.probe(mp4_video_path, "format", _ffprobe)
+
+
+def probe_packets(mp4_video_path, probe_cache=None):
+    if probe_cache is None:
+        return _ffprobe_packets(mp4_video_path)
+
+    return probe_cache.probe(mp4_video_path, "packets", _ffprobe_packets)
+
+
+def count_frames(mp4_video_path, probe_cache=None):
+    probe = probe_file(mp4_video_path, probe_cache=probe_cache)
     if probe is None or "streams" not in probe:
         err = f"ffmpeg returned unexpected response reading {mp4_video_path}"
         logger.error(err)
@@ -81,8 +314,8 @@ def count_frames(mp4_video_path):
     return int(video_stream["nb_frames"])
 
 
-def bitrate(mp4_video_path):
-    probe = probe_file(mp4_video_path)
+def bitrate(mp4_video_path, probe_cache=None):
+    probe = probe_file(mp4_video_path, probe_cache=probe_cache)
     if probe is None or "streams" not in probe:
         err = f"ffmpeg returned unexpected response reading {mp4_video_path}"
         logger.error(err)
@@ -91,8 +324,124 @@ def bitrate(mp4_video_path):
     return int(video_stream["bit_rate"])
 
 
-def get_duration(hls_video_path):
-    probe = ffmpeg.probe(hls_video_path)
+def video_stream_format(mp4_video_path, probe_cache=None):
+    """
+    Describe the video stream of the given file along with the positions of its keyframes.
+
+    :param mp4_video_path: Path to video file
+    :return: dict with codec_name, pix_fmt, width, height, fps and keyframes (list of packet indices)
+    """
+    probe = probe_packets(mp4_video_path, probe_cache=probe_cache)
+    if probe is None or "streams" not in probe:
+        err = f"ffmpeg returned unexpected response reading {mp4_video_path}"
+        logger.error(err)
+        raise ValueError(err)
+
+    video_stream = next((stream for stream in probe["streams"] if stream["codec_type"] == "video"), None)
+    if video_stream is None:
+        err = f"no video stream found in {mp4_video_path}"
+        logger.error(err)
+        raise ValueError(err)
+
+    fps = None
+    if video_stream.get("avg_frame_rate", "0/0") != "0/0":
+        fps = Fraction(video_stream["avg_frame_rate"])
+
+    keyframes = [idx for idx, packet in enumerate(probe.get("packets", [])) if "K" in packet.get("flags", "")]
+
+    return {
+        "codec_name": video_stream.get("codec_name"),
+        "pix_fmt": video_stream.get("pix_fmt"),
+        "width": video_stream.get("width"),
+        "height": video_stream.get("height"),
+        "fps": fps,
+        "keyframes": keyframes,
+    }
+
+
+def is_stream_copy_compatible(video_format, width, height, fps=10, gop=100, codec_name="h264", pix_fmt="yuv420p"):
+    """
+    Check whether a clip can be packaged into HLS with "-c copy": codec, pixel format, resolution and frame rate must
+    match the target, the clip must start on a keyframe and keyframes can't be further than one segment apart.
+
+    :param video_format: dict as returned by video_stream_format()
+    :return: boolean
+    """
+    if video_format["codec_name"] != codec_name or video_format["pix_fmt"] != pix_fmt:
+        return False
+
+    if video_format["width"] != width or video_format["height"] != height:
+        return False
+
+    if video_format["fps"] is None or video_format["fps"] != fps:
+        return False
+
+    keyframes = video_format["keyframes"]
+    if len(keyframes) == 0 or keyframes[0] != 0:
+        return False
+
+    for previous_keyframe, keyframe in zip(keyframes, keyframes[1:]):
+        if keyframe - previous_keyframe > gop:
+            return False
+
+    return True
+
+
+def conform_video(input_path, output_path, width, height, fps=10, gop=100, threads=None):
+    """
+    Re-encode a clip so it can be stream copied alongside the rest of a camera's clips.
+
+    :param input_path: Path to video file input
+    :param output_path: Path to video file output
+    :param width: Target width
+    :param height: Target height
+    :param fps: Target frame rate
+    :param gop: Keyframe interval in frames, should match the HLS segment length
+    :param threads: Encoder threads, by default the resource governor's encode threads
+    :return: boolean
+    """
+    if threads is None:
+        threads = governor.ffmpeg_threads()
+
+    logger.info(f"Conforming video '{input_path}' to {width}x{height}@{fps}fps for stream copy")
+
+    output_options = dict(
+        vcodec="libx264",
+        preset="veryfast",
+        crf=23,
+        pix_fmt="yuv420p",
+        r=fps,
+        g=gop,
+        keyint_min=gop,
+        sc_threshold=0,
+        threads=threads,
+    )
+
+    # Write to a temporary file first so an interrupted encode is never mistaken for a conformed clip
+    tmp_path = f"{output_path}.tmp"
+    try:
+        ffmpeg_supervisor.run_stream(
+            ffmpeg.input(input_path)
+            .filter("scale", width, height)
+            .output(tmp_path, format="mp4", **output_options)
+            .global_args("-loglevel", "warning")
+            .overwrite_output(),
+            threads=threads,
+        )
+        os.replace(tmp_path, output_path)
+    except ffmpeg._run.Error as e:
+        logger.error(f"Failed conforming video {input_path}")
+        logger.error(e)
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return True
+
+
+def get_duration(hls_video_path, probe_cache=None):
+    probe = probe_file(hls_video_path, probe_cache=probe_cache)
     return float(probe["format"]["duration"])
 
 
@@ -107,9 +456,12 @@ def trim_video(input_path, output_path, duration=10):
             shutil.copy(input_path, tmp_path)
             ffmpeg_input_path = tmp_path
 
-        ffmpeg.input(ffmpeg_input_path, ss=0, to=duration).output(output_path, r=10, vframes=100).global_args(
-            "-loglevel", "warning"
-        ).overwrite_output().run()
+        ffmpeg_supervisor.run_stream(
+            ffmpeg.input(ffmpeg_input_path, ss=0, to=duration)
+            .output(output_path, r=10, vframes=100, threads=1)
+            .global_args("-loglevel", "warning")
+            .overwrite_output()
+        )
     except ffmpeg._run.Error as e:
         logger.error(f"Failed trimming video {input_path}")
         logger.error(e)
@@ -140,15 +492,16 @@ def concat_videos(input_path, output_path, rewrite=False):
         try:
             concat_mp4_exists = os.path.exists(output_path)
             if concat_mp4_exists:
-                if rewrite or not is_valid_video(output_path):
+                if rewrite or not validate_video(output_path):
                     os.remove(output_path)
                     concat_mp4_exists = False
 
             if not concat_mp4_exists:
-                files = ffmpeg.input(f"file:{input_path}", format="concat", safe=0, r=10)
-                files.output(f"file:{output_path}", c="copy", r=10, fps_mode=0).global_args(
-                    "-loglevel", "warning"
-                ).run()
+                # Timestamps from the concat list are kept so gaps left by short clips are filled by the encoder
+                files = ffmpeg.input(f"file:{input_path}", format="concat", safe=0)
+                ffmpeg_supervisor.run_stream(
+                    files.output(f"file:{output_path}", c="copy", r=10, fps_mode=0).global_args("-loglevel", "warning")
+                )
             else:
                 logger.info(f"concatenated video '{output_path}' already exists")
 
@@ -164,73 +517,241 @@ def concat_videos(input_path, output_path, rewrite=False):
         raise Exception("Failed concatenating mp4 file")
 
 
-def prepare_hls(input_path, output_path, hls_time=10, rewrite=False, append=True, include_low_res_stream=False):
+def prepare_hls(
+    input_path,
+    output_path,
+    hls_time=10,
+    rewrite=False,
+    append=False,
+    renditions=None,
+    threads=None,
+    input_format=None,
+    video_bitrate=None,
+    preview_output_path=None,
+    preview_frame=None,
+    stream_copy=False,
+    probe_cache=None,
+    segment_type="mpegts",
+    thumbnail_path_pattern=None,
+    thumbnail_interval=10,
+    thumbnail_tile=(10, 10),
+    thumbnail_width=160,
+    thumbnail_start_number=0,
+):
+    """
+    Encode the input into an HLS feed.
+
+    When input_format is "concat", input_path is read as an ffmpeg concat demuxer list so the HLS segments are
+    produced straight from the source clips. If preview_output_path is given, the frame at index preview_frame is
+    written there as a JPEG by the same ffmpeg process.
+
+    When append is enabled and the HLS feed already exists, the input is encoded as new segments that continue the
+    existing segment numbering and timestamps and are appended to the existing media playlists.
+
+    Every rendition in renditions is scaled from the same decode (the decoded video is split once and each branch
+    scaled and encoded) and written as an additional variant of the master playlist. The source resolution is always
+    variant 0 (output_stream_0.m3u8), renditions follow in order. Segments of every variant are cut at the same
+    timestamps, so players can switch between them at any segment boundary.
+
+    With segment_type "fmp4" each variant is written as a single fragmented MP4 (CMAF) file, stream_%v.m4s, and the
+    media playlists address each segment with EXT-X-BYTERANGE. Single file feeds can't be appended to.
+
+    If thumbnail_path_pattern is given, the same decode produces trick play sprite sheets: one thumbnail every
+    thumbnail_interval seconds, thumbnail_width wide, tiled columns x rows per JPEG and numbered from
+    thumbnail_start_number (see thumbnails.write_thumbnail_track for the matching WebVTT track).
+
+    :param input_path: Path to a video file or a concat demuxer list
+    :param output_path: Path to the HLS master playlist
+    :param append: Append to an existing HLS feed instead of leaving it untouched
+    :param renditions: Optional ABR ladder, list of {"height": int, "bitrate": str} dicts (see
+                       util.parse_rendition_ladder). Renditions are never scaled above the source's height.
+    :param input_format: Optional ffmpeg input format (i.e. "concat")
+    :param threads: Encoder threads, by default the resource governor's encode threads. Stream copies use one.
+    :param video_bitrate: Target bitrate, probed from input_path if not given
+    :param preview_output_path: Optional path to write a preview image to
+    :param preview_frame: Index of the frame to use for the preview image
+    :param stream_copy: Package the input without re-encoding, the input must already be H.264 with a keyframe at the
+                        start of every segment (see is_stream_copy_compatible)
+    :param probe_cache: Optional ProbeCache used when probing the input's bitrate
+    :param segment_type: "mpegts" for a .ts file per segment or "fmp4" for a single fragmented MP4 file per variant
+    :param thumbnail_path_pattern: Optional image2 pattern (i.e. thumbnails_%04d.jpg) to write sprite sheets to
+    :param thumbnail_tile: tuple of the number of columns and rows of thumbnails in each sprite sheet
+    :return: True if the input was encoded, False if an existing feed was left untouched
+    """
+    if segment_type not in HLS_SEGMENT_TYPES:
+        raise ValueError(f"Unknown HLS segment type '{segment_type}', expected one of {HLS_SEGMENT_TYPES}")
     hls_exists = os.path.exists(output_path)
     hls_directory = os.path.dirname(output_path)
 
     if hls_exists:
-        # Commenting out valid video check, great idea but is VERY SLOW:
-        if rewrite:  # or not is_valid_video(output_path):
+        # Only the feed's structure is checked, ffprobe would read every segment of the feed
+        if rewrite or (not append and not validate_video(output_path, level=VALIDATION_STRUCTURE)):
             os.remove(output_path)
 
             for item in os.listdir(hls_directory):
-                if item.endswith(".m3u8") or item.endswith(".ts"):
+                if item.endswith(".m3u8") or item.endswith(".ts") or item.endswith(".m4s") or item.endswith(".vtt"):
+                    os.remove(os.path.join(hls_directory, item))
+                elif item.startswith("thumbnails_") and item.endswith(".jpg"):
                     os.remove(os.path.join(hls_directory, item))
             hls_exists = False
 
-    if not hls_exists:
-        segment_format = "%03d.ts"
-        segment_filenames = os.path.join(hls_directory, f"%v_{segment_format}")
-        m3u8_steams_output = os.path.join(hls_directory, "output_stream_%v.m3u8")
-
-        hls_filter_complex = None
-        hls_map = ["0:v"]
-        hls_var_stream_map = "v:0"
-
-        if include_low_res_stream:
-            hls_filter_complex = "[0:v]split=2[v1out][v2];[v2]scale=iw*.5:ih*.5[v2out]"
-            hls_map = ["[v1out]", "[v2out]"]
-            hls_var_stream_map = "v:0 v:1"
-
-        hls_options = dict(
-            loglevel="warning",
-            preset="veryfast",
-            crf=29,
-            filter_complex=hls_filter_complex,
-            map=hls_map,
-            f="hls",
-            hls_time=hls_time,
-            hls_list_size=0,
-            hls_playlist_type="event",  # Allow appending to video
-            hls_segment_filename=segment_filenames,
-            var_stream_map=hls_var_stream_map,
-            r=10,
-            master_pl_name="output.m3u8",
-        )
-        hls_options["c:v:0"] = "libx264"
-        hls_options["b:v:0"] = f"{bitrate(input_path)}"
+    if hls_exists and not append:
+        logger.info(f"hls video '{output_path}' already exists, and append mode set to 'False'")
+        return False
 
-        if include_low_res_stream:
-            hls_options["c:v:1"] = "libx264"
-            hls_options["b:v:1"] = "600k"
+    if hls_exists and segment_type == "fmp4":
+        raise ValueError(f"Can't append to hls video '{output_path}', single file fmp4 feeds can't be appended to")
+
+    segment_format = "%03d.ts"
+    segment_filenames = os.path.join(hls_directory, f"%v_{segment_format}")
+    if segment_type == "fmp4":
+        segment_filenames = os.path.join(hls_directory, "stream_%v.m4s")
+    m3u8_steams_output = os.path.join(hls_directory, "output_stream_%v.m3u8")
+
+    if renditions is None:
+        renditions = []
+
+    if stream_copy and (len(renditions) > 0 or preview_output_path is not None or thumbnail_path_pattern is not None):
+        logger.warning("Renditions, preview image and thumbnails can't be generated while stream copying, skipping")
+        renditions = []
+        preview_output_path = None
+        thumbnail_path_pattern = None
+
+    include_preview = preview_output_path is not None and preview_frame is not None
+
+    if stream_copy:
+        threads = 1
+    elif threads is None:
+        threads = governor.ffmpeg_threads()
+
+    hls_filter_complex = None
+    hls_map = ["0:v"]
+    hls_var_stream_map = "v:0"
+
+    split_outputs = ["[v1out]"]
+    filters = []
+    for ii, rendition in enumerate(renditions, start=1):
+        split_outputs.append(f"[r{ii}]")
+        filters.append(f"[r{ii}]scale=-2:'min(ih,{rendition['height']})'[r{ii}out]")
+        hls_map.append(f"[r{ii}out]")
+
+    if len(renditions) > 0:
+        hls_map[0] = "[v1out]"
+        hls_var_stream_map = " ".join(f"v:{ii}" for ii in range(len(hls_map)))
+
+    if include_preview:
+        split_outputs.append("[pv]")
+        filters.append(f"[pv]select=eq(n\\,{preview_frame})[pvout]")
+        hls_map[0] = "[v1out]"
+
+    if thumbnail_path_pattern is not None:
+        columns, rows = thumbnail_tile
+        split_outputs.append("[tn]")
+        filters.append(f"[tn]fps=1/{thumbnail_interval},scale={thumbnail_width}:-2,tile={columns}x{rows}[tnout]")
+        hls_map[0] = "[v1out]"
+
+    if len(split_outputs) > 1:
+        hls_filter_complex = ";".join([f"[0:v]split={len(split_outputs)}{''.join(split_outputs)}"] + filters)
+
+    if video_bitrate is None and not stream_copy:
+        video_bitrate = bitrate(input_path, probe_cache=probe_cache)
+
+    hls_options = dict(
+        loglevel="warning",
+        preset="veryfast",
+        crf=29,
+        filter_complex=hls_filter_complex,
+        map=hls_map,
+        f="hls",
+        hls_time=hls_time,
+        hls_list_size=0,
+        hls_playlist_type="event",  # Allow appending to video
+        hls_segment_filename=segment_filenames,
+        var_stream_map=hls_var_stream_map,
+        r=10,
+        fps_mode="cfr",  # Duplicate frames to fill gaps left by clips shorter than their 10 second slot
+        force_key_frames=f"expr:gte(t,n_forced*{hls_time})",  # Cut every segment on a 10 second slot boundary
+        master_pl_name="output.m3u8",
+        threads=threads,
+    )
+    if stream_copy:
+        for option in ["preset", "crf", "r", "fps_mode", "force_key_frames", "threads"]:
+            del hls_options[option]
+        hls_options["c:v:0"] = "copy"
+    else:
+        hls_options["c:v:0"] = "libx264"
+        hls_options["b:v:0"] = f"{video_bitrate}"
 
-        # Remove None items from dict
-        hls_options = {k: v for k, v in hls_options.items() if v is not None}
+    for ii, rendition in enumerate(renditions, start=1):
+        hls_options[f"c:v:{ii}"] = "libx264"
+        hls_options[f"b:v:{ii}"] = rendition["bitrate"]
+        # Cap the rendition's peak bitrate so it stays playable on the connections it's meant for
+        hls_options[f"maxrate:v:{ii}"] = rendition["bitrate"]
+        hls_options[f"bufsize:v:{ii}"] = rendition["bitrate"]
 
-        hls_args = convert_kwargs_to_cmd_line_args(hls_options)
-        hls_args = ["ffmpeg", "-i", input_path] + hls_args
-        hls_args.append(m3u8_steams_output)
+    if segment_type == "fmp4":
+        hls_options["hls_segment_type"] = "fmp4"
+        hls_options["hls_flags"] = "single_file"
 
-        subprocess.run(hls_args)
-    else:
-        if append:
-            pass
-            # ffmpeg.input(input_path).output(streams_output, hls_flags="append_list", **hls_options).run()
-        else:
-            logger.info(f"hls video '{output_path}' already exists, and append mode set to 'False'")
+    if hls_exists:
+        # Continue the existing feed: new segments pick up where the existing segment numbering and timestamps left
+        # off and are appended to the existing media playlists. The master playlist doesn't change.
+        segment_count, duration = playlist_length(media_playlist_paths(hls_directory)[0])
+        logger.info(f"Appending to hls video '{output_path}' after {segment_count} segments ({duration} seconds)")
+
+        hls_options["hls_flags"] = "append_list"
+        hls_options["start_number"] = segment_count
+        hls_options["output_ts_offset"] = duration
+        del hls_options["master_pl_name"]
+
+    # Remove None items from dict
+    hls_options = {k: v for k, v in hls_options.items() if v is not None}
+
+    input_args = ["-i", input_path]
+    if input_format == "concat":
+        input_args = ["-f", "concat", "-safe", "0", "-i", f"file:{input_path}"]
+    elif input_format is not None:
+        input_args = ["-f", input_format, "-i", input_path]
+
+    hls_args = convert_kwargs_to_cmd_line_args(hls_options)
+    hls_args = ["ffmpeg", "-y"] + input_args + hls_args
+    hls_args.append(m3u8_steams_output)
+
+    if include_preview:
+        hls_args += [
+            "-map",
+            "[pvout]",
+            "-frames:v",
+            "1",
+            "-f",
+            "image2",
+            "-update",
+            "1",
+            "-pix_fmt",
+            "yuvj422p",
+            preview_output_path,
+        ]
+
+    if thumbnail_path_pattern is not None:
+        hls_args += [
+            "-map",
+            "[tnout]",
+            "-fps_mode",
+            "passthrough",
+            "-f",
+            "image2",
+            "-start_number",
+            f"{thumbnail_start_number}",
+            "-q:v",
+            "5",
+            thumbnail_path_pattern,
+        ]
+
+    ffmpeg_supervisor.run(hls_args, description=f"HLS {output_path}", threads=threads)
+    return True
 
 
-def generate_preview_image(input_path, output_path, rewrite=False):
+def generate_preview_image(input_path, output_path, rewrite=False, probe_cache=None):
     input_fps = 10
     preview_exists = os.path.exists(output_path)
 
@@ -244,15 +765,17 @@ def generate_preview_image(input_path, output_path, rewrite=False):
     if not preview_exists:
         ss = 0
         try:
-            frames = count_frames(input_path)
+            frames = count_frames(input_path, probe_cache=probe_cache)
             ss = round(frames / 2 / input_fps)
         except ValueError as e:
             logger.error(e)
 
         if ss > 0:
-            ffmpeg.input(input_path, ss=ss).output(
-                output_path, format="image2", update=1, vframes=1, pix_fmt="yuvj422p"
-            ).global_args("-loglevel", "warning").run()
+            ffmpeg_supervisor.run_stream(
+                ffmpeg.input(input_path, ss=ss)
+                .output(output_path, format="image2", update=1, vframes=1, pix_fmt="yuvj422p", threads=1)
+                .global_args("-loglevel", "warning")
+            )
         else:
             logger.warning(f"Could not generate preview image for '{input_path}', file appears empty or corrupted")
     else:
@@ -272,12 +795,53 @@ def create_technical_difficulties_clip(clip_path):
         clip = ffmpeg.input(input_path, loop=1, to=duration)
         # Added vframes to for 100 frames and prevent ffmpeg from adding an
         # additional 2 rogue frames
-        clip.output(clip_path, r=fps, format="mp4", pix_fmt="yuvj422p", vframes=100).global_args(
-            "-loglevel", "warning"
-        ).run()
+        ffmpeg_supervisor.run_stream(
+            clip.output(clip_path, r=fps, format="mp4", pix_fmt="yuvj422p", vframes=100, threads=1).global_args(
+                "-loglevel", "warning"
+            )
+        )
+
+
+def create_blank_hls_segment(clip_path, segment_path, hls_time=10, height=None):
+    """
+    Encode the technical difficulties clip as a standalone HLS segment. Playlists reference this one segment for every
+    slot of a long gap in a camera's video instead of encoding empty frames. If height is given the segment is scaled
+    to match a rendition of that height.
+    """
+    fps = 10
+    tmp_path = f"{segment_path}.tmp"
+    try:
+        video = ffmpeg.input(clip_path).video
+        if height is not None:
+            video = video.filter("scale", -2, f"min(ih,{height})")
+        ffmpeg_supervisor.run_stream(
+            video.output(
+                tmp_path,
+                format="mpegts",
+                vcodec="libx264",
+                preset="veryfast",
+                pix_fmt="yuv420p",
+                r=fps,
+                g=hls_time * fps,
+                vframes=hls_time * fps,
+                threads=1,
+            )
+            .global_args("-loglevel", "warning")
+            .overwrite_output()
+        )
+        os.replace(tmp_path, segment_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 
+def copy_technical_difficulties_clip(clip_path, output_path, rewrite=False, hls_segment_paths=None):
+    """
+    Make the technical difficulties clip available at output_path. If hls_segment_paths is given, the blank HLS
+    segments used to fill gaps in playlists are generated as well (once, unless rewrite is set).
 
-def copy_technical_difficulties_clip(clip_path, output_path, rewrite=False):
+    :param hls_segment_paths: Optional dict of rendition height (None for the source resolution) to segment path
+    """
     if not os.path.exists(clip_path):
         create_technical_difficulties_clip(clip_path)
 
@@ -287,6 +851,13 @@ def copy_technical_difficulties_clip(clip_path, output_path, rewrite=False):
         except shutil.SameFileError:
             pass
 
+    if hls_segment_paths is None:
+        hls_segment_paths = {}
+
+    for height, hls_segment_path in hls_segment_paths.items():
+        if rewrite or not os.path.exists(hls_segment_path):
+            create_blank_hls_segment(output_path, hls_segment_path, height=height)
+
 
 def pad_video(input_path, output_path, frames):
     """
@@ -313,9 +884,12 @@ def pad_video(input_path, output_path, frames):
             ffmpeg_input_path = tmp_path
 
         stop_duration = frames / 10
-        ffmpeg.input(ffmpeg_input_path).output(
-            output_path, filter_complex=f"tpad=stop_duration={stop_duration}:stop_mode=clone"
-        ).global_args("-loglevel", "warning").overwrite_output().run()
+        ffmpeg_supervisor.run_stream(
+            ffmpeg.input(ffmpeg_input_path)
+            .output(output_path, filter_complex=f"tpad=stop_duration={stop_duration}:stop_mode=clone", threads=1)
+            .global_args("-loglevel", "warning")
+            .overwrite_output()
+        )
     except ffmpeg._run.Error as e:
         logger.error(f"Failed padding {input_path} with {frames} additional frames")
         logger.error(e)
@@ -1,5 +1,6 @@
 from datetime import datetime
 import json
+import math
 import os
 
 import collections
@@ -28,6 +29,24 @@ def str_to_date(date_str):
     return date_time_parse(date_str).replace(tzinfo=pytz.UTC)
 
 
+def str_to_epoch_seconds(date_str):
+    """
+    Whole seconds since the epoch of an ISO 8601 timestamp (or datetime), timestamps without an offset are UTC. A single
+    fromisoformat call, only strings it can't parse fall back to str_to_date.
+    """
+    if isinstance(date_str, datetime):
+        return math.floor(date_str.timestamp())
+
+    try:
+        date = datetime.fromisoformat(date_str[:-1] + "+00:00" if date_str.endswith("Z") else date_str)
+    except ValueError:
+        date = str_to_date(date_str)
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=pytz.UTC)
+    return math.floor(date.timestamp())
+
+
 def date_to_day_format(day):
     return datetime.strptime(day, "%Y-%m-%d")
 
@@ -42,6 +61,31 @@ def create_dir(dir_path):
     os.makedirs(directory, exist_ok=True)
 
 
+def parse_rendition_ladder(ladder, default_bitrates=None):
+    """
+    Parse a rendition ladder like "1080:3000k,720:1500k,360" into a list of {"height": int, "bitrate": str} dicts,
+    tallest first. Renditions without a bitrate use the bitrate in default_bitrates for their height.
+    """
+    if default_bitrates is None:
+        default_bitrates = {}
+
+    renditions = []
+    for rendition in ladder.split(","):
+        rendition = rendition.strip()
+        if rendition == "":
+            continue
+
+        height, _, rendition_bitrate = rendition.partition(":")
+        height = int(height.strip().lower().rstrip("p"))
+        rendition_bitrate = rendition_bitrate.strip() or default_bitrates.get(height)
+        if rendition_bitrate is None:
+            raise ValueError(f"No bitrate given for {height}p rendition and no default bitrate for that height")
+
+        renditions.append({"height": height, "bitrate": rendition_bitrate})
+
+    return sorted(renditions, key=lambda r: r["height"], reverse=True)
+
+
 def format_frames(count):
     full = count // 10
     part = count % 10
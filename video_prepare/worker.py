@@ -0,0 +1,182 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+import os
+import re
+import signal
+import threading
+import traceback
+from typing import Optional
+
+from . import core
+from .governor import governor
+from .honeycomb_service import HoneycombClient
+from .job_queue import JobQueue
+from .log import logger
+from .stream_service import client as stream_service_client
+
+
+# Job params the worker decides, a job can't override them
+WORKER_PARAMS = [
+    "video_directory",
+    "raw_video_storage_directory",
+    "camera_workers",
+    "honeycomb_client",
+    "streaming_client",
+    "camera_executor",
+    "metrics_path",
+    "prometheus_textfile_path",
+]
+
+
+class PrepareWorker:
+    """
+    Long running prepare process that runs the jobs in a JobQueue.
+
+    Unlike a prepare run per k8s Job, the worker pays for imports, API tokens, Honeycomb/stream service clients and
+    camera pool processes once and reuses them for every job. Up to concurrent_jobs jobs run at the same time, all of
+    them share one pool of camera_workers camera processes so the container's CPU budget (see governor.ResourceGovernor)
+    holds however many jobs are running.
+    """
+
+    def __init__(
+        self,
+        job_queue: JobQueue,
+        video_directory: str,
+        raw_video_storage_directory: Optional[str] = None,
+        concurrent_jobs: int = 2,
+        camera_workers: Optional[int] = None,
+        poll_interval: float = 10,
+        job_defaults: Optional[dict] = None,
+        metrics_directory: Optional[str] = None,
+    ):
+        """
+        :param job_defaults: prepare options applied to every job that doesn't set them itself (i.e. clip cache
+                             settings)
+        """
+        if camera_workers is None:
+            camera_workers = governor.camera_workers()
+
+        self.job_queue = job_queue
+        self.video_directory = video_directory
+        self.raw_video_storage_directory = raw_video_storage_directory
+        self.concurrent_jobs = max(1, concurrent_jobs)
+        self.camera_workers = max(1, camera_workers)
+        self.poll_interval = poll_interval
+        self.job_defaults = job_defaults or {}
+        self.metrics_directory = metrics_directory
+
+        self.stop_event = threading.Event()
+        self.job_slots = threading.Semaphore(self.concurrent_jobs)
+
+        self.honeycomb_client = HoneycombClient()
+        self.streaming_client = stream_service_client.StreamServiceClient()
+
+        self.camera_executor_lock = threading.Lock()
+        self.camera_executor = self._create_camera_executor()
+
+    def stop(self, *_):
+        """
+        Stop claiming jobs, jobs already running are finished before run() returns
+        """
+        if not self.stop_event.is_set():
+            logger.info("Worker stopping, waiting for running jobs to finish...")
+        self.stop_event.set()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.job_queue.requeue_abandoned()
+        logger.info(
+            f"Worker started, running up to {self.concurrent_jobs} job(s) at once with {self.camera_workers} camera worker(s)"
+        )
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrent_jobs) as job_executor:
+                while not self.stop_event.is_set():
+                    # Only claim a job once there's a slot to run it in, so queued jobs stay claimable by other workers
+                    if not self.job_slots.acquire(timeout=1):
+                        continue
+
+                    job = self.job_queue.claim()
+                    if job is None:
+                        self.job_slots.release()
+                        self.stop_event.wait(self.poll_interval)
+                        continue
+
+                    job_executor.submit(self._run_job_in_slot, job)
+        finally:
+            self.camera_executor.shutdown()
+
+        logger.info("Worker stopped")
+
+    def _run_job_in_slot(self, job):
+        try:
+            self.run_job(job)
+        finally:
+            self.job_slots.release()
+
+    def run_job(self, job):
+        params = {**self.job_defaults, **job["params"]}
+        for param in WORKER_PARAMS:
+            params.pop(param, None)
+
+        logger.info(
+            f"Running job {job['id']} (attempt {job['attempts']}): '{params.get('environment_name')}' - '{params.get('video_name')}' {params.get('start')} (start) - {params.get('end')} (end)"
+        )
+        metrics_paths = {}
+        if self.metrics_directory is not None:
+            # A textfile collector can't have two files with the same series, each playset's latest run replaces its
+            # Prometheus file
+            playset = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{params.get('environment_name')}_{params.get('video_name')}")
+            metrics_paths = {
+                "metrics_path": os.path.join(self.metrics_directory, f"job-{job['id']}.json"),
+                "prometheus_textfile_path": os.path.join(self.metrics_directory, f"video_prepare_{playset}.prom"),
+            }
+
+        camera_executor = self._camera_executor()
+        try:
+            core.prepare_videos_for_environment_for_time_range(
+                video_directory=self.video_directory,
+                raw_video_storage_directory=self.raw_video_storage_directory,
+                camera_workers=self.camera_workers,
+                honeycomb_client=self.honeycomb_client,
+                streaming_client=self.streaming_client,
+                camera_executor=camera_executor,
+                **metrics_paths,
+                **params,
+            )
+        except BrokenProcessPool as e:
+            self._replace_camera_executor(camera_executor)
+            self.job_queue.fail(job["id"], f"Camera worker process died: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Exception running job {job['id']}")
+            logger.error(traceback.format_exc())
+            self.job_queue.fail(job["id"], f"{type(e).__name__}: {e}")
+            return
+
+        self.job_queue.complete(job["id"])
+        logger.info(f"Job {job['id']} complete")
+
+    def _create_camera_executor(self):
+        # Camera processes are started from a forkserver, forking the multithreaded worker directly isn't safe
+        return ProcessPoolExecutor(max_workers=self.camera_workers, mp_context=get_context("forkserver"))
+
+    def _camera_executor(self):
+        with self.camera_executor_lock:
+            return self.camera_executor
+
+    def _replace_camera_executor(self, broken_executor):
+        """
+        A camera process that dies (i.e. OOM killed) breaks the pool for every job using it, start a new pool
+        """
+        with self.camera_executor_lock:
+            if self.camera_executor is not broken_executor:
+                # Another job already replaced it
+                return
+            self.camera_executor = self._create_camera_executor()
+
+        broken_executor.shutdown(wait=False)
+        logger.warning("Camera worker pool was broken, replaced it")
@@ -2,7 +2,7 @@ import os
 from typing import Optional
 
 from cachetools.func import ttl_cache
-from sqlalchemy import create_engine, select, insert, delete, or_
+from sqlalchemy import create_engine, select, insert, delete, update, or_, text
 from sqlalchemy.orm import sessionmaker
 
 from .cacheable_check_requests import CacheableAuthRequest, cached_check_requests
@@ -14,6 +14,7 @@ from .models import (
     Playset,
     PlaysetListResponse,
     PlaysetResponse,
+    PlaysetUpdate,
     Video,
     VideoResponse,
 )
@@ -36,6 +37,10 @@ class Database:
     def _create_schema(self):
         schema.metadata.create_all(self.engine)
 
+        # create_all doesn't add columns to existing tables
+        with self.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE video ADD COLUMN IF NOT EXISTS thumbnails_url VARCHAR"))
+
     def _create_session_maker(self):
         return sessionmaker(autocommit=True, autoflush=False, bind=self.engine)
 
@@ -280,6 +285,26 @@ class Handle:
 
         return playsets_response
 
+    async def update_playset(self, playset_id, playset_update: PlaysetUpdate) -> Optional[PlaysetResponse]:
+        playset = await self.get_playset(playset_id)
+        if playset is None:
+            return None
+
+        if not await self.has_write_permission(playset.classroom_id):
+            raise PermissionException(f"User does not have write permission for classroom '{playset.classroom_id}'")
+
+        values = playset_update.dict(exclude_none=True)
+        if len(values) == 0:
+            return playset
+
+        response = self.db_session.execute(
+            update(schema.playsets_tbl)
+            .where(schema.playsets_tbl.c.id == playset_id)
+            .values(**values)
+            .returning(schema.playsets_tbl)
+        )
+        return PlaysetResponse(**dict(response.first()))
+
     async def delete_playset(self, playset_id) -> bool:
         playset = await self.get_playset(playset_id)
 
@@ -304,6 +329,7 @@ class Handle:
                 device_name=video.device_name,
                 preview_url=video.preview_url,
                 preview_thumbnail_url=video.preview_thumbnail_url,
+                thumbnails_url=video.thumbnails_url,
                 url=video.url,
             )
             .returning(schema.videos_tbl)
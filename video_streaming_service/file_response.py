@@ -0,0 +1,85 @@
+import mimetypes
+import os
+import re
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import FileResponse, StreamingResponse
+
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+CHUNK_SIZE = 64 * 1024
+
+mimetypes.add_type("video/iso.segment", ".m4s")
+
+
+def parse_range(range_header: str, file_size: int):
+    """
+    Parse a single range "Range: bytes=..." header
+
+    :return: tuple of the first and last byte (inclusive) or None if the header isn't a single byte range
+    """
+    match = RANGE_PATTERN.match(range_header.strip())
+    if match is None:
+        return None
+
+    start, end = match.groups()
+    if start == "" and end == "":
+        return None
+
+    if start == "":
+        # Suffix range, the last N bytes
+        first = max(0, file_size - int(end))
+        last = file_size - 1
+    else:
+        first = int(start)
+        last = file_size - 1 if end == "" else min(int(end), file_size - 1)
+
+    if first > last or first >= file_size:
+        raise HTTPException(
+            status_code=416, detail="range_not_satisfiable", headers={"Content-Range": f"bytes */{file_size}"}
+        )
+
+    return first, last
+
+
+def ranged_file_response(path, range_header: Optional[str] = None):
+    """
+    Serve a file, honoring single byte range requests. Players request fMP4 (CMAF) HLS segments as byte ranges of one
+    large file per rendition, so ranges are streamed from the file instead of returning the whole file.
+    """
+    if range_header is None:
+        return FileResponse(path, headers={"Accept-Ranges": "bytes"})
+
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="not_found")
+
+    file_size = os.path.getsize(path)
+    byte_range = parse_range(range_header, file_size)
+    if byte_range is None:
+        return FileResponse(path, headers={"Accept-Ranges": "bytes"})
+
+    first, last = byte_range
+
+    def _read_range():
+        with open(path, "rb") as fp:
+            fp.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                chunk = fp.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    media_type = mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+    return StreamingResponse(
+        _read_range(),
+        status_code=206,
+        media_type=media_type,
+        headers={
+            "Accept-Ranges": "bytes",
+            "Content-Range": f"bytes {first}-{last}/{file_size}",
+            "Content-Length": str(last - first + 1),
+        },
+    )
@@ -24,6 +24,7 @@ class Video(BaseModel):
     url: Optional[str]
     preview_url: Optional[str]
     preview_thumbnail_url: Optional[str]
+    thumbnails_url: Optional[str]
 
 
 class VideoResponse(BaseModel):
@@ -34,6 +35,7 @@ class VideoResponse(BaseModel):
     url: str
     preview_url: str
     preview_thumbnail_url: str
+    thumbnails_url: Optional[str]
 
 
 class Playset(BaseModel):
@@ -44,6 +46,12 @@ class Playset(BaseModel):
     end_time: datetime.datetime
 
 
+class PlaysetUpdate(BaseModel):
+    name: Optional[str]
+    start_time: Optional[datetime.datetime]
+    end_time: Optional[datetime.datetime]
+
+
 class PlaysetResponse(BaseModel):
     id: UUID = Field(default_factory=uuid4)
     classroom_id: UUID
@@ -3,13 +3,14 @@ import os
 from pathlib import Path
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response
 
 from wf_fastapi_auth0 import verify_token, get_subject_domain
 from wf_fastapi_auth0.wf_permissions import AuthRequest
 
 from .cacheable_check_requests import cached_check_requests, CacheableAuthRequest
+from .file_response import ranged_file_response
 from .models import (
     ClassroomListResponse,
     ClassroomResponse,
@@ -17,6 +18,7 @@ from .models import (
     PlaysetResponse,
     Classroom,
     Playset,
+    PlaysetUpdate,
     Video,
     VideoResponse,
 )
@@ -197,6 +199,29 @@ async def create_playset(
         raise HTTPException(status_code=401, detail="not_allowed") from e
 
 
+@router.patch(
+    "/videos/playsets/{playset_id}",
+    dependencies=[Depends(verify_token), Depends(can_write)],
+    response_model=PlaysetResponse,
+)
+async def update_playset(
+    playset_id: str,
+    playset_update: PlaysetUpdate,
+    perm_subject_domain: tuple = Depends(get_subject_domain),
+    db_session=Depends(database.get_session),
+) -> PlaysetResponse:
+    try:
+        db = Handle(db_session=db_session, perm_subject=perm_subject_domain[0], perm_domain=perm_subject_domain[1])
+        result = await db.update_playset(playset_id, playset_update)
+        if result is None:
+            raise HTTPException(status_code=404, detail="not_found")
+
+        return result
+    except PermissionException as e:
+        logging.error(e)
+        raise HTTPException(status_code=401, detail="not_allowed") from e
+
+
 @router.delete(
     "/videos/playsets/{playset_id}", dependencies=[Depends(verify_token), Depends(can_delete)], response_model=None
 )
@@ -236,8 +261,12 @@ async def create_video(
 
 @router.get("/videos/{classroom_id}/{playest_name}/{filename}", dependencies=[Depends(verify_token), Depends(can_read)])
 async def videos_root(
-    classroom_id: str, playest_name: str, filename: str, perm_subject_domain: tuple = Depends(get_subject_domain)
-) -> FileResponse:
+    classroom_id: str,
+    playest_name: str,
+    filename: str,
+    perm_subject_domain: tuple = Depends(get_subject_domain),
+    range_header: Optional[str] = Header(None, alias="Range"),
+) -> Response:
     resp = await cached_check_requests(
         tuple(
             [
@@ -251,7 +280,7 @@ async def videos_root(
         raise HTTPException(status_code=401, detail="not_allowed")
 
     path = f"{STATIC_PATH}/{classroom_id}/{playest_name}/{filename}"
-    return FileResponse(Path(path).resolve())
+    return ranged_file_response(Path(path).resolve(), range_header=range_header)
 
 
 @router.get(
@@ -264,7 +293,8 @@ async def videos(
     camera_name: str,
     filename: str,
     perm_subject_domain: tuple = Depends(get_subject_domain),
-) -> FileResponse:
+    range_header: Optional[str] = Header(None, alias="Range"),
+) -> Response:
     resp = await cached_check_requests(
         tuple(
             [
@@ -278,4 +308,4 @@ async def videos(
         raise HTTPException(status_code=401, detail="not_allowed")
 
     path = f"{STATIC_PATH}/{classroom_id}/{playest_name}/{camera_name}/{filename}"
-    return FileResponse(Path(path).resolve())
+    return ranged_file_response(Path(path).resolve(), range_header=range_header)
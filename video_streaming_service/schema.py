@@ -32,5 +32,6 @@ videos_tbl = Table(
     Column("device_name", String(), nullable=True),
     Column("preview_url", String(), nullable=True),
     Column("preview_thumbnail_url", String(), nullable=True),
+    Column("thumbnails_url", String(), nullable=True),
     Column("url", String(), nullable=True),
 )